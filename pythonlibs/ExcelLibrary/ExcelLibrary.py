@@ -19,11 +19,13 @@ import os
 import natsort
 from operator import itemgetter
 from datetime import datetime, timedelta
-from xlrd import open_workbook, cellname, xldate_as_tuple, \
+from xlrd import cellname, xldate_as_tuple, \
     XL_CELL_NUMBER, XL_CELL_DATE, XL_CELL_TEXT, XL_CELL_BOOLEAN, \
     XL_CELL_ERROR, XL_CELL_BLANK, XL_CELL_EMPTY, error_text_from_code
 from xlwt import easyxf, Workbook
 from xlutils.copy import copy as copy
+from openpyxl import Workbook as XlsxWorkbook
+from cache import WorkbookCache
 from version import VERSION
 
 _version_ = VERSION
@@ -46,46 +48,69 @@ class ExcelLibrary:
 
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
     ROBOT_LIBRARY_VERSION = VERSION
+    DATE_FORMAT = 'd.M.yyyy'
 
-    def __init__(self):
+    def __init__(self, cacheSize=256):
+        """
+        Parsed workbooks are cached between `Open Excel` calls, so opening the same unchanged file again is instant.
+
+        Arguments:
+                |  Cache Size (default=256)  | The estimated memory in megabytes taken by the workbooks kept parsed, counted from the cells of their loaded sheets. Pass 0 to disable caching. |
+        Example:
+
+        | *Settings* | *Value*      | *Value* |
+        | Library    | ExcelLibrary | 1024    |
+
+        """
+        self._cache = WorkbookCache(int(cacheSize) * 1024 * 1024)
         self.wb = None
         self.tb = None
+        self.xw = None
+        self.xwFileName = None
+        self.xwSheets = {}
+        self.styles = {}
         self.sheetNum = None
         self.sheetNames = None
+        self.indexes = {}
         self.fileName = None
+        self.readOnly = False
         if os.name is "nt":
             self.tmpDir = "Temp"
         else:
             self.tmpDir = "tmp"
 
-    def open_excel(self, filename, useTempDir=False):
+    def open_excel(self, filename, useTempDir=False, readOnly=False):
         """
         Opens the Excel file from the path provided in the file name parameter.
         If the boolean useTempDir is set to true, depending on the operating system of the computer running the test the file will be opened in the Temp directory if the operating system is Windows or tmp directory if it is not.
+        If the boolean readOnly is set to true, cell formatting is not parsed and only the worksheets that are read from are kept in memory, which makes opening and reading big files considerably faster.
+        `.xlsx` files are always opened this way.
 
         Arguments:
                 |  File Name (string)                      | The file name string value that will be used to open the excel file to perform tests upon.                                  |
                 |  Use Temporary Directory (default=False) | The file will not open in a temporary directory by default. To activate and open the file in a temporary directory, pass 'True' in the variable. |
+                |  Read Only (default=False)               | The file is opened with cell formatting by default. To open the file for reading only, pass 'True' in the variable. |
         Example:
 
-        | *Keywords*           |  *Parameters*                                      |
-        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |
+        | *Keywords*           |  *Parameters*                                      |        |        |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |        |        |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  | False  | True   |
 
         """
         if useTempDir is True:
             print 'Opening file at %s' % filename
-            self.wb = open_workbook(os.path.join("/", self.tmpDir, filename), formatting_info=True, on_demand=True)
+            self._open_workbook(os.path.join("/", self.tmpDir, filename), readOnly)
         else:
-            self.wb = open_workbook(filename, formatting_info=True, on_demand=True)
+            self._open_workbook(filename, readOnly)
         self.fileName = filename
-        self.sheetNames = self.wb.sheet_names()
 
-    def open_excel_current_directory(self, filename):
+    def open_excel_current_directory(self, filename, readOnly=False):
         """
         Opens the Excel file from the current directory using the directory the test has been run from.
 
         Arguments:
-                |  File Name (string)  | The file name string value that will be used to open the excel file to perform tests upon.  |
+                |  File Name (string)         | The file name string value that will be used to open the excel file to perform tests upon.  |
+                |  Read Only (default=False)  | The file is opened with cell formatting by default. To open the file for reading only, pass 'True' in the variable. |
         Example:
 
         | *Keywords*           |  *Parameters*        |
@@ -94,9 +119,92 @@ class ExcelLibrary:
         """
         workdir = os.getcwd()
         print 'Opening file at %s' % filename
-        self.wb = open_workbook(os.path.join(workdir, filename), formatting_info=True, on_demand=True)
+        self._open_workbook(os.path.join(workdir, filename), readOnly)
+        self.fileName = filename
+
+    def _open_workbook(self, path, readOnly=False):
+        # xlrd can not read formatting of .xlsx files, so these are always opened read only.
+        self.readOnly = readOnly is True or path.lower().endswith('.xlsx')
+        entry = self._cache.open(path, not self.readOnly)
+        self.wb = entry.book
+        self.indexes = entry.indexes
+        self.tb = None
         self.sheetNames = self.wb.sheet_names()
 
+    def _get_sheet(self, sheetname):
+        my_sheet_index = self.sheetNames.index(sheetname)
+        if self.readOnly and self.wb.on_demand:
+            # Keep only the requested sheet in memory.
+            for sheet_index in range(self.wb.nsheets):
+                if sheet_index != my_sheet_index and self.wb.sheet_loaded(sheet_index):
+                    self.wb.unload_sheet(sheet_index)
+        return self.wb.sheet_by_index(my_sheet_index)
+
+    def _get_index(self, sheetname, column):
+        key = (sheetname, int(column))
+        index = self.indexes.get(key)
+        if index is None:
+            index = {}
+            sheet = self._get_sheet(sheetname)
+            for row_index, value in enumerate(sheet.col_values(int(column))):
+                index.setdefault(self._index_key(value), row_index)
+            self.indexes[key] = index
+        return index
+
+    def _get_row_index_by_key(self, sheetname, column, key):
+        index = self._get_index(sheetname, column)
+        try:
+            return index[self._index_key(key)]
+        except KeyError:
+            raise ValueError("Key '%s' was not found in column %s of sheet '%s'" % (key, column, sheetname))
+
+    @staticmethod
+    def _index_key(value):
+        # Numbers are read as floats, while keys usually come from Robot as strings.
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return unicode(value)
+
+    def _get_writable_book(self):
+        if not self.tb:
+            self.wb.sheets()
+            self.tb = copy(self.wb)
+        return self.tb
+
+    def _get_style(self, num_format_str=None):
+        style = self.styles.get(num_format_str)
+        if style is None:
+            if num_format_str:
+                style = easyxf('', num_format_str=num_format_str)
+            else:
+                style = easyxf('')
+            self.styles[num_format_str] = style
+        return style
+
+    def _write_value(self, sheet, column, row, value):
+        if isinstance(value, datetime):
+            sheet.write(int(row), int(column), value, self._get_style(self.DATE_FORMAT))
+        else:
+            sheet.write(int(row), int(column), value, self._get_style())
+
+    def _iter_rows(self, sheet, startRow=0, endRow=None):
+        if endRow is None or int(endRow) > sheet.nrows:
+            endRow = sheet.nrows
+        for row_index in xrange(int(startRow), int(endRow)):
+            yield sheet.row_values(row_index)
+
+    def clear_workbook_cache(self):
+        """
+        Releases all the parsed workbooks kept in memory. The currently opened workbook stays usable.
+
+        Example:
+
+        | *Keywords*              |  *Parameters*  |
+        | Clear Workbook Cache    |                |
+
+        """
+        self._cache.clear()
+
     def get_sheet_names(self):
         """
         Returns the names of all the worksheets in the current workbook.
@@ -138,7 +246,7 @@ class ExcelLibrary:
         | Get Column Count    |  TestSheet1                                        |
 
         """
-        sheet = self.wb.sheet_by_name(sheetname)
+        sheet = self._get_sheet(sheetname)
         return sheet.ncols
 
     def get_row_count(self, sheetname):
@@ -154,7 +262,7 @@ class ExcelLibrary:
         | Get Row Count       |  TestSheet1                                        |
 
         """
-        sheet = self.wb.sheet_by_name(sheetname)
+        sheet = self._get_sheet(sheetname)
         return sheet.nrows
 
     def get_column_values(self, sheetname, column, includeEmptyCells=True):
@@ -172,8 +280,7 @@ class ExcelLibrary:
         | Get Column Values    |  TestSheet1                                        | 0 |
 
         """
-        my_sheet_index = self.sheetNames.index(sheetname)
-        sheet = self.wb.sheet_by_index(my_sheet_index)
+        sheet = self._get_sheet(sheetname)
         data = {}
         for row_index in range(sheet.nrows):
             cell = cellname(row_index, int(column))
@@ -202,8 +309,7 @@ class ExcelLibrary:
         | Get Row Values       |  TestSheet1                                        | 0 |
 
         """
-        my_sheet_index = self.sheetNames.index(sheetname)
-        sheet = self.wb.sheet_by_index(my_sheet_index)
+        sheet = self._get_sheet(sheetname)
         data = {}
         for col_index in range(sheet.ncols):
             cell = cellname(int(row), col_index)
@@ -231,14 +337,11 @@ class ExcelLibrary:
         | Get Sheet Values     |  TestSheet1                                        |
 
         """
-        my_sheet_index = self.sheetNames.index(sheetname)
-        sheet = self.wb.sheet_by_index(my_sheet_index)
+        sheet = self._get_sheet(sheetname)
         data = {}
-        for row_index in range(sheet.nrows):
-            for col_index in range(sheet.ncols):
-                cell = cellname(row_index, col_index)
-                value = sheet.cell(row_index, col_index).value
-                data[cell] = value
+        for row_index, row_values in enumerate(self._iter_rows(sheet)):
+            for col_index, value in enumerate(row_values):
+                data[cellname(row_index, col_index)] = value
         if includeEmptyCells is True:
             sortedData = natsort.natsorted(data.items(), key=itemgetter(0))
             return sortedData
@@ -271,6 +374,100 @@ class ExcelLibrary:
             workbookData.append(sheetData)
         return workbookData
 
+    def get_sheet_rows(self, sheetname, startRow=0, endRow=None):
+        """
+        Returns the values from the sheet name specified as a list of rows, each row being a list of cell values.
+        Unlike `Get Sheet Values` no cell names are built and nothing is sorted, so big sheets can be read quickly
+        and, using the start and end rows, in chunks.
+
+        Arguments:
+                |  Sheet Name (string)        | The selected sheet that the rows will be returned from.                                   |
+                |  Start Row (default=0)      | The row integer value of the first row that will be returned.                             |
+                |  End Row (default=None)     | The row integer value the returned rows end before. All remaining rows are returned by default. |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |      |       |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |      |       |
+        | Get Sheet Rows       |  TestSheet1                                        |      |       |
+        | Get Sheet Rows       |  TestSheet1                                        | 100  | 200   |
+
+        """
+        sheet = self._get_sheet(sheetname)
+        return list(self._iter_rows(sheet, startRow, endRow))
+
+    def get_row_as_list(self, sheetname, row):
+        """
+        Returns the specific row values of the sheet name specified as a list of cell values.
+
+        Arguments:
+                |  Sheet Name (string)  | The selected sheet that the row values will be returned from.                      |
+                |  Row (int)            | The row integer value that will be used to select the row from which the values will be returned. |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |   |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |   |
+        | Get Row As List      |  TestSheet1                                        | 0 |
+
+        """
+        sheet = self._get_sheet(sheetname)
+        return sheet.row_values(int(row))
+
+    def create_column_index(self, sheetname, column):
+        """
+        Builds an index of the values of the column specified, so that rows can be looked up by a key from that column
+        with `Get Row By Key` and `Get Cell By Key` without scanning the sheet. The index is kept with the cached workbook,
+        so it is built only once per file. When a key occurs more than once the first row is used.
+        Lookups build the index themselves when it is missing, this keyword allows to build it upfront, e.g. in suite setup.
+
+        Arguments:
+                |  Sheet Name (string)  | The selected sheet that the index will be built for.           |
+                |  Column (int)         | The column integer value of the column containing the keys.    |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |   |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |   |
+        | Create Column Index  |  TestSheet1                                        | 0 |
+
+        """
+        self._get_index(sheetname, column)
+
+    def get_row_by_key(self, sheetname, column, key):
+        """
+        Returns the values of the row whose cell in the column specified contains the key, as a list of cell values.
+
+        Arguments:
+                |  Sheet Name (string)  | The selected sheet that the row will be returned from.         |
+                |  Column (int)         | The column integer value of the column containing the keys.    |
+                |  Key (string)         | The key of the row to be returned.                             |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |   |         |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |   |         |
+        | Get Row By Key       |  TestSheet1                                        | 0 | user1   |
+
+        """
+        row = self._get_row_index_by_key(sheetname, column, key)
+        return self._get_sheet(sheetname).row_values(row)
+
+    def get_cell_by_key(self, sheetname, keyColumn, key, column):
+        """
+        Returns the value of the cell in the column specified of the row whose cell in the key column contains the key.
+
+        Arguments:
+                |  Sheet Name (string)  | The selected sheet that the cell value will be returned from.  |
+                |  Key Column (int)     | The column integer value of the column containing the keys.    |
+                |  Key (string)         | The key of the row the cell value will be returned from.       |
+                |  Column (int)         | The column integer value the cell value will be returned from. |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |   |         |   |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |   |         |   |
+        | Get Cell By Key      |  TestSheet1                                        | 0 | user1   | 2 |
+
+        """
+        row = self._get_row_index_by_key(sheetname, keyColumn, key)
+        return self._get_sheet(sheetname).cell(row, int(column)).value
+
     def read_cell_data_by_name(self, sheetname, cell_name):
         """
         Uses the cell name to return the data from that cell.
@@ -285,8 +482,7 @@ class ExcelLibrary:
         | Get Cell Data        |  TestSheet1                                        |  A2  |
 
         """
-        my_sheet_index = self.sheetNames.index(sheetname)
-        sheet = self.wb.sheet_by_index(my_sheet_index)
+        sheet = self._get_sheet(sheetname)
         for row_index in range(sheet.nrows):
             for col_index in range(sheet.ncols):
                 cell = cellname(row_index, col_index)
@@ -309,8 +505,7 @@ class ExcelLibrary:
         | Read Cell      |  TestSheet1                                        | 0 | 0 |
 
         """
-        my_sheet_index = self.sheetNames.index(sheetname)
-        sheet = self.wb.sheet_by_index(my_sheet_index)
+        sheet = self._get_sheet(sheetname)
         cellValue = sheet.cell(int(row), int(column)).value
         return cellValue
 
@@ -329,9 +524,8 @@ class ExcelLibrary:
         | Check Cell Type      |  TestSheet1                                        | 0 | 0 |
 
         """
-        my_sheet_index = self.sheetNames.index(sheetname)
-        sheet = self.wb.sheet_by_index(my_sheet_index)
-        cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+        sheet = self._get_sheet(sheetname)
+        cell = sheet.cell(int(row), int(column))
         if cell.ctype is XL_CELL_NUMBER:
             print "The cell value is a number"
         elif cell.ctype is XL_CELL_TEXT:
@@ -367,13 +561,11 @@ class ExcelLibrary:
         """
         if self.wb:
             my_sheet_index = self.sheetNames.index(sheetname)
-            cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+            cell = self.wb.sheet_by_index(my_sheet_index).cell(int(row), int(column))
             if cell.ctype is XL_CELL_NUMBER:
-                self.wb.sheets()
-                if not self.tb:
-                    self.tb = copy(self.wb)
+                self._get_writable_book()
         if self.tb:
-            plain = easyxf('')
+            plain = self._get_style()
             self.tb.get_sheet(my_sheet_index).write(int(row), int(column), float(value), plain)
 
     def put_string_to_cell(self, sheetname, column, row, value):
@@ -394,13 +586,11 @@ class ExcelLibrary:
         """
         if self.wb:
             my_sheet_index = self.sheetNames.index(sheetname)
-            cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+            cell = self.wb.sheet_by_index(my_sheet_index).cell(int(row), int(column))
             if cell.ctype is XL_CELL_TEXT:
-                self.wb.sheets()
-                if not self.tb:
-                    self.tb = copy(self.wb)
+                self._get_writable_book()
         if self.tb:
-            plain = easyxf('')
+            plain = self._get_style()
             self.tb.get_sheet(my_sheet_index).write(int(row), int(column), value, plain)
 
     def put_date_to_cell(self, sheetname, column, row, value):
@@ -421,18 +611,16 @@ class ExcelLibrary:
         """
         if self.wb:
             my_sheet_index = self.sheetNames.index(sheetname)
-            cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+            cell = self.wb.sheet_by_index(my_sheet_index).cell(int(row), int(column))
             if cell.ctype is XL_CELL_DATE:
-                self.wb.sheets()
-                if not self.tb:
-                    self.tb = copy(self.wb)
+                self._get_writable_book()
         if self.tb:
             print(value)
             dt = value.split('.')
             dti = [int(dt[2]), int(dt[1]), int(dt[0])]
             print(dt, dti)
             ymd = datetime(*dti)
-            plain = easyxf('', num_format_str='d.M.yyyy')
+            plain = self._get_style(self.DATE_FORMAT)
             self.tb.get_sheet(my_sheet_index).write(int(row), int(column), ymd, plain)
 
     def modify_cell_with(self, sheetname, column, row, op, val):
@@ -453,13 +641,11 @@ class ExcelLibrary:
 
         """
         my_sheet_index = self.sheetNames.index(sheetname)
-        cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+        cell = self.wb.sheet_by_index(my_sheet_index).cell(int(row), int(column))
         curval = cell.value
         if cell.ctype is XL_CELL_NUMBER:
-            self.wb.sheets()
-            if not self.tb:
-                self.tb = copy(self.wb)
-            plain = easyxf('')
+            self._get_writable_book()
+            plain = self._get_style()
             modexpr = str(curval) + op + val
             self.tb.get_sheet(my_sheet_index).write(int(row), int(column), eval(modexpr), plain)
 
@@ -480,14 +666,12 @@ class ExcelLibrary:
 
         """
         my_sheet_index = self.sheetNames.index(sheetname)
-        cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+        cell = self.wb.sheet_by_index(my_sheet_index).cell(int(row), int(column))
         if cell.ctype is XL_CELL_DATE:
-            self.wb.sheets()
-            if not self.tb:
-                self.tb = copy(self.wb)
+            self._get_writable_book()
             curval = datetime(*xldate_as_tuple(cell.value, self.wb.datemode))
             newval = curval + timedelta(int(numdays))
-            plain = easyxf('', num_format_str='d.M.yyyy')
+            plain = self._get_style(self.DATE_FORMAT)
             self.tb.get_sheet(my_sheet_index).write(int(row), int(column), newval, plain)
 
     def subtract_from_date(self, sheetname, column, row, numdays):
@@ -507,16 +691,62 @@ class ExcelLibrary:
 
         """
         my_sheet_index = self.sheetNames.index(sheetname)
-        cell = self.wb.get_sheet(my_sheet_index).cell(int(row), int(column))
+        cell = self.wb.sheet_by_index(my_sheet_index).cell(int(row), int(column))
         if cell.ctype is XL_CELL_DATE:
-            self.wb.sheets()
-            if not self.tb:
-                self.tb = copy(self.wb)
+            self._get_writable_book()
             curval = datetime(*xldate_as_tuple(cell.value, self.wb.datemode))
             newval = curval - timedelta(int(numdays))
-            plain = easyxf('', num_format_str='d.M.yyyy')
+            plain = self._get_style(self.DATE_FORMAT)
             self.tb.get_sheet(my_sheet_index).write(int(row), int(column), newval, plain)
 
+    def put_values_to_cells(self, cells):
+        """
+        Writes many cell values at once. Each item of the list is a list of the sheet name, column, row and value of a cell.
+        Values are written as they are, dates given as datetime objects are formatted as dates.
+        The writable copy of the opened workbook and the cell styles are shared between all the cells,
+        which makes this much faster than writing the cells one by one.
+
+        Arguments:
+                |  Cells (list)  | The list of cells, each cell being a list of sheet name, column, row and value. |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |
+        | ${cell1}=            |  Create List    | TestSheet1  | 0  | 0  | 34     |
+        | ${cell2}=            |  Create List    | TestSheet1  | 1  | 0  | Hello  |
+        | ${cells}=            |  Create List    | ${cell1}    | ${cell2}         |
+        | Put Values To Cells  |  ${cells}                                          |
+
+        """
+        book = self._get_writable_book()
+        sheets = {}
+        for sheetname, column, row, value in cells:
+            if sheetname not in sheets:
+                sheets[sheetname] = book.get_sheet(sheetname)
+            self._write_value(sheets[sheetname], column, row, value)
+
+    def put_rows_to_sheet(self, sheetname, rows, startColumn=0, startRow=0):
+        """
+        Writes a block of values to the sheet name specified. Each item of the list is a list of the values of one row.
+
+        Arguments:
+                |  Sheet Name (string)       | The selected sheet that the cells will be modified from.              |
+                |  Rows (list)               | The list of rows, each row being a list of the values to be written.  |
+                |  Start Column (default=0)  | The column integer value of the top left cell of the block.           |
+                |  Start Row (default=0)     | The row integer value of the top left cell of the block.              |
+        Example:
+
+        | *Keywords*           |  *Parameters*                                      |     |     |
+        | Open Excel           |  C:\\Python27\\ExcelRobotTest\\ExcelRobotTest.xls  |     |     |
+        | Put Rows To Sheet    |  TestSheet1                                        | ${rows} | 0 | 1 |
+
+        """
+        sheet = self._get_writable_book().get_sheet(sheetname)
+        for row_offset, values in enumerate(rows):
+            row = int(startRow) + row_offset
+            for col_offset, value in enumerate(values):
+                self._write_value(sheet, int(startColumn) + col_offset, row, value)
+
     def save_excel(self, filename, useTempDir=False):
         """
         Saves the Excel file indicated by file name, the useTempDir can be set to true if the user needs the file saved in the temporary directory.
@@ -568,8 +798,7 @@ class ExcelLibrary:
         | Add New Sheet        |  NewSheet                                          |
 
         """
-        self.tb = copy(self.wb)
-        self.tb.add_sheet(newsheetname)
+        self._get_writable_book().add_sheet(newsheetname)
 
     def create_excel_workbook(self, newsheetname):
         """
@@ -586,3 +815,58 @@ class ExcelLibrary:
         """
         self.tb = Workbook()
         self.tb.add_sheet(newsheetname)
+
+    def open_xlsx_writer(self, filename):
+        """
+        Starts writing a new `.xlsx` file. Rows are streamed to disk as they are appended, so memory usage stays
+        low however big the file gets. The file is complete once `Close Xlsx Writer` is called.
+
+        Arguments:
+                |  File Name (string)  | The name of the file to be written.  |
+        Example:
+
+        | *Keywords*           |  *Parameters*      |
+        | Open Xlsx Writer     |  Results.xlsx      |
+
+        """
+        self.xw = XlsxWorkbook(write_only=True)
+        self.xwFileName = filename
+        self.xwSheets = {}
+
+    def append_rows_to_xlsx(self, sheetname, rows):
+        """
+        Appends rows to the sheet name specified of the `.xlsx` file being written. The sheet is created on first use.
+
+        Arguments:
+                |  Sheet Name (string)  | The sheet the rows will be appended to.                              |
+                |  Rows (list)          | The list of rows, each row being a list of the values to be written. |
+        Example:
+
+        | *Keywords*           |  *Parameters*      |          |
+        | Open Xlsx Writer     |  Results.xlsx      |          |
+        | Append Rows To Xlsx  |  Results           | ${rows}  |
+        | Close Xlsx Writer    |                    |          |
+
+        """
+        if sheetname not in self.xwSheets:
+            self.xwSheets[sheetname] = self.xw.create_sheet(sheetname)
+        sheet = self.xwSheets[sheetname]
+        for values in rows:
+            sheet.append(values)
+
+    def close_xlsx_writer(self):
+        """
+        Saves the `.xlsx` file being written.
+
+        Example:
+
+        | *Keywords*           |  *Parameters*      |
+        | Close Xlsx Writer    |                    |
+
+        """
+        try:
+            self.xw.save(self.xwFileName)
+        finally:
+            self.xw = None
+            self.xwFileName = None
+            self.xwSheets = {}
@@ -0,0 +1,88 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from xlrd import open_workbook
+
+# Rough memory taken by one parsed cell: value, type and format index kept by xlrd in separate lists.
+_CELL_SIZE = 100
+
+
+class _CachedWorkbook(object):
+
+    def __init__(self, book, mtime, size):
+        self.book = book
+        self.mtime = mtime
+        self.size = size
+        self.indexes = {}
+        self.memory = size
+
+    def estimate_memory(self):
+        # Sheets of on-demand books are parsed when first used, so the estimate grows with them.
+        cells = 0
+        for sheet_index in range(self.book.nsheets):
+            if self.book.sheet_loaded(sheet_index):
+                sheet = self.book.sheet_by_index(sheet_index)
+                cells += sheet.nrows * sheet.ncols
+        self.memory = self.size + cells * _CELL_SIZE
+        return self.memory
+
+
+class WorkbookCache(object):
+    """
+    Keeps parsed xlrd workbooks between `Open Excel` calls.
+
+    Workbooks are keyed by absolute path and whether formatting was parsed. A cached workbook is reused
+    only while the file keeps the same modification time and size, otherwise it is parsed again.
+    Column indexes built on a workbook are kept with it and dropped together with it.
+    The file is read into memory and parsed from there, so cached workbooks do not keep it open and it can be
+    saved over or deleted, also on Windows.
+    Least recently used workbooks are released once the estimated memory of the parsed workbooks exceeds
+    `max_size` bytes. Memory of a workbook is estimated from the size of its file and the cells of its loaded
+    sheets, and it is re-estimated on every `open` as sheets are loaded lazily.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._total_memory = 0
+        self._lock = Lock()
+
+    def open(self, path, formatting_info):
+        key = (os.path.abspath(path), formatting_info)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total_memory -= entry.memory
+                if entry.mtime != stat.st_mtime or entry.size != stat.st_size:
+                    entry.book.release_resources()
+                    entry = None
+            if entry is None:
+                # On-demand book opened by path keeps the file mapped until it is released
+                with open(path, 'rb') as f:
+                    contents = f.read()
+                book = open_workbook(file_contents=contents, formatting_info=formatting_info, on_demand=True)
+                entry = _CachedWorkbook(book, stat.st_mtime, len(contents))
+            if entry.size <= self.max_size:
+                self._entries[key] = entry
+                self._total_memory += entry.memory
+                self._evict()
+            return entry
+
+    def clear(self):
+        # Books are not released here as one of them may still be in use by the library.
+        with self._lock:
+            self._entries.clear()
+            self._total_memory = 0
+
+    def _evict(self):
+        # Estimates of cached books are refreshed first, their sheets may have been loaded since they were opened
+        self._total_memory = sum(entry.estimate_memory() for entry in self._entries.values())
+        while self._total_memory > self.max_size and len(self._entries) > 1:
+            self._release_oldest()
+
+    def _release_oldest(self):
+        _, entry = self._entries.popitem(last=False)
+        self._total_memory -= entry.memory
+        entry.book.release_resources()
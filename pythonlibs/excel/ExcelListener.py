@@ -1,28 +1,58 @@
 import os
+import json
+import logging
 import openpyxl
 from robot.libraries.BuiltIn import BuiltIn
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles.fills import PatternFill
 
+logger = logging.getLogger(__name__)
+
+HEADER = ['Scenario', 'Expected', 'Status', 'Message']
+HEADER_COLOR = 'C6EFCE'
+FAIL_COLOR = '00FFC7CE'
+
+
 class ExcelListener(object):
+    '''
+    Writes test steps of each suite into `${OUTPUT_DIR}/excel/${SUITE_NAME}.xlsx`, one sheet per test.
+
+    Steps of finished tests are appended to a journal file next to the workbook and flushed, so nothing but the
+    current test is kept in memory and results survive a crash. The workbook is streamed from the journal
+    when the suite ends, see `write_workbook`. By default the workbook is overwritten. To merge the sheets into
+    the existing workbook instead, replacing sheets with the same names, pass `merge` argument:
+
+    --listener ExcelListener:True
+    '''
 
     ROBOT_LISTENER_API_VERSION = 2
 
     _builtin = BuiltIn()
 
-    def __init__(self):
-        self._workbook = None
+    def __init__(self, merge=False):
+        self._merge = str(merge).lower() == 'true'
+        self._journal = None
+        self._output_path = None
+        self._variables = {}
         self._keyword_message = ''
         self._level = 0
         self._test_steps = {}
         self._current_test_name = ''
         self._current_suite_name = ''
 
-    @property
-    def _robot_vars(self):
+    def _get_variable(self, name, default=None, cached=False):
         '''
-        Gets robot variables.
+        Gets single robot variable value. Cached values are kept until `_invalidate_variables` is called.
         '''
-        return self._builtin.get_variables()
+        if cached and name in self._variables:
+            return self._variables[name]
+        value = self._builtin.get_variable_value(name, default)
+        if cached:
+            self._variables[name] = value
+        return value
+
+    def _invalidate_variables(self):
+        self._variables = {}
 
     def __add_step(self, name, attrs):
         if (attrs['type'] in ('Suite Setup', 'Suite Teardown', 'Test Setup', 'Test Teardown', 'Keyword') and self._level == 1) or \
@@ -33,8 +63,8 @@ class ExcelListener(object):
                 key = attrs['type']
 
             if attrs['type'] == 'Test Foritem':
-                longname = self._robot_vars.get('${' + self._current_test_name + '_SCENARIO_NAME}')
-                expected = self._robot_vars.get('${' + self._current_test_name + '_EXPECTED_RESULT}')
+                longname = self._get_variable('${' + self._current_test_name + '_SCENARIO_NAME}')
+                expected = self._get_variable('${' + self._current_test_name + '_EXPECTED_RESULT}')
             else:
                 longname = name
                 expected = 'PASS'
@@ -50,7 +80,7 @@ class ExcelListener(object):
                 'params': ', '.join(attrs['args']),
                 'status': attrs['status'],
                 'message': self._keyword_message,
-                'tags': self._robot_vars.get('@{TEST_TAGS}', []),
+                'tags': self._get_variable('@{TEST_TAGS}', [], cached=True),
                 'doc': attrs['doc'],
             }
             # If we are on Suite Setup stage, there is no self._test_steps[key] is defined yet.
@@ -60,69 +90,130 @@ class ExcelListener(object):
         elif attrs['type'] == 'Test Teardown' and name == 'util.Report Status Message':
             # Save keyword status message for later use when process the for item
             # 'util.Report Status Message' keyword should be called from test template keyword teardown to enable this
-            self._keyword_message = self._robot_vars.get('${KEYWORD_MESSAGE}')
+            self._keyword_message = self._get_variable('${KEYWORD_MESSAGE}')
 
     def start_test(self, name, attrs):
+        self._invalidate_variables()
         self._current_test_name = name
-        if not self._workbook:
-            if os.path.exists(self.get_output_path()):
-                self._workbook = openpyxl.load_workbook(self.get_output_path(), data_only=True)
-            else:
-                self._workbook = openpyxl.Workbook()
-
-        if name in self._workbook:
-            self._workbook.remove_sheet(self._workbook[name])
-
-        self._workbook.create_sheet(0, name)
-        self._workbook.active.append(['Scenario', 'Expected', 'Status', 'Message'])
-        self.set_last_row_color('C6EFCE')
+        if not self._journal:
+            self._output_path = self.get_output_path()
+            self._journal = open(self._output_path + '.journal', 'w')
 
         self._test_steps[name] = []
 
     def end_test(self, name, attrs):
+        self._invalidate_variables()
         self._level = 0
         self._test_steps[name] = self._test_steps.pop('Test Setup', []) + self._test_steps[name]
         self._test_steps[name] = self._test_steps.get('Suite Setup', []) + self._test_steps[name]
         self._test_steps[name] += self._test_steps.pop('Test Teardown', [])
         self._test_steps[name] += self._test_steps.get('Suite Teardown', [])
         self._current_test_name = ''
-        for step in self._test_steps[name]:
-            self._workbook.active.append([step['longname'], step['expected'], step['status'], step['message']])
-            if step['status'] == 'FAIL':
-                self.set_last_row_color('00FFC7CE')
+        rows = [[step['longname'], step['expected'], step['status'], step['message']]
+                for step in self._test_steps.pop(name)]
+        self._journal.write(json.dumps({'name': name, 'rows': rows}) + '\n')
+        self._journal.flush()
 
     def start_keyword(self, name, attrs):
         self._level += 1
 
     def end_keyword(self, name, attrs):
+        if name.endswith(('Set Tags', 'Remove Tags')):
+            self._invalidate_variables()
         try:
             self.__add_step(name, attrs)
         finally:
             self._level -= 1
 
     def start_suite(self, name, attrs):
+        self._invalidate_variables()
         self._current_suite_name = name
 
     def end_suite(self, name, attrs):
         try:
-            if self._workbook:
-                self._workbook.save(self.get_output_path())
+            if self._journal:
+                self._journal.close()
+                journal_path = self._journal.name
+                if self._merge and os.path.exists(self._output_path):
+                    write_workbook(journal_path, journal_path + '.xlsx')
+                    merge_workbooks(journal_path + '.xlsx', self._output_path)
+                    os.remove(journal_path + '.xlsx')
+                else:
+                    write_workbook(journal_path, self._output_path)
+                os.remove(journal_path)
         finally:
             self._test_steps = {}
-            self._workbook = None
+            self._journal = None
+            self._output_path = None
             self._current_suite_name = ''
 
     def get_output_path(self):
-        output_dir = self._robot_vars.get('${OUTPUT_DIR}') + '/excel'
+        output_dir = self._get_variable('${OUTPUT_DIR}') + '/excel'
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        output_path = output_dir + '/' + self._robot_vars.get('${SUITE_NAME}') + '.xlsx'
+        output_path = output_dir + '/' + self._get_variable('${SUITE_NAME}') + '.xlsx'
         return output_path
 
-    def set_last_row_color(self, color):
-        max_row = self._workbook.active.max_row
-        fill = PatternFill(patternType='solid', fgColor=color)
-        self._workbook.active.row_dimensions[max_row].fill = fill
-        for cell in self._workbook.active.rows[max_row - 1]:
-            cell.fill = PatternFill(patternType='solid', fgColor=color)
+
+_FILLS = {}
+
+
+def _get_fill(color):
+    '''
+    Gets shared fill for specified color.
+    '''
+    if color not in _FILLS:
+        _FILLS[color] = PatternFill(patternType='solid', fgColor=color)
+    return _FILLS[color]
+
+
+def _styled_row(sheet, values, color=None):
+    cells = []
+    for value in values:
+        cell = WriteOnlyCell(sheet, value=value)
+        if color:
+            cell.fill = _get_fill(color)
+        cells.append(cell)
+    return cells
+
+
+def write_workbook(journal_path, output_path):
+    '''
+    Streams tests written to journal into workbook, newest test sheet first. Can be used to recover results
+    from journal left by interrupted execution.
+
+    :param journal_path: journal file path
+    :param output_path: workbook file path
+    '''
+    workbook = openpyxl.Workbook(write_only=True)
+    with open(journal_path) as journal:
+        for line in journal:
+            test = json.loads(line)
+            sheet = workbook.create_sheet(test['name'], 0)
+            sheet.append(_styled_row(sheet, HEADER, HEADER_COLOR))
+            for row in test['rows']:
+                sheet.append(_styled_row(sheet, row, FAIL_COLOR if row[2] == 'FAIL' else None))
+            sheet.close()
+    workbook.save(output_path)
+
+
+def merge_workbooks(source_path, target_path):
+    '''
+    Copies sheets of source workbook into target workbook, replacing sheets with the same names.
+
+    :param source_path: source workbook file path
+    :param target_path: target workbook file path
+    '''
+    source = openpyxl.load_workbook(source_path, read_only=True)
+    target = openpyxl.load_workbook(target_path, data_only=True)
+    for index, source_sheet in enumerate(source.worksheets):
+        if source_sheet.title in target.sheetnames:
+            target.remove(target[source_sheet.title])
+        sheet = target.create_sheet(source_sheet.title, index)
+        for row in source_sheet.rows:
+            sheet.append([cell.value for cell in row])
+            for cell, source_cell in zip(sheet[sheet.max_row], row):
+                if source_cell.fill.patternType:
+                    cell.fill = _get_fill(source_cell.fill.fgColor.rgb)
+    target.save(target_path)
@@ -1,11 +1,14 @@
 #!/usr/bin/env python2.7
 
-from proxy import RequestInterceptorPlugin, ResponseInterceptorPlugin, AsyncMitmProxy, ProxyHandler
+from proxy import Interceptor, AsyncMitmProxy, ProxyHandler
+import hashlib
 import re
 import os
 import sys
 import logging
+import threading
 import zlib
+from tempfile import gettempdir
 
 logger = logging.getLogger('download_interceptor_logger')
 formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
@@ -14,76 +17,182 @@ hdlr.setFormatter(formatter)
 logger.addHandler(hdlr)
 logger.setLevel(logging.INFO)
 
-download_dir = sys.argv[3]
-ff_profile_dir = sys.argv[4]
-profile_template_file = sys.argv[5]
 
+class _DeflateDecoder(object):
+    '''
+    Incremental decoder of "deflate" content encoding, which should be zlib stream, but some servers send raw
+    deflate data.
+    '''
 
-class DownloadInterceptor(RequestInterceptorPlugin, ResponseInterceptorPlugin):
-    def do_request(self, data):
-        return data
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._first = True
 
-    def do_response(self, data):
-        if "Content-Disposition: attachment" in data or "content-disposition: attachment" in data or "Content-disposition: attachment" in data:
+    def decompress(self, data):
+        if self._first:
+            self._first = False
             try:
-                logger.info("Attachment founded")
-                headers = dict(re.findall(r"(?P<name>.*?): (?P<value>.*?)\r\n", data))
-                logger.info(headers)
-                if headers.has_key('Content-Disposition'):
-                    content = repr(headers['Content-Disposition'])
-                elif headers.has_key('content-disposition'):
-                    content = repr(headers['content-disposition'])
-                elif headers.has_key('Content-disposition'):
-                    content = repr(headers['Content-disposition'])
-                else:
-                    logger.error("Content-Disposition header was not found")
-                    return 'Attachment was not downloaded, check Content-Disposition header'
-                filename = re.search('.*filename="(.*)"', content).group(1)
-                filename = filename.replace('/', '_')
-                logger.info("Attachment: " + content)
-                body = self.strip_http_headers(data)
-
-                filepath = download_dir + filename
-                if not os.path.exists(download_dir):
-                    os.makedirs(download_dir)
-
-                if 'Content-Encoding' in headers and headers['Content-Encoding'] == 'gzip':
-                    body = zlib.decompress(body, 16+zlib.MAX_WBITS)
-
-                file = open(filepath, "wb")
-                file.write(body)
-                file.close()
-                logger.info("Attachment was downloaded by path: " + filepath)
-                return 'Attachment was successfully downloaded by path: ' + filepath + '. You can close your browser'
-            except:
-                logger.error(sys.exc_info()[0])
-        return data
+                return self._decoder.decompress(data)
+            except zlib.error:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decoder.decompress(data)
 
-    def strip_http_headers(self, http_reply):
-        '''
-        helper function for getting content of response.
 
-        :param http_reply:
-        :return:
+def _decoder(encoding):
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _DeflateDecoder()
+    return None
+
+
+class Download(object):
+    '''
+    Attachment captured by `DownloadInterceptor`. `size` and `sha256` are of decoded content written to `path`,
+    `finished` is set once the download either completed or failed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.complete = False
+        self.finished = threading.Event()
+        self._hash = hashlib.sha256()
+        self._file = None
+        self._decoder = None
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        if self._decoder is not None:
+            data = self._decoder.decompress(data)
+        self._hash.update(data)
+        self.size += len(data)
+        self._file.write(data)
+
+
+class DownloadInterceptor(Interceptor):
+    '''
+    Saves attachments to `download_dir`, `downloads` directory in temp by default, and answers the browser
+    with a plain text message instead.
+
+    Body is written to disk chunk by chunk as it arrives, decoded on the fly if gzip or deflate encoded.
+    Finished downloads are collected in `downloads`, `finished` event is set after each of them.
+    '''
+
+    def __init__(self, download_dir=None):
+        self.download_dir = download_dir or os.path.join(gettempdir(), 'downloads')
+        self.downloads = []
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def match_response(self, response):
+        # Head of attachment without its body, e.g. response to HEAD request, is relayed as is
+        return response.has_body and \
+            (response.headers.get('Content-Disposition') or '').lower().startswith('attachment')
+
+    def on_response_head(self, response):
+        logger.info("Attachment founded")
+        content = response.headers['Content-Disposition']
+        logger.info("Attachment: " + content)
+        headers = response.headers
+        encoding = headers.get('Content-Encoding')
+        for name in ('Content-Disposition', 'Content-Encoding', 'Content-Type', 'Content-Length'):
+            del headers[name]
+        headers['Content-Type'] = 'text/plain'
+
+        match = re.search('filename="(.*?)"', content)
+        if match is None:
+            logger.error("Filename was not found in Content-Disposition header")
+            response.context['download'] = None
+            return
+        filepath = os.path.join(self.download_dir, match.group(1).replace('/', '_'))
+        download = Download(filepath)
+        response.context['download'] = download
+        try:
+            if not os.path.exists(self.download_dir):
+                os.makedirs(self.download_dir)
+            download._decoder = _decoder(encoding)
+            download._file = open(filepath + '.part', 'wb')
+        except:
+            logger.error(sys.exc_info()[1])
+
+    def on_response_chunk(self, response, chunk):
+        download = response.context['download']
+        if download is not None and download._file is not None:
+            try:
+                download.write(chunk)
+            except:
+                logger.error(sys.exc_info()[1])
+                self._discard(download)
+        return ''
+
+    def on_response_tail(self, response):
+        download = response.context['download']
+        if download is None:
+            return 'Attachment was not downloaded, check Content-Disposition header'
+        if download._file is None:
+            return 'Attachment was not downloaded to path: ' + download.path
+        try:
+            download._file.close()
+            download._file = None
+            if os.path.exists(download.path):
+                os.remove(download.path)
+            os.rename(download.path + '.part', download.path)
+        except:
+            logger.error(sys.exc_info()[1])
+            self._discard(download)
+            return 'Attachment was not downloaded to path: ' + download.path
+        download.complete = True
+        logger.info("Attachment was downloaded by path: %s (%d bytes, sha256 %s)"
+                    % (download.path, download.size, download.sha256))
+        return 'Attachment was successfully downloaded by path: ' + download.path + '. You can close your browser'
+
+    def on_response_end(self, response, complete):
+        download = response.context['download']
+        if download is None:
+            return
+        if download._file is not None:
+            logger.error("Attachment download was interrupted: " + download.path)
+            self._discard(download)
+        with self._lock:
+            self.downloads.append(download)
+        download.finished.set()
+        self.finished.set()
+
+    def wait(self, timeout=None):
+        '''
+        Waits until a download finishes and returns the last finished one, None on timeout.
+        Clear `finished` before triggering the download to wait for the new one.
         '''
-        p = http_reply.find('\r\n\r\n')
-        if p >= 0:
-            return http_reply[p+4:]
-        return http_reply
+        if not self.finished.wait(timeout):
+            return None
+        with self._lock:
+            return self.downloads[-1]
+
+    def _discard(self, download):
+        download._file.close()
+        download._file = None
+        os.remove(download.path + '.part')
+
 
 #function for generating temp firefox profile with specified proxy host and port
-def generate_firefox_profile(profile_template_path, host, port):
+def generate_firefox_profile(profile_template_path, host, port, profile_dir):
 
     '''
     Function for generating temp firefox profile with specified proxy host and port
     :param profile_template_path:
     :param host:
     :param port:
-    :return:
+    :param profile_dir: directory of generated profile
+    :return: path of generated prefs.js
     '''
-    profile_path = ff_profile_dir + 'prefs.js'
-    if not os.path.exists(ff_profile_dir):
-        os.makedirs(ff_profile_dir)
+    profile_path = os.path.join(profile_dir, 'prefs.js')
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
 
     if os.path.exists(profile_path):
         os.remove(profile_path)
@@ -94,28 +203,30 @@ def generate_firefox_profile(profile_template_path, host, port):
 
     for line in template:
         line = line.replace('${host}', host)
-        line = line.replace('${port}', port)
+        line = line.replace('${port}', str(port))
         profile.write(line)
 
 
     profile.close()
     template.close()
     logger.info("Firefox profile was generated: " + profile_path)
-    return
+    return profile_path
 
 
 if __name__ == '__main__':
-    proxy = AsyncMitmProxy()
+    # Standalone use, ProxyLibrary runs the proxy within Robot process instead:
+    # DownloadInterceptor.py <host> <port> <download_dir> <ff_profile_dir> <profile_template_file>
+    host, port, download_dir, ff_profile_dir, profile_template_file = sys.argv[1:6]
+    logger.info("Generating firefox profile")
+    generate_firefox_profile(profile_template_file, host, port, ff_profile_dir)
+    logger.info("Starting download interceptor")
+    proxy = AsyncMitmProxy(server_address=(host, int(port)), RequestHandlerClass=ProxyHandler, bind_and_activate=True, ca_file='ca.pem')
     try:
-        logger.info("Generating firefox profile")
-        generate_firefox_profile(profile_template_file, sys.argv[1], sys.argv[2])
-        logger.info("Starting download interceptor")
-        proxy.__init__(server_address=(sys.argv[1], int(sys.argv[2])), RequestHandlerClass=ProxyHandler, bind_and_activate=True, ca_file='ca.pem')
-        proxy.register_interceptor(DownloadInterceptor)
-        proxy.serve_forever()
+        proxy.register_interceptor(DownloadInterceptor(download_dir))
         logger.info("Download interceptor is started")
         logger.info("Temp download directory: " + download_dir)
         logger.info("Firefox profile location: " + ff_profile_dir)
+        proxy.serve_forever()
     except KeyboardInterrupt:
         proxy.server_close()
 
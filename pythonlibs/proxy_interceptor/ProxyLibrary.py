@@ -0,0 +1,255 @@
+"""
+Robot Framework keywords running intercepting proxy within the test process.
+
+The proxy is started in background thread on free port, interceptors are registered and removed while it runs,
+so tests neither launch separate proxy process nor wait for it.
+"""
+from collections import defaultdict
+from threading import Lock, Thread
+from time import time
+
+from robot.utils import Importer
+
+from proxy import Interceptor, AsyncMitmProxy
+from DownloadInterceptor import DownloadInterceptor, generate_firefox_profile
+from recorder import TrafficRecorder, recording_name, save_recording
+
+__all__ = [
+    'ProxyLibrary'
+]
+
+
+class _Stats(object):
+    '''
+    Counts responses relayed by the proxy, registered as its observer.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.responses = 0
+            self.incomplete = 0
+            self.bytes = 0
+            self.time = 0.0
+            self.statuses = defaultdict(int)
+            self.hosts = defaultdict(int)
+
+    def __call__(self, response, complete, size):
+        request = response.request
+        with self._lock:
+            self.responses += 1
+            self.incomplete += not complete
+            self.bytes += size
+            self.time += request.timings['complete'] - request.timings['start']
+            self.statuses[response.status] += 1
+            self.hosts['%s:%d' % (request.hostname, request.port)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'responses': self.responses,
+                'incomplete': self.incomplete,
+                'bytes': self.bytes,
+                'mean_time': round(self.time / self.responses, 4) if self.responses else 0.0,
+                'statuses': dict(self.statuses),
+                'hosts': dict(self.hosts),
+            }
+
+
+class ProxyLibrary(object):
+    """
+    Keywords starting intercepting proxy in background thread of the test process and controlling its interceptors.
+
+    Proxy listens on free port of `host` by default, `Start Proxy` returns the port browser should be configured
+    with. Starting it takes milliseconds, so it may be started by suite or test setup.
+
+    Arguments:
+            |  Host (default=127.0.0.1)   | Interface the proxy listens on. |
+            |  Port (default=0)           | Port of the proxy, 0 picks a free one. |
+            |  CA File (default=ca.pem)   | CA certificate signing certificates of HTTPS destinations, generated if missing. |
+    Example:
+
+    | *Settings*     | *Value*                        |
+    | Library        | proxy_interceptor.ProxyLibrary |
+    | Suite Setup    | Start Proxy                    |
+    | Suite Teardown | Stop Proxy                     |
+
+    | *Test Cases*     |                               |                               |          |
+    | Export Report    | Capture Downloads             | ${OUTPUT DIR}${/}downloads    |          |
+    |                  | Click Button                  | export                        |          |
+    |                  | ${path} =                     | Wait For Download             | 60       |
+    | Record Login     | Start Recording               |                               |          |
+    |                  | Click Button                  | login                         |          |
+    |                  | ${har} =                      | Stop Recording                |          |
+    """
+
+    ROBOT_LIBRARY_SCOPE = 'GLOBAL'
+
+    def __init__(self, host='127.0.0.1', port=0, ca_file='ca.pem'):
+        self._address = (host, int(port))
+        self._ca_file = ca_file
+        self._proxy = None
+        self._thread = None
+        self._stats = _Stats()
+        self._interceptors = {}
+        self._downloads = None
+        self._downloads_seen = 0
+        self._recorder = None
+        self._recording_name = None
+
+    def start_proxy(self):
+        """
+        Starts the proxy unless it is running already and returns its port. Registered interceptors are kept
+        between restarts.
+        """
+        if self._proxy is None:
+            proxy = AsyncMitmProxy(server_address=self._address, ca_file=self._ca_file)
+            proxy.daemon_threads = True
+            proxy.register_observer(self._stats)
+            for interceptor in self._interceptors.values():
+                proxy.register_interceptor(interceptor)
+            self._thread = Thread(target=proxy.serve_forever, name='ProxyLibrary')
+            self._thread.daemon = True
+            self._thread.start()
+            self._proxy = proxy
+        return self._proxy.server_address[1]
+
+    def stop_proxy(self):
+        """
+        Stops the proxy and closes its connections.
+        """
+        if self._proxy is not None:
+            proxy, self._proxy = self._proxy, None
+            proxy.shutdown()
+            proxy.server_close()
+            self._thread.join()
+
+    def get_proxy_address(self):
+        """
+        Returns `host:port` of running proxy.
+        """
+        return '%s:%d' % self._running().server_address
+
+    def register_interceptor(self, name, *args):
+        """
+        Registers interceptor to running and later started proxy and returns it.
+
+        `name` is importable name or path of `Interceptor` subclass, it is instantiated with `args`.
+        Interceptor registered under the same name before is replaced.
+
+        Example:
+        | Register Interceptor | proxy_interceptor.replay.ReplayInterceptor | ${CURDIR}${/}rules.json |
+        """
+        interceptor = Importer('interceptor').import_class_or_module(name, instantiate_with_args=args)
+        if not isinstance(interceptor, Interceptor):
+            raise TypeError('Expected Interceptor got %s instead' % type(interceptor).__name__)
+        self.unregister_interceptor(name)
+        self._interceptors[name] = interceptor
+        if self._proxy is not None:
+            self._proxy.register_interceptor(interceptor)
+        return interceptor
+
+    def unregister_interceptor(self, name):
+        """
+        Removes interceptor registered by `Register Interceptor` under `name`, unknown names are ignored.
+        """
+        interceptor = self._interceptors.pop(name, None)
+        if interceptor is not None and self._proxy is not None:
+            self._proxy.unregister_interceptor(interceptor)
+
+    def capture_downloads(self, download_dir=None):
+        """
+        Starts saving attachments passing the proxy to `download_dir`, browser gets plain text message instead.
+        Downloads directory in temp is used by default. Downloads captured before are forgotten.
+        """
+        self.unregister_interceptor('downloads')
+        self._downloads = DownloadInterceptor(download_dir)
+        self._downloads_seen = 0
+        self._interceptors['downloads'] = self._downloads
+        if self._proxy is not None:
+            self._proxy.register_interceptor(self._downloads)
+        return self._downloads.download_dir
+
+    def wait_for_download(self, timeout=30):
+        """
+        Waits until next attachment is downloaded and returns its path. Each download is returned once.
+
+        Fails if no download finishes within `timeout` seconds, or the download was not completed.
+        """
+        if self._downloads is None:
+            raise RuntimeError('Downloads are not captured, use Capture Downloads first')
+        downloads = self._downloads
+        deadline = time() + float(timeout)
+        while len(downloads.downloads) <= self._downloads_seen:
+            downloads.finished.clear()
+            # Download might finish before the event was cleared
+            if len(downloads.downloads) > self._downloads_seen:
+                break
+            remaining = deadline - time()
+            if remaining <= 0 or not downloads.finished.wait(remaining):
+                raise AssertionError('No download finished in %s seconds' % timeout)
+        download = downloads.downloads[self._downloads_seen]
+        self._downloads_seen += 1
+        if not download.complete:
+            raise AssertionError('Download of %s was not completed' % download.path)
+        print 'Downloaded %s (%d bytes, sha256 %s)' % (download.path, download.size, download.sha256)
+        return download.path
+
+    def get_downloads(self):
+        """
+        Returns list of captured downloads as dictionaries with `path`, `size`, `sha256` and `complete` keys.
+        """
+        if self._downloads is None:
+            return []
+        return [{'path': d.path, 'size': d.size, 'sha256': d.sha256, 'complete': d.complete}
+                for d in self._downloads.downloads]
+
+    def start_recording(self, name=None, max_entries=1000):
+        """
+        Starts recording traffic passing the proxy, recording is named by current test by default. Only the last
+        `max_entries` exchanges are kept. Recording started before is discarded.
+        """
+        self.unregister_interceptor('recording')
+        self._recorder = TrafficRecorder(int(max_entries))
+        self._recording_name = recording_name(name)
+        self._recorder.start()
+        self._interceptors['recording'] = self._recorder
+        if self._proxy is not None:
+            self._proxy.register_interceptor(self._recorder)
+
+    def stop_recording(self, output_dir=None):
+        """
+        Stops recording, writes it to `<output_dir>/<name>.har` with latency summary per host in
+        `<output_dir>/<name>.latency.txt` and returns path of the HAR file. Robot output directory is used by default.
+        """
+        if self._recorder is None:
+            raise RuntimeError('Traffic is not recorded, use Start Recording first')
+        recorder, self._recorder = self._recorder, None
+        self.unregister_interceptor('recording')
+        return save_recording(recorder, self._recording_name, output_dir)
+
+    def get_proxy_stats(self):
+        """
+        Returns dictionary with number of `responses`, `incomplete` ones, `bytes` of their bodies, `mean_time`
+        of exchanges in seconds, and numbers of responses by `statuses` and `hosts`.
+        """
+        return self._stats.snapshot()
+
+    def reset_proxy_stats(self):
+        self._stats.reset()
+
+    def generate_firefox_profile(self, template, profile_dir):
+        """
+        Generates Firefox `prefs.js` in `profile_dir` from `template` with host and port of running proxy,
+        returns path of the file.
+        """
+        host, port = self._running().server_address
+        return generate_firefox_profile(template, host, port, profile_dir)
+
+    def _running(self):
+        if self._proxy is None:
+            raise RuntimeError('Proxy is not started, use Start Proxy first')
+        return self._proxy
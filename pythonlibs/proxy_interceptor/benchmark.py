@@ -0,0 +1,174 @@
+#!/usr/bin/env python2.7
+"""
+Throughput benchmark of threaded `AsyncMitmProxy` against event loop `EventMitmProxy`.
+
+Both proxies and local destination server are started in this process, clients are threads keeping their
+connections to the proxy alive:
+
+|python benchmark.py [--connections 50] [--requests 200] [--size 16384] [--idle 0]
+
+`--idle` keep-alive connections are opened to the proxy before the clients start and are held open while they
+run. `--high-concurrency` holds 5000 of them, so the proxies are measured with thousands of open connections:
+
+|python benchmark.py --high-concurrency
+"""
+import argparse
+import threading
+try:
+    import resource
+except ImportError:
+    resource = None
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from httplib import HTTPConnection
+from os import path
+from SocketServer import ThreadingMixIn
+from tempfile import gettempdir
+from time import time
+
+from proxy import AsyncMitmProxy
+from event_proxy import EventMitmProxy
+
+
+class _DestinationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = ''
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Destination(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _start(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _client(proxy_address, url, requests, errors):
+    connection = HTTPConnection(*proxy_address)
+    for _ in range(requests):
+        try:
+            connection.request('GET', url)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except Exception, e:
+            errors.append(e)
+            connection.close()
+            connection = HTTPConnection(*proxy_address)
+    connection.close()
+
+
+def _raise_file_limit(count):
+    # Every held connection takes a descriptor of the client and one of the proxy
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 2 * count + 1024
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard),
+                                                    hard))
+
+
+def _open(proxy_address, url, count, held, errors):
+    for _ in range(count):
+        connection = HTTPConnection(*proxy_address)
+        try:
+            connection.request('GET', url)
+            connection.getresponse().read()
+        except Exception, e:
+            connection.close()
+            errors.append(e)
+            return
+        held.append(connection)
+
+
+def hold(proxy_address, url, count, openers=50):
+    '''
+    Opens `count` keep-alive connections to the proxy by `openers` threads, each connection sends one request and is
+    left open.
+
+    :return: list of open connections
+    '''
+    held, errors = [], []
+    threads = [threading.Thread(target=_open, args=(proxy_address, url, count // openers + (i < count % openers),
+                                                    held, errors))
+               for i in range(openers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        print 'Only %d of %d connections were opened: %s' % (len(held), count, errors[0])
+    return held
+
+
+def run(proxy, url, connections, requests, idle=0):
+    '''
+    Runs `connections` clients sending `requests` requests each through `proxy` while `idle` other connections to
+    it are held open.
+
+    :return: tuple of requests per second and number of failed requests
+    '''
+    held = hold(proxy.server_address, url, idle)
+    try:
+        return _run(proxy, url, connections, requests)
+    finally:
+        for connection in held:
+            connection.close()
+
+
+def _run(proxy, url, connections, requests):
+    errors = []
+    clients = [threading.Thread(target=_client, args=(proxy.server_address, url, requests, errors))
+               for _ in range(connections)]
+    started = time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time() - started
+    return connections * requests / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare throughput of threaded and event loop proxies.')
+    parser.add_argument('--connections', type=int, default=50, help='number of concurrent client connections')
+    parser.add_argument('--requests', type=int, default=200, help='number of requests per connection')
+    parser.add_argument('--size', type=int, default=16 * 1024, help='response body size in bytes')
+    parser.add_argument('--idle', type=int, default=0, help='number of keep-alive connections held open meanwhile')
+    parser.add_argument('--high-concurrency', action='store_true', help='hold 5000 connections open meanwhile')
+    args = parser.parse_args()
+    if args.high_concurrency:
+        args.idle = max(args.idle, 5000)
+    _raise_file_limit(args.idle + args.connections)
+
+    _DestinationHandler.body = 'x' * args.size
+    destination = _start(_Destination(('127.0.0.1', 0), _DestinationHandler))
+    url = 'http://127.0.0.1:%d/' % destination.server_address[1]
+    ca_file = path.join(gettempdir(), 'benchmark_ca.pem')
+
+    threaded = AsyncMitmProxy(server_address=('127.0.0.1', 0), ca_file=ca_file)
+    threaded.daemon_threads = True
+    event = EventMitmProxy(server_address=('127.0.0.1', 0), ca_file=ca_file)
+    for name, proxy in (('threaded', threaded), ('event loop', event)):
+        _start(proxy)
+        rate, failed = run(proxy, url, args.connections, args.requests, args.idle)
+        print '%-10s %8.1f requests/s, %d failed' % (name, rate, failed)
+        proxy.shutdown()
+        proxy.server_close()
+
+
+if __name__ == '__main__':
+    main()
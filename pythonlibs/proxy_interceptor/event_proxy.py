@@ -0,0 +1,676 @@
+"""
+Event loop engine of MitmProxy. All connections are served by single thread with non-blocking sockets driven by
+asyncore, so one process keeps thousands of concurrent connections without a thread per connection.
+
+Interceptor plugins and certificate authority are the same as of threaded `AsyncMitmProxy`:
+
+|proxy = EventMitmProxy(server_address=('', 9095), ca_file='ca.pem')
+|proxy.register_interceptor(DebugInterceptor)
+|proxy.serve_forever()
+
+Plugins get the client connection as `msg`, it has the same `command`, `path`, `headers`, `hostname`, `port` and
+`is_connect` attributes as `ProxyHandler` has. Plugins are called on the loop thread, so they should not block.
+Leaf certificates of new hosts and host names are still resolved synchronously.
+"""
+import asyncore
+import errno
+import socket
+import ssl
+from collections import deque
+from mimetools import Message
+from StringIO import StringIO
+from time import time
+from urlparse import urlparse, urlunparse, ParseResult
+
+from proxy import CertificateAuthority, MitmProxy, Request, Response, _Exchange, _IDEMPOTENT_METHODS
+
+__all__ = ['EventMitmProxy']
+
+_RECV_SIZE = 64 * 1024
+_MAX_HEAD_SIZE = 64 * 1024
+# Reading of upstream response is paused while this much is not sent to the client yet.
+_MAX_PENDING_OUTPUT = 1024 * 1024
+_WOULD_BLOCK = (errno.EWOULDBLOCK, errno.EAGAIN)
+# Destination certificates are not verified, like by threaded proxy
+_CLIENT_CONTEXT = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+
+
+class _Connection(asyncore.dispatcher):
+    '''
+    Non-blocking connection with output queue and optional TLS.
+    '''
+
+    def __init__(self, server, sock=None):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server = server
+        self.last_active = time()
+        self.handshaking = False
+        self.closed = False
+        self._want_write = False
+        self._output = deque()
+        self.pending_output = 0
+
+    def start_tls(self, context, server_side=False):
+        self.socket = context.wrap_socket(self.socket, server_side=server_side, do_handshake_on_connect=False)
+        self.handshaking = True
+        self._want_write = True
+
+    def send_data(self, data):
+        if data:
+            self._output.append(data)
+            self.pending_output += len(data)
+            self._flush()
+
+    def writable(self):
+        if self.handshaking:
+            return self._want_write
+        return self.connecting or bool(self._output)
+
+    def handle_read(self):
+        if self.handshaking:
+            self._handshake()
+            return
+        data = self._recv()
+        if data:
+            self.last_active = time()
+            self.handle_data(data)
+
+    def handle_write(self):
+        if self.handshaking:
+            self._handshake()
+        else:
+            self._flush()
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        self.closed = True
+        asyncore.dispatcher.close(self)
+
+    def expired(self, now, timeout):
+        return now - self.last_active > timeout
+
+    def handle_data(self, data):
+        pass
+
+    def handle_tls_ready(self):
+        self._flush()
+
+    def handle_flushed(self):
+        pass
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            self._want_write = False
+            return
+        except ssl.SSLWantWriteError:
+            self._want_write = True
+            return
+        except (ssl.SSLError, socket.error), e:
+            print 'TLS handshake failed: %s' % e
+            self.handle_close()
+            return
+        self.handshaking = False
+        self.handle_tls_ready()
+
+    def _recv(self):
+        try:
+            data = self.socket.recv(_RECV_SIZE)
+            # TLS layer keeps decrypted data select does not know about
+            while isinstance(self.socket, ssl.SSLSocket) and self.socket.pending():
+                data += self.socket.recv(self.socket.pending())
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return ''
+        except socket.error, e:
+            if e.args[0] in _WOULD_BLOCK:
+                return ''
+            self.handle_close()
+            return ''
+        if not data:
+            self.handle_close()
+        return data
+
+    def _flush(self):
+        if self.connecting or self.handshaking or self.closed:
+            return
+        while self._output:
+            data = self._output[0]
+            try:
+                sent = self.socket.send(data[:_RECV_SIZE])
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except socket.error, e:
+                if e.args[0] in _WOULD_BLOCK:
+                    return
+                self.handle_close()
+                return
+            self.last_active = time()
+            self.pending_output -= sent
+            if sent < len(data):
+                self._output[0] = data[sent:]
+                return
+            self._output.popleft()
+        self.handle_flushed()
+
+
+class _ResponseReader(object):
+    '''
+    Incremental parser of upstream response, passes head and de-chunked body of it to `upstream`.
+    '''
+
+    def __init__(self, upstream, command):
+        self.upstream = upstream
+        self.command = command
+        self.started = False
+        self.done = False
+        self.chunked = False
+        self.will_close = False
+        self._buffer = ''
+        self._state = 'head'
+        self._remaining = None
+
+    def feed(self, data):
+        self.started = True
+        self._buffer += data
+        # Client may go away while response is passed to it
+        while not self.done and self.upstream.client is not None and self._step():
+            pass
+
+    def eof(self):
+        if self.done:
+            return
+        # Body without length ends with the connection
+        self._finish(self._state == 'body' and self._remaining is None)
+
+    def _step(self):
+        if self._state == 'head':
+            end = self._buffer.find('\r\n\r\n')
+            if end < 0:
+                return False
+            head, self._buffer = self._buffer[:end + 2], self._buffer[end + 4:]
+            self._read_head(head)
+        elif self._state == 'body':
+            if not self._buffer:
+                return False
+            self._read_data('chunk-end' if self.chunked else None)
+        elif self._state == 'chunk-size':
+            end = self._buffer.find('\r\n')
+            if end < 0:
+                return False
+            size = int(self._buffer[:end].split(';')[0], 16)
+            self._buffer = self._buffer[end + 2:]
+            if size:
+                self._state, self._remaining = 'body', size
+            else:
+                self._state = 'trailer'
+        elif self._state == 'chunk-end':
+            if len(self._buffer) < 2:
+                return False
+            self._buffer = self._buffer[2:]
+            self._state = 'chunk-size'
+        elif self._state == 'trailer':
+            end = self._buffer.find('\r\n')
+            if end < 0:
+                return False
+            self._buffer = self._buffer[end + 2:]
+            if not end:
+                self._finish(True)
+        return True
+
+    def _read_head(self, head):
+        status_line, _, headers = head.partition('\r\n')
+        version, status, reason = (status_line.split(None, 2) + ['', ''])[:3]
+        status = int(status)
+        msg = Message(StringIO(headers + '\r\n'))
+        if 100 <= status < 200:
+            # Interim response, final one follows
+            self.upstream.client.send_data(head + '\r\n')
+            return
+        connection = msg.get('Connection', '').lower()
+        length = msg.get('Content-Length')
+        self.chunked = 'chunked' in msg.get('Transfer-Encoding', '').lower()
+        if self.command == 'HEAD' or status in (204, 304):
+            length = 0
+            self.chunked = False
+        elif self.chunked:
+            length = None
+        elif length is not None:
+            length = int(length)
+        self.will_close = ('close' in connection or version == 'HTTP/1.0' and 'keep-alive' not in connection or
+                           length is None and not self.chunked)
+        self.upstream.client.handle_response_head(status, reason, msg, self.chunked)
+        if self.upstream.client is None:
+            self.done = True
+        elif self.chunked:
+            self._state = 'chunk-size'
+        elif length == 0:
+            self._finish(True)
+        else:
+            self._state, self._remaining = 'body', length
+
+    def _read_data(self, next_state):
+        if self._remaining is None:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:self._remaining], self._buffer[self._remaining:]
+            self._remaining -= len(data)
+        self.upstream.client.handle_response_data(data)
+        if self.upstream.client is None:
+            self.done = True
+        elif self._remaining == 0:
+            if next_state:
+                self._state = next_state
+            else:
+                self._finish(True)
+
+    def _finish(self, complete):
+        self.done = True
+        self.upstream.response_done(complete, self.will_close or not complete)
+
+
+class _UpstreamConnection(_Connection):
+    '''
+    Connection to destination, kept by server between requests while it is alive.
+    '''
+
+    def __init__(self, server, key):
+        _Connection.__init__(self, server)
+        self.key = key
+        self.client = None
+        self.reused = False
+        self._request = None
+        self._reader = None
+        # Timings of the request being served, the first one also gets those of connecting
+        self.timings = {'connect_start': time()}
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(key[:2])
+        except socket.error:
+            self.close()
+            raise
+
+    def send_request(self, client, request, timings):
+        self.client = client
+        self._request = request
+        timings.update(self.timings)
+        self.timings = timings
+        self._reader = _ResponseReader(self, client.command)
+        self.send_data(request)
+
+    def readable(self):
+        # Idle connection is watched to notice it was closed by destination
+        return self.handshaking or self.client is None or self.client.pending_output < _MAX_PENDING_OUTPUT
+
+    def handle_connect(self):
+        self.timings['connect'] = time()
+        if self.key[2]:
+            self.start_tls(_CLIENT_CONTEXT)
+        else:
+            self._flush()
+
+    def handle_tls_ready(self):
+        self.timings['tls'] = time()
+        _Connection.handle_tls_ready(self)
+
+    def handle_flushed(self):
+        if self._reader is not None and 'sent' not in self.timings:
+            self.timings['sent'] = time()
+
+    def handle_data(self, data):
+        if self._reader is None:
+            # Nothing expected on idle connection
+            self.handle_close()
+            return
+        if 'first_byte' not in self.timings:
+            self.timings['first_byte'] = time()
+        self._reader.feed(data)
+
+    def handle_close(self):
+        self.close()
+        self.server.forget_upstream(self)
+        if self.client is None:
+            return
+        if self.reused and not self._reader.started:
+            # Idle connection was closed by destination meanwhile, retry on new one
+            client, self.client = self.client, None
+            client.retry_request(self._request)
+        elif not self._reader.started:
+            client, self.client = self.client, None
+            client.handle_upstream_error('Connection closed by destination')
+        else:
+            self._reader.eof()
+
+    def handle_error(self):
+        if self.client is not None and (self._reader is None or not self._reader.started):
+            client, self.client = self.client, None
+            client.handle_upstream_error(str(asyncore.compact_traceback()[2]))
+        self.handle_close()
+
+    def response_done(self, complete, will_close):
+        client, self.client = self.client, None
+        self._reader = self._request = None
+        self.timings = {}
+        if will_close or self.closed:
+            self.close()
+        else:
+            self.server.release_upstream(self)
+        if client is not None:
+            client.handle_response_end(complete, will_close)
+
+
+class _ClientConnection(_Connection):
+    '''
+    Connection of proxy client, requests of it are served one by one.
+    '''
+
+    def __init__(self, server, sock, client_address):
+        _Connection.__init__(self, server, sock)
+        self.client_address = client_address
+        self.is_connect = False
+        self.hostname = self.port = None
+        self.command = self.path = self.request_version = self.headers = None
+        self.close_connection = False
+        self.busy = False
+        self._input = ''
+        self._upstream = None
+        self._tls_pending = False
+        self._res_interceptors = []
+        self._exchange = None
+        self._buffered = None
+        self._chunked = False
+
+    def readable(self):
+        return self.handshaking or not self.busy
+
+    def expired(self, now, timeout):
+        # Slow responses are watched on upstream connection
+        return self._upstream is None and _Connection.expired(self, now, timeout)
+
+    def handle_data(self, data):
+        self._input += data
+        self._next_request()
+
+    def handle_close(self):
+        upstream, self._upstream = self._upstream, None
+        _Connection.handle_close(self)
+        if upstream is not None and upstream.client is self:
+            upstream.client = None
+            upstream.close()
+            self.server.forget_upstream(upstream)
+
+    def handle_tls_ready(self):
+        self.busy = False
+        self._next_request()
+
+    def handle_flushed(self):
+        if self._tls_pending:
+            self._tls_pending = False
+            try:
+                self.start_tls(self.server.ca.context(self.hostname), server_side=True)
+            except Exception, e:
+                print 'TLS setup failed: %s' % e
+                self.close()
+        elif self.close_connection and not self.busy:
+            self.close()
+
+    def _next_request(self):
+        while not self.busy and not self.closed:
+            end = self._input.find('\r\n\r\n')
+            if end < 0:
+                if len(self._input) > _MAX_HEAD_SIZE:
+                    self.send_error(400, 'Request header is too large')
+                return
+            request_line, _, headers = self._input[:end + 2].partition('\r\n')
+            words = request_line.split()
+            if len(words) != 3:
+                self.send_error(400, 'Bad request syntax (%r)' % request_line)
+                return
+            headers = Message(StringIO(headers + '\r\n'))
+            length = int(headers.get('Content-Length') or 0)
+            if len(self._input) < end + 4 + length:
+                return
+            body = self._input[end + 4:end + 4 + length]
+            self._input = self._input[end + 4 + length:]
+
+            self.command, self.path, self.request_version = words
+            self.headers = headers
+            connection = headers.get('Connection', '').lower()
+            self.close_connection = 'close' in connection or \
+                self.request_version != 'HTTP/1.1' and 'keep-alive' not in connection
+            self.busy = True
+            if self.command == 'CONNECT':
+                self._do_connect()
+            else:
+                self._do_command(body)
+
+    def _do_connect(self):
+        self.is_connect = True
+        self.hostname, self.port = self.path.split(':')
+        self.ssl_host = 'https://%s' % self.path
+        self.close_connection = False
+        # TLS is started once the reply is sent, client does not send anything before it
+        self._tls_pending = True
+        self.send_data('%s 200 Connection established\r\n\r\n' % self.request_version)
+
+    def _do_command(self, body):
+        if not self.is_connect:
+            u = urlparse(self.path)
+            if u.scheme != 'http':
+                self.send_error(500, 'Unknown scheme %s' % repr(u.scheme))
+                return
+            self.hostname = u.hostname
+            self.port = u.port or 80
+            self.path = urlunparse(ParseResult(scheme='', netloc='', params=u.params, path=u.path or '/',
+                                               query=u.query, fragment=u.fragment))
+
+        # Hop-by-hop header of the client connection
+        del self.headers['Proxy-Connection']
+
+        request = Request(self.command, self.path, self.request_version, self.headers, body, self.hostname,
+                          self.port, self.is_connect)
+
+        self._res_interceptors = [p(self.server, self) for p in self.server._res_plugins]
+        self._exchange = _Exchange(self.server, self, request)
+        self._buffered = None
+        response = self._exchange.intercept_request()
+        if response is not None:
+            # Answered by interceptor, destination is not contacted
+            if self._exchange.legacy_buffer:
+                self.close_connection = True
+            self.send_data(self._exchange.answer(response))
+            self._request_done()
+            return
+        # Requests which cannot be sent again go on fresh connection, idle one may be closed meanwhile
+        self._send_upstream(self.mitm_request(request.raw()), request.command in _IDEMPOTENT_METHODS)
+
+    def _send_upstream(self, request, reuse=True):
+        try:
+            self._upstream = self.server.acquire_upstream((self.hostname, int(self.port), self.is_connect), reuse)
+        except socket.error, e:
+            self.handle_upstream_error(str(e))
+            return
+        self._upstream.send_request(self, request, self._exchange.request.timings)
+
+    def retry_request(self, request):
+        if self._exchange.request.command not in _IDEMPOTENT_METHODS:
+            self.handle_upstream_error('Connection closed by destination')
+            return
+        self._send_upstream(request, reuse=False)
+
+    def handle_upstream_error(self, message):
+        self._upstream = None
+        self.send_error(502, message)
+
+    def handle_response_head(self, status, reason, msg, chunked):
+        self._exchange.start_response(Response(self._exchange.request, status, reason, msg))
+        self._chunked = (chunked or self._exchange.rechunk) and self._exchange.response.has_body
+        if self._exchange.close:
+            self.close_connection = True
+        if self._exchange.buffer_response:
+            self._buffered = []
+        else:
+            self.send_data(self._exchange.head())
+
+    def handle_response_data(self, data):
+        if self._buffered is not None:
+            self._buffered.append(data)
+            return
+        data = self._exchange.chunk(data)
+        if not data:
+            return
+        if self._chunked:
+            data = '%x\r\n%s\r\n' % (len(data), data)
+        self.send_data(data)
+
+    def handle_response_end(self, complete, will_close):
+        self._upstream = None
+        if self._buffered is not None:
+            if self._exchange.legacy_buffer:
+                # Response may be changed by plugins, so its end is marked by closing the connection
+                self.close_connection = True
+            self.send_data(self._exchange.buffered(''.join(self._buffered)))
+            self._buffered = None
+        elif complete:
+            tail = self._exchange.tail()
+            if tail:
+                self.send_data('%x\r\n%s\r\n' % (len(tail), tail) if self._chunked else tail)
+            if self._chunked:
+                self.send_data('0\r\n\r\n')
+        self._exchange.end(complete)
+        if will_close or not complete:
+            self.close_connection = True
+        self._request_done()
+
+    def send_error(self, code, message):
+        self.close_connection = True
+        body = '<html><body><h1>%d %s</h1></body></html>' % (code, message)
+        self.send_data('%s %d %s\r\nContent-Type: text/html\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s'
+                       % (self.request_version or 'HTTP/1.0', code, message, len(body), body))
+        self._request_done()
+
+    def _request_done(self):
+        self.busy = False
+        if self.close_connection:
+            if not self._output:
+                self.close()
+            return
+        self._next_request()
+
+    def mitm_request(self, data):
+        for p in self.server._req_plugins:
+            data = p(self.server, self).do_request(data)
+        return data
+
+    def mitm_response(self, data):
+        for p in self._res_interceptors:
+            data = p.do_response(data)
+        return data
+
+    def mitm_response_head(self, data):
+        for p in self._res_interceptors:
+            data = p.do_response_head(data)
+        return data
+
+    def mitm_response_chunk(self, data):
+        for p in self._res_interceptors:
+            data = p.do_response_chunk(data)
+        return data
+
+
+class EventMitmProxy(asyncore.dispatcher):
+    '''
+    MitmProxy serving all connections on one thread. Idle upstream connections are kept for following requests, at
+    most `max_idle` per destination and `max_total` in all. Connections inactive for more than `idle_timeout` seconds
+    are closed. `key_type` and `key_pool_size` of certificates are passed to `CertificateAuthority`.
+    '''
+
+    register_interceptor = MitmProxy.register_interceptor.im_func
+    unregister_interceptor = MitmProxy.unregister_interceptor.im_func
+    register_observer = MitmProxy.register_observer.im_func
+    unregister_observer = MitmProxy.unregister_observer.im_func
+
+    def __init__(self, server_address=('', 9095), ca_file='ca.pem', backlog=1024, idle_timeout=60, max_idle=8,
+                 max_total=128, key_type='rsa', key_pool_size=4):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(server_address)
+        self.listen(backlog)
+        self.server_address = self.socket.getsockname()
+        self.ca = CertificateAuthority(ca_file, key_type=key_type, key_pool_size=key_pool_size)
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.max_total = max_total
+        self._idle = {}
+        self._total = 0
+        self._res_plugins = []
+        self._req_plugins = []
+        self._interceptors = []
+        self._observers = []
+        self._running = False
+        self._swept = time()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _ClientConnection(self, *pair)
+
+    def handle_error(self):
+        # Keep listening, failed accept is retried by the client
+        print 'Accepting connection failed: %s' % (asyncore.compact_traceback()[2],)
+
+    def serve_forever(self, poll_interval=0.5):
+        self._running = True
+        while self._running:
+            asyncore.loop(poll_interval, True, self.map, 1)
+            self._sweep()
+
+    def shutdown(self):
+        self._running = False
+
+    def server_close(self):
+        self._running = False
+        for connection in self.map.values():
+            connection.close()
+        self._idle.clear()
+        self._total = 0
+        self.ca.close()
+
+    def acquire_upstream(self, key, reuse=True):
+        connections = self._idle.get(key)
+        while reuse and connections:
+            connection = connections.pop()
+            self._total -= 1
+            if not connection.closed:
+                connection.reused = True
+                return connection
+        return _UpstreamConnection(self, key)
+
+    def release_upstream(self, connection):
+        connections = self._idle.setdefault(connection.key, [])
+        if len(connections) < self.max_idle and self._total < self.max_total:
+            connection.reused = False
+            connection.last_active = time()
+            connections.append(connection)
+            self._total += 1
+        else:
+            connection.close()
+
+    def forget_upstream(self, connection):
+        connections = self._idle.get(connection.key, [])
+        if connection in connections:
+            connections.remove(connection)
+            self._total -= 1
+
+    def _sweep(self):
+        now = time()
+        if now - self._swept < 1:
+            return
+        self._swept = now
+        for connection in self.map.values():
+            if connection is not self and connection.expired(now, self.idle_timeout):
+                connection.handle_close()
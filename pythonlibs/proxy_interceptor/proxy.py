@@ -1,21 +1,33 @@
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 from urlparse import urlparse, urlunparse, ParseResult
 from SocketServer import ThreadingMixIn
-from httplib import HTTPResponse, IncompleteRead
+from httplib import HTTPResponse, IncompleteRead, BadStatusLine
+from collections import OrderedDict
+from Queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+from time import time
 from tempfile import gettempdir
-from os import path, listdir
-from ssl import wrap_socket
-from socket import socket
+from os import path, listdir, remove
+from ssl import wrap_socket, SSLContext, SSLError, PROTOCOL_SSLv23
+from socket import socket, error as socket_error
+from select import select, error as select_error
 from re import compile
 from sys import argv
 
 from OpenSSL.crypto import (X509Extension, X509, dump_privatekey, dump_certificate, load_certificate, load_privatekey,
                             PKey, TYPE_RSA, X509Req)
 from OpenSSL.SSL import FILETYPE_PEM
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
 
 __all__ = [
     'CertificateAuthority',
+    'ConnectionPool',
     'ProxyHandler',
+    'Request',
+    'Response',
+    'Interceptor',
     'RequestInterceptorPlugin',
     'ResponseInterceptorPlugin',
     'MitmProxy',
@@ -23,21 +35,49 @@ __all__ = [
     'InvalidInterceptorPluginException'
 ]
 
+# Requests which may be sent again if connection to destination failed, others may have been applied already
+_IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
 
 class CertificateAuthority(object):
+    '''
+    Issues leaf certificates signed by CA from `ca_file`, the CA is generated if the file does not exist.
+
+    Certificates are kept in `cache_dir` between runs and SSL contexts of them in memory, at most `context_cache_size`
+    least recently used ones. Keys of new certificates are generated in background, `key_pool_size` of them are kept
+    ready until `close` is called. `key_type` is either 'rsa' or 'ec', EC keys (P-256) are much faster to generate.
+    Last issued serial number is kept in `.pymp_serial` file of `cache_dir`.
+    '''
 
-    def __init__(self, ca_file='ca.pem', cache_dir=gettempdir()):
+    def __init__(self, ca_file='ca.pem', cache_dir=gettempdir(), key_type='rsa', key_pool_size=4,
+                 context_cache_size=256):
         self.ca_file = ca_file
         self.cache_dir = cache_dir
+        self.key_type = key_type
+        self.context_cache_size = context_cache_size
+        self._lock = Lock()
+        self._issue_lock = Lock()
+        self._contexts = OrderedDict()
+        self._serial_file = path.join(cache_dir, '.pymp_serial')
         self._serial = self._get_serial()
         if not path.exists(ca_file):
             self._generate_ca()
         else:
             self._read_ca(ca_file)
+        self._keys = Queue(key_pool_size)
+        self._closed = Event()
+        if key_pool_size:
+            keys = Thread(target=self._generate_keys)
+            keys.daemon = True
+            keys.start()
 
     def _get_serial(self):
+        if path.exists(self._serial_file):
+            with open(self._serial_file) as f:
+                return int(f.read().strip() or 1)
+        # No index yet, find out the last serial from cached certificates once
         s = 1
-        for c in filter(lambda x: x.startswith('.pymp_'), listdir(self.cache_dir)):
+        for c in filter(lambda x: x.startswith('.pymp_') and x.endswith('.pem'), listdir(self.cache_dir)):
             c = load_certificate(FILETYPE_PEM, open(path.sep.join([self.cache_dir, c])).read())
             sc = c.get_serial_number()
             if sc > s:
@@ -45,6 +85,42 @@ class CertificateAuthority(object):
             del c
         return s
 
+    def _generate_key(self):
+        if self.key_type == 'ec':
+            key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+            return load_privatekey(FILETYPE_PEM, key.private_bytes(Encoding.PEM, PrivateFormat.TraditionalOpenSSL,
+                                                                   NoEncryption()))
+        key = PKey()
+        key.generate_key(TYPE_RSA, 2048)
+        return key
+
+    def _generate_keys(self):
+        while not self._closed.is_set():
+            key = self._generate_key()
+            while not self._closed.is_set():
+                try:
+                    self._keys.put(key, timeout=0.5)
+                    break
+                except Full:
+                    pass
+
+    def close(self):
+        '''
+        Stops generating keys in background and drops the ready ones.
+        '''
+        self._closed.set()
+        try:
+            while True:
+                self._keys.get_nowait()
+        except Empty:
+            pass
+
+    def _take_key(self):
+        try:
+            return self._keys.get_nowait()
+        except Empty:
+            return self._generate_key()
+
     def _generate_ca(self):
         # Generate key
         self.key = PKey()
@@ -64,7 +140,7 @@ class CertificateAuthority(object):
             X509Extension("keyUsage", True, "keyCertSign, cRLSign"),
             X509Extension("subjectKeyIdentifier", False, "hash", subject=self.cert),
             ])
-        self.cert.sign(self.key, "sha1")
+        self.cert.sign(self.key, "sha256")
 
         with open(self.ca_file, 'wb+') as f:
             f.write(dump_privatekey(FILETYPE_PEM, self.key))
@@ -76,37 +152,132 @@ class CertificateAuthority(object):
 
     def __getitem__(self, cn):
         cnp = path.sep.join([self.cache_dir, '.pymp_%s.pem' % cn])
-        if not path.exists(cnp):
-            # create certificate
-            key = PKey()
-            key.generate_key(TYPE_RSA, 2048)
-
-            # Generate CSR
-            req = X509Req()
-            req.get_subject().CN = cn
-            req.set_pubkey(key)
-            req.sign(key, 'sha1')
-
-            # Sign CSR
-            cert = X509()
-            cert.set_subject(req.get_subject())
-            cert.set_serial_number(self.serial)
-            cert.gmtime_adj_notBefore(0)
-            cert.gmtime_adj_notAfter(31536000)
-            cert.set_issuer(self.cert.get_subject())
-            cert.set_pubkey(req.get_pubkey())
-            cert.sign(self.key, 'sha1')
-
-            with open(cnp, 'wb+') as f:
-                f.write(dump_privatekey(FILETYPE_PEM, key))
-                f.write(dump_certificate(FILETYPE_PEM, cert))
-
+        with self._issue_lock:
+            if not path.exists(cnp):
+                self._issue(cn, cnp)
         return cnp
 
+    def _issue(self, cn, cnp):
+        # create certificate
+        key = self._take_key()
+
+        # Generate CSR
+        req = X509Req()
+        req.get_subject().CN = cn
+        req.set_pubkey(key)
+        req.sign(key, 'sha256')
+
+        # Sign CSR
+        cert = X509()
+        cert.set_subject(req.get_subject())
+        cert.set_serial_number(self.serial)
+        cert.gmtime_adj_notBefore(0)
+        cert.gmtime_adj_notAfter(31536000)
+        cert.set_issuer(self.cert.get_subject())
+        cert.set_pubkey(req.get_pubkey())
+        cert.sign(self.key, 'sha256')
+
+        with open(cnp, 'wb+') as f:
+            f.write(dump_privatekey(FILETYPE_PEM, key))
+            f.write(dump_certificate(FILETYPE_PEM, cert))
+
+    def context(self, cn):
+        '''
+        Returns server side SSL context with certificate for `cn`.
+        '''
+        with self._lock:
+            context = self._contexts.pop(cn, None)
+            if context is not None:
+                self._contexts[cn] = context
+                return context
+        context = SSLContext(PROTOCOL_SSLv23)
+        try:
+            context.load_cert_chain(self[cn])
+        except SSLError:
+            # Certificate cached by older version may be signed with digest which is not accepted anymore
+            remove(self[cn])
+            context.load_cert_chain(self[cn])
+        with self._lock:
+            self._contexts[cn] = context
+            while len(self._contexts) > self.context_cache_size:
+                self._contexts.popitem(last=False)
+        return context
+
     @property
     def serial(self):
-        self._serial += 1
-        return self._serial
+        with self._lock:
+            self._serial += 1
+            with open(self._serial_file, 'w') as f:
+                f.write(str(self._serial))
+            return self._serial
+
+
+class ConnectionPool(object):
+    '''
+    Keeps idle keep-alive connections to destinations by (host, port, tls) key, so following requests to the same
+    destination skip TCP and TLS handshakes. Connections idle for more than `idle_timeout` seconds are closed, at most
+    `max_idle` connections are kept per destination and `max_total` in all. Connections closed by destination meanwhile
+    are not handed out.
+    '''
+
+    def __init__(self, max_idle=8, max_total=128, idle_timeout=30):
+        self.max_idle = max_idle
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._total = 0
+        self._lock = Lock()
+
+    def acquire(self, key):
+        now = time()
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while connections:
+                sock, stamp = connections.pop()
+                self._total -= 1
+                if now - stamp < self.idle_timeout and not self._closed_by_peer(sock):
+                    return sock
+                sock.close()
+        return None
+
+    @staticmethod
+    def _closed_by_peer(sock):
+        # Nothing is expected on idle connection, it is readable only if destination closed it
+        try:
+            return bool(select([sock], [], [], 0)[0])
+        except (select_error, socket_error, ValueError):
+            return True
+
+    def release(self, key, sock):
+        now = time()
+        with self._lock:
+            self._evict(now)
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle and self._total < self.max_total:
+                connections.append((sock, now))
+                self._total += 1
+                return
+        sock.close()
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for sock, _ in connections:
+                    sock.close()
+            self._idle.clear()
+            self._total = 0
+
+    def _evict(self, now):
+        for key, connections in self._idle.items():
+            alive = [(sock, stamp) for sock, stamp in connections if now - stamp < self.idle_timeout]
+            for sock, stamp in connections:
+                if now - stamp >= self.idle_timeout:
+                    sock.close()
+            self._total -= len(connections) - len(alive)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
 
 
 class UnsupportedSchemeException(Exception):
@@ -117,15 +288,21 @@ class ProxyHandler(BaseHTTPRequestHandler):
 
     r = compile(r'http://[^/]+(/?.*)(?i)')
 
+    # Client connections are kept alive between requests, idle ones are closed after `timeout` seconds.
+    protocol_version = 'HTTP/1.1'
+    timeout = 60
+
+    # Size of response body chunks relayed to the client.
+    chunk_size = 64 * 1024
+
     def __init__(self, request, client_address, server):
         self.is_connect = False
+        self._tunnel_timings = {}
         BaseHTTPRequestHandler.__init__(self, request, client_address, server)
 
-    def _connect_to_host(self):
-        # Get hostname and port to connect to
-        if self.is_connect:
-            self.hostname, self.port = self.path.split(':')
-        else:
+    def _parse_destination(self):
+        # Get hostname and port to connect to, tunnel destination is set by CONNECT
+        if not self.is_connect:
             u = urlparse(self.path)
             if u.scheme != 'http':
                 raise UnsupportedSchemeException('Unknown scheme %s' % repr(u.scheme))
@@ -142,25 +319,39 @@ class ProxyHandler(BaseHTTPRequestHandler):
                 )
             )
 
+    def _connect_to_host(self, timings, reuse=True):
+        # Reuse idle connection to destination if there is one
+        self._upstream_key = (self.hostname, int(self.port), self.is_connect)
+        self._proxy_sock = self.server.upstream.acquire(self._upstream_key) if reuse else None
+        self._reused = self._proxy_sock is not None
+        if not self._reused:
+            self._proxy_sock = self._open_connection(timings)
+
+    def _open_connection(self, timings):
         # Connect to destination
-        self._proxy_sock = socket()
-        self._proxy_sock.settimeout(30)
-        self._proxy_sock.connect((self.hostname, int(self.port)))
+        timings['connect_start'] = time()
+        sock = socket()
+        sock.settimeout(30)
+        sock.connect((self.hostname, int(self.port)))
+        timings['connect'] = time()
 
         # Wrap socket if SSL is required
         if self.is_connect:
-            self._proxy_sock = wrap_socket(self._proxy_sock)
-
+            sock = wrap_socket(sock)
+            timings['tls'] = time()
+        return sock
 
     def _transition_to_ssl(self):
-        self.request = wrap_socket(self.request, server_side=True, certfile=self.server.ca[self.path.split(':')[0]])
+        self.request = self.server.ca.context(self.hostname).wrap_socket(self.request, server_side=True)
 
 
     def do_CONNECT(self):
         self.is_connect = True
+        self.hostname, self.port = self.path.split(':')
         try:
-            # Connect to destination first
-            self._connect_to_host()
+            # Connect to destination first, the connection is used by the first tunneled request
+            self._connect_to_host(self._tunnel_timings)
+            self.server.upstream.release(self._upstream_key, self._proxy_sock)
 
             # If successful, let's do this!
             self.send_response(200, 'Connection established')
@@ -171,7 +362,7 @@ class ProxyHandler(BaseHTTPRequestHandler):
             self.send_error(500, str(e))
             return
 
-        # Reload!
+        # Reload! Following requests of the connection are read from the tunnel.
         self.setup()
         self.ssl_host = 'https://%s' % self.path
         self.handle_one_request()
@@ -179,50 +370,138 @@ class ProxyHandler(BaseHTTPRequestHandler):
 
     def do_COMMAND(self):
 
-        # Is this an SSL tunnel?
-        if not self.is_connect:
-            try:
-                # Connect to destination
-                self._connect_to_host()
-            except Exception, e:
-                self.send_error(500, str(e))
-                return
-            # Extract path
-
-        # Build request
-        req = '%s %s %s\r\n' % (self.command, self.path, self.request_version)
+        try:
+            # Get destination, in SSL tunnel it is the tunnel one
+            self._parse_destination()
+        except Exception, e:
+            self.send_error(500, str(e))
+            return
 
-        # Add headers to the request
-        req += '%s\r\n' % self.headers
+        # Hop-by-hop header of the client connection
+        del self.headers['Proxy-Connection']
 
         # Append message body if present to the request
+        body = ''
         if 'Content-Length' in self.headers:
-            req += self.rfile.read(int(self.headers['Content-Length']))
-
-        # Send it down the pipe!
-        self._proxy_sock.sendall(self.mitm_request(req))
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        request = Request(self.command, self.path, self.request_version, self.headers, body, self.hostname,
+                          self.port, self.is_connect)
+        # Connection opened by CONNECT is used by the first request of the tunnel
+        request.timings.update(self._tunnel_timings)
+        self._tunnel_timings = {}
+
+        # Plugins live for the whole response
+        self._res_interceptors = [p(self.server, self) for p in self.server._res_plugins]
+        exchange = _Exchange(self.server, self, request)
+        response = exchange.intercept_request()
+        if response is not None:
+            # Answered by interceptor, destination is not contacted
+            if exchange.legacy_buffer:
+                self.close_connection = 1
+            self.request.sendall(exchange.answer(response))
+            return
 
-        # Parse response
-        h = HTTPResponse(self._proxy_sock)
-        h.begin()
+        try:
+            # Connect to destination
+            # Requests which cannot be sent again go on fresh connection, idle one may be closed meanwhile
+            self._connect_to_host(request.timings, self.command in _IDEMPOTENT_METHODS)
+        except Exception, e:
+            self.send_error(500, str(e))
+            return
 
-        # Get rid of the pesky header
-        del h.msg['Transfer-Encoding']
+        # Send it down the pipe!
+        try:
+            h = self._send_request(self.mitm_request(request.raw()), request.timings)
+        except Exception, e:
+            self._proxy_sock.close()
+            self.send_error(502, str(e))
+            return
 
         # Time to relay the message across
-        res = '%s %s %s\r\n' % (self.request_version, h.status, h.reason)
-        res += '%s\r\n' % h.msg
+        exchange.start_response(Response(request, h.status, h.reason, h.msg))
+        complete = False
+        try:
+            if exchange.buffer_response:
+                if exchange.legacy_buffer:
+                    # Response may be changed by plugins, so its end is marked by closing the connection
+                    self.close_connection = 1
+                complete = self._relay_buffered(h, exchange)
+            else:
+                complete = self._relay_streamed(h, exchange)
+        finally:
+            exchange.end(complete)
+            # Keep the remote end for following requests if it is reusable, close it off otherwise
+            if h.will_close or not complete:
+                self.close_connection = 1
+            h.close()
+            if complete and not h.will_close:
+                self.server.upstream.release(self._upstream_key, self._proxy_sock)
+            else:
+                self._proxy_sock.close()
+
+    def _send_request(self, req, timings):
+        while True:
+            try:
+                self._proxy_sock.sendall(req)
+                timings['sent'] = time()
+                h = HTTPResponse(self._proxy_sock, method=self.command)
+                h.begin()
+                timings['first_byte'] = time()
+                return h
+            except (socket_error, BadStatusLine):
+                if not self._reused or self.command not in _IDEMPOTENT_METHODS:
+                    raise
+                # Idle connection was closed by destination meanwhile, retry on new one
+                self._proxy_sock.close()
+                self._proxy_sock = self._open_connection(timings)
+                self._reused = False
+
+    def _relay_buffered(self, h, exchange):
+        complete = True
         try:
-            res += h.read(h.length)
-        except IncompleteRead,e:
+            body = h.read()
+        except IncompleteRead, e:
             print e.message
-
-        # Let's close off the remote end
-        h.close()
-        self._proxy_sock.close()
-
-        # Relay the message
-        self.request.sendall(self.mitm_response(res))
+            body = e.partial
+            complete = False
+
+        self.request.sendall(exchange.buffered(body))
+        return complete
+
+    def _relay_streamed(self, h, exchange):
+        # Headers go first, body is piped through in chunks as it arrives.
+        # httplib de-chunks the body, so it is chunked again for the client.
+        self.request.sendall(exchange.head())
+        chunked = (h.chunked or exchange.rechunk) and exchange.response.has_body
+        if exchange.close:
+            self.close_connection = 1
+
+        complete = True
+        while True:
+            try:
+                chunk = h.read(self.chunk_size)
+            except IncompleteRead, e:
+                print e.message
+                chunk = e.partial
+                complete = False
+                h.close()
+            if not chunk:
+                break
+            chunk = exchange.chunk(chunk)
+            if not chunk:
+                continue
+            if chunked:
+                chunk = '%x\r\n%s\r\n' % (len(chunk), chunk)
+            self.request.sendall(chunk)
+
+        if complete:
+            tail = exchange.tail()
+            if tail:
+                self.request.sendall('%x\r\n%s\r\n' % (len(tail), tail) if chunked else tail)
+        if chunked and complete:
+            self.request.sendall('0\r\n\r\n')
+        return complete
 
     def mitm_request(self, data):
         for p in self.server._req_plugins:
@@ -230,8 +509,18 @@ class ProxyHandler(BaseHTTPRequestHandler):
         return data
 
     def mitm_response(self, data):
-        for p in self.server._res_plugins:
-            data = p(self.server, self).do_response(data)
+        for p in self._res_interceptors:
+            data = p.do_response(data)
+        return data
+
+    def mitm_response_head(self, data):
+        for p in self._res_interceptors:
+            data = p.do_response_head(data)
+        return data
+
+    def mitm_response_chunk(self, data):
+        for p in self._res_interceptors:
+            data = p.do_response_chunk(data)
         return data
 
     def __getattr__(self, item):
@@ -239,6 +528,212 @@ class ProxyHandler(BaseHTTPRequestHandler):
             return self.do_COMMAND
 
 
+def _header_block(headers):
+    # Headers set through Message end with bare LF, every line is ended by CRLF on the wire
+    return ''.join(line.rstrip('\r\n') + '\r\n' for line in headers.headers)
+
+
+class Request(object):
+    '''
+    Parsed proxied request, `headers` is `mimetools.Message`. Changes of `command`, `path`, `headers` and `body`
+    made by interceptors are sent to destination.
+
+    `timings` maps phases of the exchange to the time they ended: start (request is read), connect_start,
+    connect and tls (only if new connection to destination was opened for the request), sent, first_byte
+    and complete.
+    '''
+
+    def __init__(self, command, path, version, headers, body, hostname, port, is_connect):
+        self.command = command
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.hostname = hostname
+        self.port = int(port)
+        self.is_connect = is_connect
+        self.timings = {'start': time()}
+
+    @property
+    def url(self):
+        # Default port is left out as browsers do, so URLs can be matched against what is seen in the browser
+        scheme, default_port = ('https', 443) if self.is_connect else ('http', 80)
+        if self.port == default_port:
+            return '%s://%s%s' % (scheme, self.hostname, self.path)
+        return '%s://%s:%s%s' % (scheme, self.hostname, self.port, self.path)
+
+    def raw(self):
+        return '%s %s %s\r\n%s\r\n%s' % (self.command, self.path, self.version, _header_block(self.headers), self.body)
+
+
+class Response(object):
+    '''
+    Parsed response of `request`, `headers` is `mimetools.Message`. `body` is set only if the response is
+    buffered or is created by interceptor. Interceptors keep their state of the response in `context`.
+    '''
+
+    def __init__(self, request, status, reason, headers, body=None):
+        self.request = request
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.context = {}
+
+    def head(self, version):
+        return '%s %s %s\r\n%s\r\n' % (version, self.status, self.reason, _header_block(self.headers))
+
+    @property
+    def has_body(self):
+        # Responses to HEAD, informational, No Content and Not Modified ones never have body
+        return self.request.command != 'HEAD' and not 100 <= self.status < 200 and self.status not in (204, 304)
+
+
+class Interceptor(object):
+    '''
+    Interceptor working on parsed requests and responses. It is instantiated once and shared by all connections,
+    so state of single response should be kept in `response.context`.
+
+    Interceptor declares interest by `match_request` and `match_response` predicates over request and response
+    heads, other traffic is relayed without calling it and without looking into its body.
+    '''
+
+    # Set to True to get whole body of matching responses in `on_response_body` instead of `on_response_chunk`.
+    buffer_response = False
+
+    def match_request(self, request):
+        return False
+
+    def on_request(self, request):
+        '''
+        Called before matching request is sent, may change it or return `Response` to answer without
+        contacting destination.
+        '''
+        return None
+
+    def match_response(self, response):
+        return False
+
+    def on_response_head(self, response):
+        pass
+
+    def on_response_chunk(self, response, chunk):
+        return chunk
+
+    def on_response_tail(self, response):
+        '''
+        Called after the whole streamed body went through `on_response_chunk`, returned data is appended to it.
+        Interceptor changing the body length should remove Content-Length header in `on_response_head`.
+        '''
+        return None
+
+    def on_response_body(self, response, body):
+        return body
+
+    def on_response_end(self, response, complete):
+        pass
+
+
+class _Exchange(object):
+    '''
+    Passes one request and its response through interceptors of `server`, both new ones and `handler` plugins.
+    '''
+
+    def __init__(self, server, handler, request):
+        self.handler = handler
+        self.request = request
+        self.response = None
+        self.buffer_response = False
+        self.legacy_buffer = False
+        self.rechunk = False
+        self.close = False
+        # Size of the body relayed to the client
+        self.size = 0
+        self._interceptors = server._interceptors
+        self._observers = server._observers
+        self._matched = ()
+
+    def intercept_request(self):
+        for interceptor in self._interceptors:
+            if interceptor.match_request(self.request):
+                response = interceptor.on_request(self.request)
+                if response is not None:
+                    return response
+        return None
+
+    def start_response(self, response):
+        self.response = response
+        self._matched = [i for i in self._interceptors if i.match_response(response)]
+        for interceptor in self._matched:
+            interceptor.on_response_head(response)
+        self.legacy_buffer = any(p.buffer_response for p in self.handler._res_interceptors)
+        self.buffer_response = self.legacy_buffer or any(i.buffer_response for i in self._matched)
+        headers = response.headers
+        if self.buffer_response or 'Content-Length' in headers or 'Transfer-Encoding' in headers \
+                or not response.has_body:
+            return
+        if self._matched and self.request.version == 'HTTP/1.1':
+            # Body length was changed by interceptors, it is chunked to keep the client connection
+            headers['Transfer-Encoding'] = 'chunked'
+            self.rechunk = True
+        else:
+            # Body is delimited by closing the connection
+            self.close = True
+
+    def answer(self, response):
+        self.start_response(response)
+        data = self.buffered(response.body or '')
+        self.end(True)
+        return data
+
+    def head(self):
+        return self.handler.mitm_response_head(self.response.head(self.request.version))
+
+    def chunk(self, data):
+        data = self.handler.mitm_response_chunk(data)
+        if not self.response.has_body:
+            return data
+        for interceptor in self._matched:
+            if data:
+                data = interceptor.on_response_chunk(self.response, data)
+        self.size += len(data)
+        return data
+
+    def buffered(self, body):
+        if not self.response.has_body:
+            body = ''
+        for interceptor in self._matched if self.response.has_body else ():
+            if interceptor.buffer_response:
+                body = interceptor.on_response_body(self.response, body)
+            else:
+                if body:
+                    body = interceptor.on_response_chunk(self.response, body)
+                body += interceptor.on_response_tail(self.response) or ''
+        self.response.body = body
+        self.size = len(body)
+        # Get rid of the pesky header, body is relayed de-chunked
+        headers = self.response.headers
+        del headers['Transfer-Encoding']
+        if not self.legacy_buffer and self.response.has_body:
+            del headers['Content-Length']
+            headers['Content-Length'] = str(len(body))
+        return self.handler.mitm_response(self.response.head(self.request.version) + body)
+
+    def tail(self):
+        if not self.response.has_body:
+            return ''
+        data = ''.join(i.on_response_tail(self.response) or '' for i in self._matched)
+        self.size += len(data)
+        return data
+
+    def end(self, complete):
+        self.request.timings['complete'] = time()
+        for interceptor in self._matched:
+            interceptor.on_response_end(self.response, complete)
+        for observer in self._observers:
+            observer(self.response, complete, self.size)
+
+
 class InterceptorPlugin(object):
 
     def __init__(self, server, msg):
@@ -254,9 +749,19 @@ class RequestInterceptorPlugin(InterceptorPlugin):
 
 class ResponseInterceptorPlugin(InterceptorPlugin):
 
+    # Responses are relayed as they arrive through `do_response_head` and `do_response_chunk`.
+    # Set it to True to get the whole response in `do_response` instead.
+    buffer_response = False
+
     def do_response(self, data):
         return data
 
+    def do_response_head(self, data):
+        return data
+
+    def do_response_chunk(self, data):
+        return data
+
 
 class InvalidInterceptorPluginException(Exception):
     pass
@@ -264,20 +769,49 @@ class InvalidInterceptorPluginException(Exception):
 
 class MitmProxy(HTTPServer):
 
-    def __init__(self, server_address=('', 9095), RequestHandlerClass=ProxyHandler, bind_and_activate=True, ca_file='ca.pem'):
+    def __init__(self, server_address=('', 9095), RequestHandlerClass=ProxyHandler, bind_and_activate=True, ca_file='ca.pem',
+                 key_type='rsa', key_pool_size=4):
         HTTPServer.__init__(self, server_address, RequestHandlerClass, bind_and_activate)
-        self.ca = CertificateAuthority(ca_file)
+        self.ca = CertificateAuthority(ca_file, key_type=key_type, key_pool_size=key_pool_size)
+        self.upstream = ConnectionPool()
         self._res_plugins = []
         self._req_plugins = []
+        self._interceptors = []
+        self._observers = []
 
     def register_interceptor(self, interceptor_class):
-        if not issubclass(interceptor_class, InterceptorPlugin):
+        # Interceptor is registered as instance, its class is instantiated once
+        if isinstance(interceptor_class, type) and issubclass(interceptor_class, Interceptor):
+            interceptor_class = interceptor_class()
+        if isinstance(interceptor_class, Interceptor):
+            self._interceptors.append(interceptor_class)
+            return interceptor_class
+        if not isinstance(interceptor_class, type) or not issubclass(interceptor_class, InterceptorPlugin):
             raise InvalidInterceptorPluginException('Expected type InterceptorPlugin got %s instead' % type(interceptor_class))
         if issubclass(interceptor_class, RequestInterceptorPlugin):
             self._req_plugins.append(interceptor_class)
         if issubclass(interceptor_class, ResponseInterceptorPlugin):
             self._res_plugins.append(interceptor_class)
 
+    def unregister_interceptor(self, interceptor):
+        # Lists are replaced, not changed, as they may be iterated by handlers meanwhile
+        self._interceptors = [i for i in self._interceptors if i is not interceptor]
+        self._req_plugins = [p for p in self._req_plugins if p is not interceptor]
+        self._res_plugins = [p for p in self._res_plugins if p is not interceptor]
+
+    def register_observer(self, observer):
+        # Observer is called with response, whether it was completed and size of its relayed body after each
+        # exchange. Unlike interceptors, it sees all the traffic without changing the way it is relayed.
+        self._observers = self._observers + [observer]
+
+    def unregister_observer(self, observer):
+        self._observers = [o for o in self._observers if o is not observer]
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.upstream.close()
+        self.ca.close()
+
 
 class AsyncMitmProxy(ThreadingMixIn, MitmProxy):
     pass
@@ -293,6 +827,10 @@ class MitmProxyHandler(ProxyHandler):
         print '<< %s' % repr(data[:100])
         return data
 
+    def mitm_response_head(self, data):
+        print '<< %s' % repr(data[:100])
+        return data
+
 
 class DebugInterceptor(RequestInterceptorPlugin, ResponseInterceptorPlugin):
 
@@ -304,6 +842,10 @@ class DebugInterceptor(RequestInterceptorPlugin, ResponseInterceptorPlugin):
             print '<< %s' % repr(data[:100])
             return data
 
+        def do_response_head(self, data):
+            print '<< %s' % repr(data[:100])
+            return data
+
 
 if __name__ == '__main__':
     proxy = None
@@ -0,0 +1,295 @@
+"""
+Recording of traffic passing `MitmProxy` with timings of each exchange phase: connect, TLS, request sent,
+first byte and complete.
+
+Recorded exchanges are kept in a ring buffer of `max_entries`, so memory stays flat however long the recording
+is. Recording is written as HAR file along with latency summary of each destination host.
+
+`TrafficRecorderLibrary` provides Robot Framework keywords starting a proxy with the recorder and recording
+around a test:
+
+| *Settings* | *Value*                                         |
+| Library    | proxy_interceptor.recorder.TrafficRecorderLibrary |
+| Test Setup    | Start Recording |
+| Test Teardown | Stop Recording  |
+
+`ProxyLibrary` has the same keywords recording traffic of its own proxy.
+"""
+import json
+import re
+import os
+from collections import deque, defaultdict
+from datetime import datetime
+from threading import Lock, Thread
+from urlparse import urlparse, parse_qsl
+
+from proxy import Interceptor, AsyncMitmProxy
+
+__all__ = [
+    'TrafficRecorder',
+    'TrafficRecorderLibrary',
+    'recording_name',
+    'save_recording'
+]
+
+
+def _ms(start, end):
+    if start is None or end is None:
+        return -1
+    return round(max(end - start, 0) * 1000, 3)
+
+
+def _headers(headers):
+    return [{'name': name, 'value': value} for name, value in headers.items()]
+
+
+class TrafficRecorder(Interceptor):
+    '''
+    Interceptor recording exchanges as HAR entries while recording is started. Only the last `max_entries`
+    exchanges are kept, `dropped` counts the older ones which were discarded.
+    '''
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.dropped = 0
+        self.recording = False
+        self._entries = deque(maxlen=max_entries)
+        self._lock = Lock()
+
+    def start(self):
+        with self._lock:
+            self._entries.clear()
+            self.dropped = 0
+            self.recording = True
+
+    def stop(self):
+        '''
+        Stops recording and returns recorded HAR entries.
+        '''
+        with self._lock:
+            self.recording = False
+            return list(self._entries)
+
+    def match_response(self, response):
+        return self.recording
+
+    def on_response_head(self, response):
+        response.context['recorded_size'] = 0
+
+    def on_response_chunk(self, response, chunk):
+        response.context['recorded_size'] += len(chunk)
+        return chunk
+
+    def on_response_end(self, response, complete):
+        entry = self._entry(response, complete)
+        with self._lock:
+            if not self.recording:
+                return
+            if len(self._entries) == self.max_entries:
+                self.dropped += 1
+            self._entries.append(entry)
+
+    def _entry(self, response, complete):
+        request = response.request
+        t = request.timings
+        start = t['start']
+        # Connection may be opened before the request is read, by CONNECT
+        ready = max(t.get('tls', t.get('connect', start)), start)
+        sent = t.get('sent', ready)
+        first_byte = t.get('first_byte', sent)
+        size = response.context['recorded_size']
+        return {
+            'startedDateTime': datetime.utcfromtimestamp(start).isoformat() + 'Z',
+            'time': _ms(start, t['complete']),
+            'request': {
+                'method': request.command,
+                'url': request.url,
+                'httpVersion': request.version,
+                'cookies': [],
+                'headers': _headers(request.headers),
+                'queryString': [{'name': name, 'value': value}
+                                for name, value in parse_qsl(urlparse(request.path).query, True)],
+                'headersSize': -1,
+                'bodySize': len(request.body),
+            },
+            'response': {
+                'status': response.status,
+                'statusText': response.reason,
+                'httpVersion': request.version,
+                'cookies': [],
+                'headers': _headers(response.headers),
+                'content': {'size': size, 'mimeType': response.headers.get('Content-Type', '')},
+                'redirectURL': response.headers.get('Location', ''),
+                'headersSize': -1,
+                'bodySize': size,
+            },
+            'cache': {},
+            'timings': {
+                'blocked': -1,
+                'dns': -1,
+                # HAR connect time includes TLS handshake
+                'connect': _ms(t.get('connect_start'), t.get('tls', t.get('connect'))),
+                'ssl': _ms(t.get('connect'), t.get('tls')),
+                'send': _ms(ready, sent),
+                'wait': _ms(sent, first_byte),
+                'receive': _ms(first_byte, t['complete']),
+            },
+            '_complete': complete,
+        }
+
+    @staticmethod
+    def har(entries):
+        return {'log': {'version': '1.2', 'creator': {'name': 'proxy_interceptor', 'version': '1.0'},
+                        'entries': entries}}
+
+    @staticmethod
+    def summary(entries):
+        '''
+        Returns latency summary of `entries` per host as list of dicts, hosts with the most time spent first.
+        '''
+        times = defaultdict(list)
+        waits = defaultdict(list)
+        for entry in entries:
+            host = urlparse(entry['request']['url']).netloc
+            times[host].append(entry['time'])
+            waits[host].append(entry['timings']['wait'])
+        summary = []
+        for host, values in times.iteritems():
+            values.sort()
+            summary.append({
+                'host': host,
+                'requests': len(values),
+                'total': round(sum(values), 3),
+                'mean': round(sum(values) / len(values), 3),
+                'p50': values[(len(values) - 1) // 2],
+                'p95': values[int(round(0.95 * (len(values) - 1)))],
+                'max': values[-1],
+                'mean_wait': round(sum(waits[host]) / len(values), 3),
+            })
+        summary.sort(key=lambda s: s['total'], reverse=True)
+        return summary
+
+    @staticmethod
+    def format_summary(summary):
+        lines = ['%-40s %8s %10s %10s %10s %10s %10s' % ('host', 'requests', 'mean ms', 'p50 ms', 'p95 ms', 'max ms',
+                                                          'wait ms')]
+        for s in summary:
+            lines.append('%-40s %8d %10.1f %10.1f %10.1f %10.1f %10.1f' % (s['host'], s['requests'], s['mean'], s['p50'],
+                                                                           s['p95'], s['max'], s['mean_wait']))
+        return '\n'.join(lines)
+
+    def write(self, entries, har_file):
+        '''
+        Writes `entries` to `har_file` and their latency summary next to it, returns the summary.
+        '''
+        directory = os.path.dirname(har_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(har_file, 'w') as f:
+            json.dump(self.har(entries), f, indent=1)
+        summary = self.summary(entries)
+        with open(os.path.splitext(har_file)[0] + '.latency.txt', 'w') as f:
+            f.write(self.format_summary(summary) + '\n')
+        return summary
+
+
+def _variable(name):
+    try:
+        from robot.libraries.BuiltIn import BuiltIn
+        return BuiltIn().get_variable_value(name)
+    except Exception:
+        # Used outside of Robot run
+        return None
+
+
+def recording_name(name=None):
+    '''
+    Returns `name` of recording, name of current test or suite by default.
+    '''
+    return name or _variable('${TEST NAME}') or _variable('${SUITE NAME}') or 'recording'
+
+
+def save_recording(recorder, name, output_dir=None):
+    '''
+    Stops `recorder`, writes its recording to `<output_dir>/<name>.har` and returns path of the file. Latency summary
+    per host is logged. Robot output directory is used by default.
+    '''
+    entries = recorder.stop()
+    output_dir = output_dir or _variable('${OUTPUT DIR}') or os.getcwd()
+    har_file = os.path.join(output_dir, re.sub(r'[^\w.-]+', '_', name or 'recording') + '.har')
+    summary = recorder.write(entries, har_file)
+    print 'Recorded %d requests to %s' % (len(entries), har_file)
+    if recorder.dropped:
+        print '%d oldest requests were dropped, at most %d are kept' % (recorder.dropped, recorder.max_entries)
+    print recorder.format_summary(summary)
+    return har_file
+
+
+class TrafficRecorderLibrary(object):
+    """
+    Keywords recording traffic of browser under test.
+
+    The library runs its own proxy on `host` and `port`, browser should be configured to use it.
+    Recording of each test is written to `<output_dir>/<name>.har` with latency summary
+    in `<output_dir>/<name>.latency.txt`. Suites using `ProxyLibrary` should use its `Start Recording` and
+    `Stop Recording` keywords instead, so the browser keeps one proxy.
+
+    Arguments:
+            |  Port (default=9095)          | Port of the proxy, 0 picks a free one. |
+            |  Host (default=127.0.0.1)     | Interface the proxy listens on. |
+            |  CA File (default=ca.pem)     | CA certificate signing certificates of HTTPS destinations. |
+            |  Max Entries (default=1000)   | Number of the last exchanges kept in one recording. |
+            |  Output Dir (default=None)    | Directory of recordings, Robot output directory by default. |
+    Example:
+
+    | *Settings* | *Value*                                           | *Value* |
+    | Library    | proxy_interceptor.recorder.TrafficRecorderLibrary | 9095    |
+
+    """
+
+    ROBOT_LIBRARY_SCOPE = 'GLOBAL'
+
+    def __init__(self, port=9095, host='127.0.0.1', ca_file='ca.pem', max_entries=1000, output_dir=None):
+        self.recorder = TrafficRecorder(int(max_entries))
+        self._address = (host, int(port))
+        self._ca_file = ca_file
+        self._output_dir = output_dir
+        self._proxy = None
+        self._name = None
+
+    def start_recorder_proxy(self):
+        """
+        Starts the proxy unless it is running already and returns its `host:port`.
+        """
+        if self._proxy is None:
+            self._proxy = AsyncMitmProxy(server_address=self._address, ca_file=self._ca_file)
+            self._proxy.daemon_threads = True
+            self._proxy.register_interceptor(self.recorder)
+            thread = Thread(target=self._proxy.serve_forever)
+            thread.daemon = True
+            thread.start()
+        return '%s:%d' % self._proxy.server_address
+
+    def stop_recorder_proxy(self):
+        if self._proxy is not None:
+            self._proxy.shutdown()
+            self._proxy.server_close()
+            self._proxy = None
+
+    def start_recording(self, name=None):
+        """
+        Starts recording, the proxy is started if needed. Recording is named by current test by default.
+
+        Example:
+        | Start Recording |              |
+        | Start Recording | login_page   |
+        """
+        self.start_recorder_proxy()
+        self._name = recording_name(name)
+        self.recorder.start()
+
+    def stop_recording(self):
+        """
+        Stops recording, writes it as HAR file and returns path of the file. Latency summary per host is logged.
+        """
+        return save_recording(self.recorder, self._name, self._output_dir)
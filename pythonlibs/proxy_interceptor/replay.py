@@ -0,0 +1,247 @@
+"""
+Serving of proxied requests from local response cache or fixtures, so tests do not depend on slow or flaky
+destinations.
+
+Requests are matched by rules in order, the first matching rule decides:
+  - `cache` rule replays response recorded earlier and not older than rule `ttl` seconds. Missing responses are
+    fetched from destination and recorded, unless the rule is `offline`, then they are answered by 504.
+  - `fixture` rule answers by content of the `fixture` file with rule `status` and `headers`.
+  - `pass` rule lets the request through untouched.
+Destination is not contacted at all for replayed responses.
+
+Rules are given as list of dicts or path of JSON file with such list:
+
+|[
+|    {"url": "^https?://fonts\\\\.googleapis\\\\.com/", "ttl": 86400},
+|    {"url": "/api/config$", "action": "fixture", "fixture": "config.json"},
+|    {"url": "^https://cdn\\\\.example\\\\.com/", "offline": true}
+|]
+
+Cache is content addressed, bodies are stored once under their sha1 in `objects` directory, while `index` maps
+method, URL and request body of each recorded request to response status, headers and body hash.
+"""
+import json
+import mimetypes
+import os
+import re
+from BaseHTTPServer import BaseHTTPRequestHandler
+from hashlib import sha1
+from mimetools import Message
+from StringIO import StringIO
+from tempfile import gettempdir, mkstemp
+from time import time
+
+from proxy import Interceptor, Response
+
+__all__ = [
+    'Rule',
+    'ReplayInterceptor'
+]
+
+# Hop-by-hop headers and headers set again when the response is replayed
+_DROPPED_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'content-length',
+                              'te', 'trailer', 'upgrade'])
+
+
+def _message(items):
+    return Message(StringIO(''.join('%s: %s\r\n' % item for item in items) + '\r\n'))
+
+
+def _write_atomic(file_path, data):
+    # Concurrent readers see either the old file or the complete new one
+    directory = os.path.dirname(file_path)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by other thread meanwhile
+            pass
+    fd, tmp = mkstemp(dir=directory, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    if os.name == 'nt' and os.path.exists(file_path):
+        os.remove(file_path)
+    os.rename(tmp, file_path)
+
+
+class Rule(object):
+    '''
+    Rule of `ReplayInterceptor`, `url` is regular expression searched in request URL. Default ports are not part of
+    the URL, like in the browser.
+    '''
+
+    def __init__(self, url, action='cache', methods=None, ttl=None, offline=False, fixture=None, status=200,
+                 headers=None, max_size=10 * 1024 * 1024):
+        if action not in ('cache', 'fixture', 'pass'):
+            raise ValueError('Unknown rule action %r' % action)
+        if action == 'fixture' and not fixture:
+            raise ValueError('Fixture rule of %r does not define fixture file' % url)
+        self.url = re.compile(url)
+        self.action = action
+        # Only safe requests are cached by default, fixtures answer any method
+        self.methods = set(m.upper() for m in methods) if methods else ('GET',) if action == 'cache' else None
+        self.ttl = ttl
+        self.offline = offline
+        self.fixture = fixture
+        self.status = int(status)
+        self.headers = headers or {}
+        self.max_size = max_size
+
+    def matches(self, request):
+        return (self.methods is None or request.command in self.methods) and self.url.search(request.url) is not None
+
+
+class ReplayInterceptor(Interceptor):
+    '''
+    Interceptor answering requests matched by `rules` from cache in `cache_dir` or fixtures in `fixtures_dir`.
+    `hits`, `misses` and `recorded` count cache lookups and responses stored.
+    '''
+
+    def __init__(self, rules, cache_dir=None, fixtures_dir=None):
+        if isinstance(rules, basestring):
+            fixtures_dir = fixtures_dir or os.path.dirname(os.path.abspath(rules))
+            with open(rules) as f:
+                rules = json.load(f)
+        self.rules = [r if isinstance(r, Rule) else Rule(**dict((str(k), v) for k, v in r.iteritems()))
+                      for r in rules]
+        self.cache_dir = cache_dir or os.path.join(gettempdir(), 'proxy_replay_cache')
+        self.fixtures_dir = fixtures_dir or os.getcwd()
+        self.hits = self.misses = self.recorded = 0
+
+    def match_request(self, request):
+        return self._rule(request) is not None
+
+    def on_request(self, request):
+        rule = self._rule(request)
+        if rule.action == 'fixture':
+            return self._fixture(request, rule)
+        if rule.action == 'cache':
+            response = self._lookup(request, rule)
+            if response is not None:
+                self.hits += 1
+                return response
+            self.misses += 1
+            if rule.offline:
+                return Response(request, 504, 'Not Recorded', _message([('Content-Type', 'text/plain')]),
+                                'Response of %s %s was not recorded' % (request.command, request.url))
+        return None
+
+    def match_response(self, response):
+        # Misses of cache rules are recorded, responses answered by interceptors come with body already
+        if response.body is not None:
+            return False
+        rule = self._rule(response.request)
+        return rule is not None and rule.action == 'cache' and 200 <= response.status < 400 \
+            and response.status not in (206, 304) and 'no-store' not in response.headers.get('Cache-Control', '')
+
+    def on_response_head(self, response):
+        response.context['replay_rule'] = self._rule(response.request)
+        response.context['replay_body'] = []
+        response.context['replay_size'] = 0
+
+    def on_response_chunk(self, response, chunk):
+        body = response.context['replay_body']
+        if body is not None:
+            response.context['replay_size'] += len(chunk)
+            if response.context['replay_size'] > response.context['replay_rule'].max_size:
+                # Too big to be kept, relayed only
+                response.context['replay_body'] = None
+            else:
+                body.append(chunk)
+        return chunk
+
+    def on_response_end(self, response, complete):
+        body = response.context['replay_body']
+        if complete and body is not None:
+            try:
+                self._store(response, ''.join(body))
+                self.recorded += 1
+            except (IOError, OSError), e:
+                print 'Response of %s was not recorded: %s' % (response.request.url, e)
+
+    def prune(self):
+        '''
+        Removes cache entries older than TTL of their rule or not matched by any rule, and bodies no longer
+        referenced by any entry.
+        '''
+        index_dir = os.path.join(self.cache_dir, 'index')
+        objects_dir = os.path.join(self.cache_dir, 'objects')
+        referenced = set()
+        now = time()
+        for name in os.listdir(index_dir) if os.path.exists(index_dir) else ():
+            entry_path = os.path.join(index_dir, name)
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+            except (IOError, ValueError):
+                continue
+            rules = [r for r in self.rules if r.action == 'cache' and r.url.search(entry['url'])]
+            if not rules or rules[0].ttl is not None and now - entry['stored'] > rules[0].ttl:
+                os.remove(entry_path)
+            else:
+                referenced.add(entry['body'])
+        for prefix in os.listdir(objects_dir) if os.path.exists(objects_dir) else ():
+            for name in os.listdir(os.path.join(objects_dir, prefix)):
+                if prefix + name not in referenced:
+                    os.remove(os.path.join(objects_dir, prefix, name))
+
+    def _rule(self, request):
+        for rule in self.rules:
+            if rule.matches(request):
+                return None if rule.action == 'pass' else rule
+        return None
+
+    def _key(self, request):
+        return sha1('%s %s\n%s' % (request.command, request.url, sha1(request.body).hexdigest())).hexdigest()
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest[2:])
+
+    def _index_path(self, request):
+        return os.path.join(self.cache_dir, 'index', self._key(request) + '.json')
+
+    def _lookup(self, request, rule):
+        try:
+            with open(self._index_path(request)) as f:
+                entry = json.load(f)
+            if rule.ttl is not None and time() - entry['stored'] > rule.ttl:
+                return None
+            with open(self._object_path(entry['body']), 'rb') as f:
+                body = f.read()
+        except (IOError, ValueError, KeyError):
+            return None
+        headers = _message([(str(name), str(value)) for name, value in entry['headers']] +
+                           [('X-Proxy-Replay', 'cache')])
+        return Response(request, entry['status'], str(entry['reason']), headers, body)
+
+    def _store(self, response, body):
+        digest = sha1(body).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            _write_atomic(object_path, body)
+        headers = [line.rstrip('\r\n').split(':', 1) for line in response.headers.headers
+                   if ':' in line and not line[0].isspace()]
+        entry = {
+            'url': response.request.url,
+            'method': response.request.command,
+            'status': response.status,
+            'reason': response.reason,
+            'headers': [(name, value.strip()) for name, value in headers if name.lower() not in _DROPPED_HEADERS],
+            'body': digest,
+            'stored': time(),
+        }
+        _write_atomic(self._index_path(response.request), json.dumps(entry))
+
+    def _fixture(self, request, rule):
+        fixture_path = os.path.join(self.fixtures_dir, rule.fixture)
+        try:
+            with open(fixture_path, 'rb') as f:
+                body = f.read()
+        except IOError, e:
+            return Response(request, 500, 'Fixture Not Found', _message([('Content-Type', 'text/plain')]), str(e))
+        items = [(str(name), str(value)) for name, value in rule.headers.iteritems()]
+        if not any(name.lower() == 'content-type' for name, _ in items):
+            items.append(('Content-Type', mimetypes.guess_type(fixture_path)[0] or 'application/octet-stream'))
+        items.append(('X-Proxy-Replay', 'fixture'))
+        reason = BaseHTTPRequestHandler.responses.get(rule.status, ('Fixture',))[0]
+        return Response(request, rule.status, reason, _message(items), body)
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from httplib import HTTPConnection
+from mimetools import Message
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn
+from time import sleep, time
+
+from proxy import AsyncMitmProxy, Request
+from replay import ReplayInterceptor
+
+# Rules of the module documentation
+_DOCUMENTED_RULES = [
+    {'url': '^https?://fonts\\.googleapis\\.com/', 'ttl': 86400},
+    {'url': '/api/config$', 'action': 'fixture', 'fixture': 'config.json'},
+    {'url': '^https://cdn\\.example\\.com/', 'offline': True},
+]
+
+
+def _request(url, command='GET'):
+    scheme, _, rest = url.partition('://')
+    netloc, _, path = rest.partition('/')
+    hostname, _, port = netloc.partition(':')
+    port = port or (443 if scheme == 'https' else 80)
+    return Request(command, '/' + path, 'HTTP/1.1', Message(StringIO('Host: %s\r\n\r\n' % netloc)), '', hostname,
+                   port, scheme == 'https')
+
+
+class _DestinationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        body = 'response of %s' % self.path
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _get(proxy, url):
+    connection = HTTPConnection(*proxy.server_address)
+    try:
+        connection.request('GET', url)
+        response = connection.getresponse()
+        return response.status, response.getheader('X-Proxy-Replay'), response.read()
+    finally:
+        connection.close()
+
+
+def test_url_leaves_out_default_port():
+    assert _request('https://fonts.googleapis.com/css').url == 'https://fonts.googleapis.com/css'
+    assert _request('http://example.com/').url == 'http://example.com/'
+    assert _request('http://example.com:8080/a').url == 'http://example.com:8080/a'
+    assert _request('https://example.com:80/a').url == 'https://example.com:80/a'
+
+
+def test_documented_rules():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'config.json'), 'w') as f:
+            f.write('{"debug": true}')
+        with open(os.path.join(directory, 'rules.json'), 'w') as f:
+            json.dump(_DOCUMENTED_RULES, f)
+        replay = ReplayInterceptor(os.path.join(directory, 'rules.json'), os.path.join(directory, 'cache'))
+
+        fonts = _request('https://fonts.googleapis.com/css?family=Roboto')
+        assert replay.match_request(fonts)
+        assert replay.on_request(fonts) is None, 'Not recorded response is fetched'
+        assert not replay.match_request(_request('https://fonts.googleapis.com/css', 'POST'))
+
+        config = replay.on_request(_request('http://app.example.com:8080/api/config', 'POST'))
+        assert (config.status, config.body) == (200, '{"debug": true}')
+        assert config.headers['Content-Type'] == 'application/json'
+
+        offline = replay.on_request(_request('https://cdn.example.com/lib.js'))
+        assert offline.status == 504
+        assert not replay.match_request(_request('https://cdn.example.com.evil.org/lib.js'))
+        assert not replay.match_request(_request('http://example.com/'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_replay_through_proxy():
+    directory = tempfile.mkdtemp()
+    destination = _serve(_Server(('127.0.0.1', 0), _DestinationHandler))
+    proxy = _serve(AsyncMitmProxy(server_address=('127.0.0.1', 0), ca_file=os.path.join(directory, 'ca.pem')))
+    proxy.daemon_threads = True
+    try:
+        base = 'http://127.0.0.1:%d' % destination.server_address[1]
+        replay = ReplayInterceptor([{'url': '^http://127\\.0\\.0\\.1:\\d+/static/'}], os.path.join(directory, 'cache'))
+        proxy.register_interceptor(replay)
+
+        assert _get(proxy, base + '/static/app.js') == (200, None, 'response of /static/app.js')
+        # Response is stored after it is relayed to the client
+        deadline = time() + 5
+        while not replay.recorded and time() < deadline:
+            sleep(0.01)
+        assert _get(proxy, base + '/static/app.js') == (200, 'cache', 'response of /static/app.js')
+        assert _get(proxy, base + '/api/data') == (200, None, 'response of /api/data')
+        assert _DestinationHandler.requests == ['/static/app.js', '/api/data']
+        assert (replay.hits, replay.misses, replay.recorded) == (1, 1, 1)
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
+        destination.shutdown()
+        destination.server_close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test_url_leaves_out_default_port()
+    test_documented_rules()
+    test_replay_through_proxy()
@@ -8,6 +8,26 @@
   - `custom_field_id` - id Zephyr test cases custom field where test case id should be stored
   - `project_key` - test cases project key
 
+ Optional keys:
+  - `workers` - number of background threads reporting results, 4 by default. Results of each suite are reported
+    in background while next suites are executed, all of them are reported before output file is processed.
+    Set it to 0 to report synchronously at the end of each suite. Failures of background reporting and of logs
+    upload are logged as execution errors when run ends. Robot Framework ignores errors of listeners, so they
+    do not change the run result.
+  - `lookup_cache` - path to json file where looked up Jira projects, versions, test cycles and issues ids are kept
+    between runs. Within one run every lookup is done only once regardless of this setting.
+  - `lookup_cache_ttl` - time in seconds entries of `lookup_cache` file are valid, 86400 (one day) by default.
+  - `spool` - path to spool file. If set, nothing is sent to Jira during the run, results of each suite are appended
+    to this JSON Lines file instead and should be reported later by replay tool:
+    |python -m zephyr.replay <spool> --password <passwd>
+    Execution logs are not uploaded in this mode.
+  - `link_cache` - path to json file where links of test issues are remembered between runs. Links of test are
+    not checked in Jira if they were not changed since last run. Links of all tests are checked if not set.
+  - `link_cache_ttl` - time in seconds entries of `link_cache` file are valid, 86400 (one day) by default.
+  - `timeout` - Jira requests timeout in seconds, 60 by default. Requests answered with 429 code, and idempotent
+    ones answered with 5xx codes, are retried few times with growing delay. Time spent in requests to each
+    endpoint is logged when run ends.
+
  Example definition:
 
  |ZEPHYR = Dotable.parse({
@@ -24,19 +44,31 @@
 import multiprocessing
 import os
 import re
-from urllib2 import Request, urlopen
-from json import dumps, load
+import copy
+import mimetypes
+import shutil
+import time
+import uuid
+from functools import wraps
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from StringIO import StringIO
+from collections import defaultdict, OrderedDict
+from hashlib import sha1
+from tempfile import mkdtemp
+from json import dump, dumps, load, loads
 from base64 import b64encode
-from requests.auth import HTTPBasicAuth
+from requests import HTTPError, Session
+from requests.adapters import HTTPAdapter
+from robot.api import logger as robot_logger
 from robot.libraries.BuiltIn import BuiltIn
 from robot.libraries.String import String
-import urllib2
 import logging
 import logging.config
 import sys
-from robot import rebot_cli
-from requests import post
-from . util import escape_string, update_dict_recursively
+from robot import rebot
+from . util import update_dict_recursively
+from . output_splitter import split_output
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -60,11 +92,28 @@ _NO_LOGS_UPLOAD = 'No Logs Upload'
 _SKIP_STEPS = 'Skip Steps'
 _METADATA = 'metadata'
 _IS_WINDOWS = os.name == 'nt'  # cygwin will produce 'posix' here and this is expected behavior.
+_DEFAULT_WORKERS = 4
+_MAX_CONNECTIONS = 32
+_DEFAULT_LOOKUP_CACHE_TTL = 86400
+_MAX_CONCURRENT_REQUESTS = 8
+_MAX_CONCURRENT_UPLOADS = 4
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+_SEARCH_PAGE_SIZE = 1000
+_LINKS_SEARCH_SIZE = 100
+_DEFAULT_LINK_CACHE_TTL = 86400
+_SPOOLED_VARIABLES = ('${ATTACHMENT_PATHS}', '${SUITE NAME}')
+_DEFAULT_TIMEOUT = 60
+_RETRIES = 3
+_RETRY_DELAY = 1
+_MAX_RETRY_DELAY = 30
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Request failed with 5xx code may have been applied, only these are sent again
+_IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
 
 
 class ZephyrError(Exception):
     '''
-    Zephyr error. Translates urllib2.HTTPError into specific format for diagnostics.
+    Zephyr error. Translates requests.HTTPError into specific format for diagnostics.
     '''
     __BASE_MSG = 'Zephyr request failed with code %s: %s\n      %s'
     __LICENSE_MSG = 'Possibly Zephyr licence has expired. Code: %s: %s\n        %s'
@@ -72,13 +121,14 @@ class ZephyrError(Exception):
     def __init__(self, error):
         if isinstance(error, Exception):
             base_exception = error
-            if isinstance(base_exception, urllib2.HTTPError):
-                if base_exception.code == 403 or base_exception.code == 405:
-                    self.message = self.__LICENSE_MSG % (base_exception.code, base_exception.msg, base_exception.read())
+            if isinstance(base_exception, HTTPError) and base_exception.response is not None:
+                response = base_exception.response
+                if response.status_code == 403 or response.status_code == 405:
+                    self.message = self.__LICENSE_MSG % (response.status_code, response.reason, response.text)
                 else:
-                    self.message = self.__BASE_MSG % (base_exception.code, base_exception.msg, base_exception.read())
+                    self.message = self.__BASE_MSG % (response.status_code, response.reason, response.text)
             else:
-                self.message = base_exception.message
+                self.message = base_exception.message or str(base_exception)
         else:
             self.message = error
 
@@ -86,6 +136,312 @@ class ZephyrError(Exception):
         return self.message
 
 
+class _ReportQueue(object):
+    '''
+    Runs reporting jobs on bounded pool of background threads, so tests execution is not blocked by Jira.
+    Jobs errors are logged and raised together as one ZephyrError when queue is drained. With no workers jobs are
+    run synchronously.
+    '''
+
+    def __init__(self, workers=_DEFAULT_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._results = []
+        self._lock = Lock()
+
+    def submit(self, func, *args):
+        '''
+        Submits job.
+
+        :param func: job function
+        :param args: job arguments
+        '''
+        if self.workers <= 0:
+            func(*args)
+            return
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            self._results.append(self._pool.apply_async(func, args))
+
+    def drain(self):
+        '''
+        Waits for all submitted jobs to finish.
+
+        :raises ZephyrError: if any of the jobs failed
+        '''
+        with self._lock:
+            if self._pool is None:
+                return
+            pool, results = self._pool, self._results
+            self._pool, self._results = None, []
+        pool.close()
+        pool.join()
+        errors = []
+        for result in results:
+            try:
+                result.get()
+            except Exception as e:
+                errors.append(ZephyrError(e))
+                logger.error('Reporting to Zephyr failed: %s', errors[-1])
+        if errors:
+            raise ZephyrError('%d of %d jobs failed, first error: %s'
+                              % (len(errors), len(results), errors[0]))
+
+
+class _LookupCache(object):
+    '''
+    Memoizes Jira/Zephyr lookups for the whole run, so same lookup never hits Jira twice. Concurrent lookups
+    of the same key wait for the first one. Missing (None) values are not cached.
+
+    Entries can be persisted to json file and reused by next runs until they are older than `ttl` seconds.
+    '''
+
+    def __init__(self):
+        self.path = None
+        self.ttl = _DEFAULT_LOOKUP_CACHE_TTL
+        self._entries = {}
+        self._locks = {}
+        self._lock = Lock()
+        self._dirty = False
+
+    def get(self, key, loader):
+        '''
+        Returns cached value or loads and caches it.
+
+        :param key: tuple of lookup name, Jira URL and arguments
+        :param loader: function returning value
+        :return: value
+        '''
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key][1]
+            key_lock = self._locks.setdefault(key, Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key][1]
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+            return value
+
+    def put(self, key, value):
+        '''
+        Stores value.
+
+        :param key: tuple of lookup name and arguments
+        :param value: value
+        '''
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._dirty = True
+
+    def find(self, key):
+        '''
+        Returns cached value without loading it.
+
+        :param key: tuple of lookup name and arguments
+        :return: value or None if missing
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def load(self, path, ttl=_DEFAULT_LOOKUP_CACHE_TTL):
+        '''
+        Loads not expired entries from file, which is also used by `save` later.
+
+        :param path: json file path
+        :param ttl: entries time to live in seconds
+        '''
+        self.path = path
+        self.ttl = ttl
+        if not os.path.isfile(path):
+            return
+        try:
+            with open(path) as f:
+                entries = load(f)
+        except (IOError, ValueError) as e:
+            logger.warning('Lookup cache %s is not loaded: %s', path, e)
+            return
+        now = time.time()
+        with self._lock:
+            for key, (stamp, value) in entries.iteritems():
+                key = tuple(loads(key))
+                if now - stamp < ttl and key not in self._entries:
+                    self._entries[key] = (stamp, value)
+
+    def save(self):
+        '''
+        Saves entries to file they were loaded from, if any.
+        '''
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            entries = dict((dumps(list(key)), entry) for key, entry in self._entries.iteritems())
+            self._dirty = False
+        try:
+            with open(self.path, 'w') as f:
+                dump(entries, f)
+        except IOError as e:
+            logger.warning('Lookup cache %s is not saved: %s', self.path, e)
+
+
+class _JiraClient(object):
+    '''
+    Jira/Zephyr REST client shared by all reporting threads. Connections are kept alive and pooled, responses
+    are requested compressed, requests answered with 429 or 5xx codes are retried with growing delay.
+    Time spent in requests is collected per endpoint, ids in paths are replaced by `{id}`.
+    '''
+
+    def __init__(self):
+        self.base_url = ''
+        self.timeout = _DEFAULT_TIMEOUT
+        self.retries = _RETRIES
+        self._session = Session()
+        self._session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+        for prefix in ('http://', 'https://'):
+            self._session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=_MAX_CONNECTIONS))
+        self._metrics = defaultdict(lambda: [0, 0.0, 0.0])
+        self._lock = Lock()
+
+    def configure(self, base_url, user, password, timeout=_DEFAULT_TIMEOUT):
+        '''
+        Sets connection settings.
+
+        :param base_url: Jira URL
+        :param user: Jira user name
+        :param password: it's password
+        :param timeout: requests timeout in seconds
+        '''
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._session.headers['Authorization'] = 'Basic ' + b64encode(user + ':' + password)
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params=params)
+
+    def post(self, path, json_data=None, **kwargs):
+        return self.request('POST', path, json_data, **kwargs)
+
+    def put(self, path, json_data=None):
+        return self.request('PUT', path, json_data)
+
+    def delete(self, path):
+        return self.request('DELETE', path)
+
+    def request(self, method, path, json_data=None, params=None, data=None, headers=None):
+        '''
+        Sends request and returns decoded json response, None if response is empty.
+
+        :param method: HTTP method
+        :param path: path relative to Jira URL
+        :param json_data: object sent as json body
+        :param params: query parameters
+        :param data: raw body, not retried if it is file-like
+        :param headers: additional headers
+        :raises requests.HTTPError: if response status is error one
+        '''
+        headers = dict(headers or {})
+        if json_data is not None:
+            data = dumps(json_data)
+            headers['Content-Type'] = 'application/json'
+        retries = 0 if hasattr(data, 'read') else self.retries
+        endpoint = re.sub(r'(?<!/api)/(?:[A-Z][A-Z0-9_]*-)?\d+(?=/|$)', '/{id}', path)
+        attempt = 0
+        while True:
+            started = time.time()
+            response = self._session.request(method, self.base_url + path, params=params, data=data,
+                                             headers=headers, timeout=self.timeout)
+            self._record(method + ' ' + endpoint, time.time() - started)
+            if response.status_code not in _RETRY_STATUSES or attempt >= retries \
+                    or response.status_code != 429 and method not in _IDEMPOTENT_METHODS:
+                break
+            delay = self._retry_delay(response, attempt)
+            logger.warning('%s %s answered %s, retrying in %s s', method, path, response.status_code, delay)
+            time.sleep(delay)
+            attempt += 1
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+    def metrics(self):
+        '''
+        Returns list of (endpoint, requests count, total seconds, max seconds) tuples, slowest first.
+        '''
+        with self._lock:
+            items = [(endpoint,) + tuple(values) for endpoint, values in self._metrics.iteritems()]
+        return sorted(items, key=lambda item: item[2], reverse=True)
+
+    def log_metrics(self):
+        '''
+        Logs time spent in requests to each endpoint.
+        '''
+        for endpoint, count, total, longest in self.metrics():
+            logger.info('Jira %s: %s requests, %.2f s total, %.2f s max', endpoint, count, total, longest)
+
+    def _record(self, endpoint, elapsed):
+        with self._lock:
+            values = self._metrics[endpoint]
+            values[0] += 1
+            values[1] += elapsed
+            values[2] = max(values[2], elapsed)
+
+    @staticmethod
+    def _retry_delay(response, attempt):
+        try:
+            delay = float(response.headers.get('Retry-After', ''))
+        except ValueError:
+            delay = _RETRY_DELAY * 2 ** attempt
+        return min(delay, _MAX_RETRY_DELAY)
+
+
+def _collect_errors(errors, action, func, *args):
+    '''
+    Calls `func` with `args`, its error is appended to `errors` instead of being raised.
+    '''
+    try:
+        func(*args)
+    except Exception as e:
+        errors.append(ZephyrError('%s failed: %s' % (action, ZephyrError(e))))
+
+
+def _log_errors(errors):
+    '''
+    Logs errors of reporting as execution errors of Robot run.
+    '''
+    for error in errors:
+        robot_logger.error(str(error))
+
+
+def _lookup_key(name, *args):
+    '''
+    Returns lookup cache key, ids are specific to Jira instance, so its URL is part of the key.
+    '''
+    return (name, _Zephyr.baseURL) + args
+
+
+def _cached_lookup(func):
+    '''
+    Decorates lookup function, so its results are memoized by Jira URL and arguments in lookup cache.
+    '''
+    @wraps(func)
+    def wrapper(*args):
+        return _LOOKUPS.get(_lookup_key(func.__name__, *args), lambda: func(*args))
+    return wrapper
+
+
+_REPORT_QUEUE = _ReportQueue()
+_UPLOAD_QUEUE = _ReportQueue(_MAX_CONCURRENT_UPLOADS)
+_LOOKUPS = _LookupCache()
+_JIRA = _JiraClient()
+_LINK_FINGERPRINTS = _LookupCache()
+_CYCLE_LOCK = Lock()
+_SPOOL_LOCK = Lock()
+_TEST_ISSUES = {}
+_TEST_ISSUES_LOCK = Lock()
+
+
 class _MetadataContext(object):
     '''
     Stores metadata in directory-like structure.
@@ -131,26 +487,36 @@ class _MetadataContext(object):
         '''
         if isinstance(parent, _MetadataContext):
             self.__parent = parent
+            self.__root = parent.__root
         else:
             self.__parent = None
+            self.__root = self
+            self.__version = 0
         self.__name = name
         self.__lookup = {}
         self.__values = {}
+        self.__merged = None
+        self.__merged_version = -1
 
     def lookup(self, p):
         '''
         Looks for context by specified path, then merge all metadata this path possessed.
+        Missing nodes are not created, metadata of the closest existing ancestor is returned instead.
 
         :param p: path
-        :return: metadata
+        :return: copy of metadata
         '''
-        return self.__lookup_ctx(_MetadataContext.__normalize_path(p)).__merge()
+        merged = self.__lookup_ctx(_MetadataContext.__normalize_path(p), False).__merge()
+        if isinstance(merged, dict):
+            return merged.copy()
+        return merged
 
-    def __lookup_ctx(self, p):
+    def __lookup_ctx(self, p, create=True):
         '''
         Looks recursively for context by specified path.
 
         :param p: path
+        :param create: whether to create missing nodes, otherwise the closest existing one is returned
         :return: context
         '''
         if p == self.__name:
@@ -166,11 +532,13 @@ class _MetadataContext(object):
             (head, tail) = p.split('/', 1)
 
         if head not in self.__lookup:
+            if not create:
+                return self
             self.__lookup[head] = _MetadataContext(head, self)
 
         ctx = self.__lookup[head]
 
-        return ctx.__lookup_ctx(tail)
+        return ctx.__lookup_ctx(tail, create)
 
     def put(self, p, v):
         '''
@@ -181,26 +549,42 @@ class _MetadataContext(object):
         :param p: path
         :param v: data
         '''
-        ctx = self.__lookup_ctx(_MetadataContext.__normalize_path(p))
-        if not isinstance(ctx, _MetadataContext):
-            raise Exception
-        if hasattr(v, 'copy'):
-            v = v.copy()
-        ctx.__values = v
+        self.put_all([(p, v)])
+
+    def put_all(self, items):
+        '''
+        Puts values into tree, e.g. metadata of whole suites tree at once.
+
+        :param items: iterable of (path, data) pairs
+        '''
+        for p, v in items:
+            ctx = self.__lookup_ctx(_MetadataContext.__normalize_path(p))
+            if not isinstance(ctx, _MetadataContext):
+                raise Exception
+            if hasattr(v, 'copy'):
+                v = v.copy()
+            ctx.__values = v
+        # Merged metadata of all nodes is recalculated on next lookup.
+        self.__root.__version += 1
 
     def __merge(self):
         '''
         Merges all metadatas (if it is dictionary) in this path. Low level metadata overrides higher level.
+        Result is cached until next `put`, so it must not be modified.
 
         :return: metadata
         '''
         if not isinstance(self.__values, dict):
             return self.__values
-        d = {}
-        if self.__parent:
-            d = self.__parent.__merge()
-        d.update(self.__values)
-        return d
+        version = self.__root.__version
+        if self.__merged_version != version:
+            d = {}
+            if self.__parent:
+                d = self.__parent.__merge().copy()
+            d.update(self.__values)
+            self.__merged = d
+            self.__merged_version = version
+        return self.__merged
 
     @staticmethod
     def __normalize_path(p):
@@ -257,7 +641,7 @@ class ZephyrLibrary(object):
         """
         try:
             self.__delegate.end_suite(name, attrs)
-        except urllib2.HTTPError as e:
+        except HTTPError as e:
             raise ZephyrError(e)
         finally:
             metadata = attrs[_METADATA]
@@ -276,7 +660,7 @@ class ZephyrLibrary(object):
     def end_test(self, name, attrs):
         try:
             self.__delegate.end_test(name, attrs)
-        except urllib2.HTTPError as e:
+        except HTTPError as e:
             raise ZephyrError(e)
 
     def message(self, message):
@@ -287,18 +671,29 @@ class ZephyrLibrary(object):
 
     def output_file(self, path):
         """
-        Asynchronously generate test output and attach it to Zephyr test execution log
+        Generate logs of reported tests and attach them to Zephyr test executions and step results
         """
-        if self.__no_logs_upload:
-            return
-
-        zephyrSettings = {'baseURL': _Zephyr.baseURL, '_username': _Zephyr._username, '_password': _Zephyr._password}
+        errors = []
+        _collect_errors(errors, 'Reporting results to Zephyr', _REPORT_QUEUE.drain)
+        _LOOKUPS.save()
+        _LINK_FINGERPRINTS.save()
+        if self.__no_logs_upload or not self.__delegate.steps:
+            _collect_errors(errors, 'Uploading logs to Zephyr', _UPLOAD_QUEUE.drain)
+        else:
+            _collect_errors(errors, 'Uploading logs to Zephyr', _upload_logs, path, self.__delegate.steps)
+        _log_errors(errors)
 
-        p = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-        for step in self.__delegate.steps:
-            p.apply_async(gen_report, (zephyrSettings, path, step))
-        p.close()
-        p.join()
+    def close(self):
+        """
+        Wait for results reporting and attachments uploading to finish
+        """
+        errors = []
+        _collect_errors(errors, 'Reporting results to Zephyr', _REPORT_QUEUE.drain)
+        _collect_errors(errors, 'Uploading logs to Zephyr', _UPLOAD_QUEUE.drain)
+        _LOOKUPS.save()
+        _LINK_FINGERPRINTS.save()
+        _JIRA.log_metrics()
+        _log_errors(errors)
 
     @staticmethod
     def lookup(prefix, path):
@@ -308,6 +703,26 @@ class ZephyrLibrary(object):
     def store(prefix, path, value):
         return ZephyrLibrary._CTX.put(prefix + '$' + path, value)
 
+    @staticmethod
+    def store_all(prefix, items):
+        return ZephyrLibrary._CTX.put_all((prefix + '$' + path, value) for path, value in items)
+
+    @staticmethod
+    def store_suite_metadata(suite):
+        '''
+        Stores metadata of all suites in tree at once, e.g. from pre-run modifier or parsed output.
+
+        :param suite: robot suite model with `source`, `metadata` and `suites` attributes
+        '''
+        items = []
+        suites = [suite]
+        while suites:
+            s = suites.pop()
+            if s.source:
+                items.append((s.source, dict(s.metadata)))
+            suites.extend(s.suites)
+        ZephyrLibrary.store_all('Metadata', items)
+
 
 class _Zephyr(object):
     baseURL = ''
@@ -321,6 +736,8 @@ class _Zephyr(object):
         self._empty_suite = True
         self._test_results = {}
         self._metadata = {}
+        self._variables = {}
+        self._links = {}
 
     def init_vars(self):
         if not _Zephyr.baseURL:
@@ -329,6 +746,18 @@ class _Zephyr(object):
             _Zephyr._username = self._zephyr_settings.user
         if not _Zephyr._password:
             _Zephyr._password = self._zephyr_settings.passwd
+        if not _JIRA.base_url:
+            _JIRA.configure(_Zephyr.baseURL, _Zephyr._username, _Zephyr._password,
+                            float(self._zephyr_settings.get('timeout', _DEFAULT_TIMEOUT)))
+        _REPORT_QUEUE.workers = int(self._zephyr_settings.get('workers', _DEFAULT_WORKERS))
+        lookup_cache = self._zephyr_settings.get('lookup_cache')
+        if lookup_cache and lookup_cache != _LOOKUPS.path:
+            _LOOKUPS.load(lookup_cache, float(self._zephyr_settings.get('lookup_cache_ttl',
+                                                                        _DEFAULT_LOOKUP_CACHE_TTL)))
+        link_cache = self._zephyr_settings.get('link_cache')
+        if link_cache and link_cache != _LINK_FINGERPRINTS.path:
+            _LINK_FINGERPRINTS.load(link_cache, float(self._zephyr_settings.get('link_cache_ttl',
+                                                                              _DEFAULT_LINK_CACHE_TTL)))
 
     def _process_test_cases(self, project_key, version_id, cycle_id, suite_summary, suite_description,
                             issue_custom_field, issue_custom_field_val, execution_log, execution_status):
@@ -393,20 +822,25 @@ class _Zephyr(object):
         execution_id = self._process_execution(project_id, version_id, cycle_id, issue_id, execution_status,
                                                execution_log)
 
-        if bool(self._metadata.get('Attachfile', False)) and '${ATTACHMENT_PATHS}' in self._robot_vars:
-            suite_name = self._robot_vars['${SUITE NAME}']
-            if suite_name in self._robot_vars['${ATTACHMENT_PATHS}']:
-                path_to_file = self._robot_vars['${ATTACHMENT_PATHS}'][suite_name]
-                p = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-                p.apply_async(_zephyr_attach_test_execution_log, ({'baseURL': _Zephyr.baseURL, '_username': _Zephyr._username,
-                                                                   '_password': _Zephyr._password}, execution_id, path_to_file))
-                p.close()
-                p.join()
-                logger.info('Attachment uploaded: %s', path_to_file)
+        attachment_paths = self._get_variable('${ATTACHMENT_PATHS}', cached=True)
+        if bool(self._metadata.get('Attachfile', False)) and attachment_paths is not None:
+            suite_name = self._get_variable('${SUITE NAME}', cached=True)
+            if suite_name in attachment_paths:
+                self._attach_execution_file(execution_id, attachment_paths[suite_name])
 
         if not self.skip_steps:
             self._process_test_steps(issue_id, execution_id, self._get_test_steps(issue_summary))
 
+    def _attach_execution_file(self, execution_id, path):
+        '''
+        Queues file upload to test execution attachments. Uploads are finished on `close` or `output_file`.
+
+        :param execution_id:
+        :param path: file path
+        '''
+        _UPLOAD_QUEUE.submit(_zephyr_attach_test_execution_log, execution_id, path)
+        logger.info('Attachment upload queued: %s', path)
+
     def _process_test_suite(self, project_key, suite_summary, suite_description, issue_custom_field,
                             issue_custom_field_val, execution_status, execution_log):
         """
@@ -434,6 +868,56 @@ class _Zephyr(object):
         self._process_test_cases(project_key, version_id, cycle_id, suite_summary, suite_description,
                                  issue_custom_field, issue_custom_field_val, execution_log, execution_status)
 
+    def _report_test_suite(self, default_project_key, suite_summary, suite_description, issue_custom_field,
+                           issue_custom_field_val, execution_status, execution_log):
+        '''
+        Reports test suite results. Called on snapshot of listener state taken at the end of suite.
+        Links of all processed issues are updated at once at the end.
+        '''
+        self._links = {}
+        project_key = self._get_project_key(default_project_key)
+        self._process_test_suite(project_key, suite_summary, suite_description, issue_custom_field,
+                                 issue_custom_field_val, execution_status, execution_log)
+        _jira_update_links(self._links)
+
+    def _spool_test_suite(self, path, args):
+        '''
+        Appends test suite reporting job with snapshot of listener state to spool file.
+
+        :param path: spool file path
+        :param args: `_report_test_suite` arguments
+        '''
+        job = {
+            'id': uuid.uuid4().hex,
+            'listener': type(self).__name__,
+            'baseURL': _Zephyr.baseURL,
+            'user': _Zephyr._username,
+            'args': args,
+            'state': {
+                '_metadata': self._metadata,
+                '_test_results': self._test_results,
+                '_test_steps': getattr(self, '_test_steps', {}),
+                '_variables': dict((name, self._variables.get(name)) for name in _SPOOLED_VARIABLES),
+            },
+        }
+        line = dumps(job)
+        with _SPOOL_LOCK:
+            with open(path, 'a') as f:
+                f.write(line + '\n')
+        logger.info('Test suite "%s" is spooled to %s', args[1], path)
+
+    @staticmethod
+    def _report_spooled_test_suite(job):
+        '''
+        Reports test suite job read from spool file.
+
+        :param job: job written by `_spool_test_suite`
+        '''
+        listener = _SPOOLED_LISTENERS[job['listener']]()
+        for name, value in job['state'].iteritems():
+            setattr(listener, name, value)
+        listener._report_test_suite(*job['args'])
+
     def _get_project_key(self, default_project_key):
         '''
         Extract project key from metadata or provided default value.
@@ -446,11 +930,7 @@ class _Zephyr(object):
             project_key = self._metadata['ProjectKey']
 
         if 'Project' in self._metadata:
-            project_name = self._metadata['Project']
-            project_key = ZephyrLibrary.lookup('Project', project_name)
-            if not project_key:
-                project_key = _get_project_key(self._metadata['Project'])
-                ZephyrLibrary.store('Project', project_name, project_key)
+            project_key = _get_project_key(self._metadata['Project'])
         logger.info('Get project key: %s', project_key)
         return project_key
 
@@ -463,25 +943,17 @@ class _Zephyr(object):
         '''
         version_id = None
         if 'Version' in self._metadata:
-            version = self._metadata['Version']
-            version_id = ZephyrLibrary.lookup('Version', version)
-            if not version_id:
-                version_id = _zephyr_get_version_id(project_key, version)
-                ZephyrLibrary.store('Version', version, version_id)
+            version_id = _zephyr_get_version_id(project_key, self._metadata['Version'])
         return version_id
 
     def _get_project_id(self, project_key):
         '''
-        Extracts version from metadata and obtains id for it.
+        Obtains project id for project key.
 
-        :param project_key: version project key
-        :return: version id or '-1' if metadata missing it
+        :param project_key: project key
+        :return: project id
         '''
-        project_id = ZephyrLibrary.lookup('ProjectKey', project_key)
-        if not project_id:
-            project_id = _get_project_id(project_key)
-            ZephyrLibrary.store('ProjectKey', project_key, project_id)
-        return project_id
+        return _get_project_id(project_key)
 
     def _get_components(self):
         '''
@@ -518,7 +990,7 @@ class _Zephyr(object):
         `issue_custom_field`/`issue_custom_field_val` pair. Otherwise creates new issue.
 
         - creates or updates Jira issue
-        - updates Jira issue links using `based_on` value
+        - collects Jira issue links using `based_on` value, they are updated at the end of suite
 
         :param project_key:
         :param issue_key:
@@ -534,7 +1006,7 @@ class _Zephyr(object):
                                              issue_custom_field, issue_custom_field_val, components)
         issue_id = _get_issue_id(issue_key)
 
-        _jira_update_links(issue_key, based_on, bugs)
+        self._links.setdefault(issue_key, []).extend(split_metadata_value(based_on) + bugs)
 
         return issue_id, issue_key
 
@@ -548,12 +1020,9 @@ class _Zephyr(object):
         :return: test cycle id
         '''
         cycle_name = self._get_test_cycle(issue_summary)
-        cycle_key = '%s_%s_%s' % (project_id, version_id, cycle_name)
-        cycle_id = ZephyrLibrary.lookup('CycleKey', cycle_key)
-        if not cycle_id:
-            cycle_id = _zephyr_create_test_cycle(project_id, version_id, cycle_name)
-            ZephyrLibrary.store('CycleKey', cycle_key, cycle_id)
-        return cycle_id
+        # Suites are reported concurrently, so make sure only one of them creates the cycle.
+        with _CYCLE_LOCK:
+            return _zephyr_create_test_cycle(project_id, version_id, cycle_name)
 
     def _process_execution(self, project_id, version_id, cycle_id, issue_id, execution_status,
                            execution_log):
@@ -580,19 +1049,18 @@ class _Zephyr(object):
         :param execution_id:
         :param steps:
         '''
-        for k, v in steps:
-            if _SKIP_STEPS in v['tags']:
-                continue
-            v['stepId'] = _zephyr_add_test_step(issue_id, k, v['params'], v['expected'])
-            # comment_str = v['comment'] + '\n' + 'log: \n' + v['log'] + '\n' + 'syslog: \n' + v['syslog']
-            execution_status = self._get_execution_status(v)
-            step_result_id = _zephyr_execute_test_step(v['stepId'], execution_id, execution_status, v['comment'])
-            if step_result_id and execution_status in ('PASS', 'FAIL'):
+        steps = [(k, v) for k, v in steps if _SKIP_STEPS not in v['tags']]
+        # comment_str = v['comment'] + '\n' + 'log: \n' + v['log'] + '\n' + 'syslog: \n' + v['syslog']
+        ids = _zephyr_sync_test_steps(issue_id, execution_id, [
+            (k, v['params'], v['expected'], self._get_execution_status(v), v['comment']) for k, v in steps])
+        for (k, v), (step_id, step_result_id) in zip(steps, ids):
+            v['stepId'] = step_id
+            if step_result_id and self._get_execution_status(v) in ('PASS', 'FAIL'):
                 self.steps.append({'stepResultId': step_result_id, 'longname': v['longname']})
 
     # robot listener interface
     def start_suite(self, name, attrs):
-        pass
+        self._invalidate_variables()
 
     def end_suite(self, name, attrs):
         """
@@ -603,25 +1071,30 @@ class _Zephyr(object):
                 self._metadata = ZephyrLibrary.lookup('Metadata', attrs['source'])
                 self._replace_variables_in_metadata()
                 logger.debug('End suite "%s", metadata: \n%s', name, self._metadata)
-                robot_vars = self._robot_vars
                 # here we hardcoded repository structure
                 robot_file = String().fetch_from_right(attrs['source'], 'robot{0}implementation{0}testsuites{0}'.format(
-                    robot_vars['${/}']))
-                robot_zephyr_vars = robot_vars['${ZEPHYR}']
-                project_key = self._get_project_key(robot_zephyr_vars.project_key)
+                    self._get_variable('${/}', cached=True)))
+                robot_zephyr_vars = self._zephyr_settings
                 suite_summary = attrs['longname']
                 suite_description = attrs['doc']
                 custom_field_id = str(robot_zephyr_vars.custom_field_id)
                 status = attrs['status']
                 message = attrs['statistics']
-
-                self._process_test_suite(project_key, suite_summary, suite_description,
-                                         custom_field_id, robot_file,
-                                         status, message)
+                # Reporting runs in background when robot context is gone, so resolve variables it needs now.
+                self._get_variable('${ATTACHMENT_PATHS}', cached=True)
+                self._get_variable('${SUITE NAME}', cached=True)
+
+                args = (robot_zephyr_vars.project_key, suite_summary, suite_description, custom_field_id, robot_file,
+                        status, message)
+                if robot_zephyr_vars.get('spool'):
+                    self._spool_test_suite(robot_zephyr_vars.spool, args)
+                else:
+                    _REPORT_QUEUE.submit(copy.copy(self)._report_test_suite, *args)
         finally:
             self._empty_suite = True
             self._test_results = {}
             self._metadata = {}
+            self._invalidate_variables()
 
     def start_keyword(self, name, attrs):
         """
@@ -637,12 +1110,14 @@ class _Zephyr(object):
                     self._current_test_name = None
 
     def end_keyword(self, name, attrs):
-        pass
+        if name.endswith(('Set Tags', 'Remove Tags')):
+            self._invalidate_variables()
 
     def start_test(self, name, attrs):
         """
         Init `_test_results` map
         """
+        self._invalidate_variables()
         self._current_test_name = name
         data = self._process_tags(attrs['tags'])
         res = {
@@ -668,14 +1143,15 @@ class _Zephyr(object):
         """
         Update `test_results`
         """
+        self._invalidate_variables()
         self._empty_suite = False
         res = self._test_results[name]
         res['status'] = attrs.get('status', res['status'])
         res['comment'] = attrs.get('message', res['comment'])
         res['tags'] = attrs.get('tags', res['tags'])
 
-        res['expected'] = self._robot_vars.get('${' + self._current_test_name + '_EXPECTED_RESULT}', 'PASS')
-        res['params'] = self._robot_vars.get('${' + self._current_test_name + '_TEST_DATA}', '')
+        res['expected'] = self._get_variable('${' + self._current_test_name + '_EXPECTED_RESULT}', 'PASS')
+        res['params'] = self._get_variable('${' + self._current_test_name + '_TEST_DATA}', '')
 
         # post process tags
         self._current_test_name = None
@@ -744,19 +1220,22 @@ class _Zephyr(object):
         '''
         Get Zephyr settings from <settings>.py .
         '''
-        return self._robot_vars['${ZEPHYR}']
+        return self._get_variable('${ZEPHYR}', cached=True)
 
-    @property
-    def _robot_vars(self):
+    def _get_variable(self, name, default=None, cached=False):
         '''
-        Gets robot variables.
+        Gets single robot variable value. Cached values are kept until `_invalidate_variables` is called,
+        which happens on suite and test boundaries and when test tags are changed.
         '''
-        # workaround to save inconsistency between robot 2.8 and robot 2.9
-        variables = self._builtin.get_variables()
-        for name in list(variables):
-            if name.startswith('&'):
-                variables['$' + name[1:]] = variables.pop(name)
-        return variables
+        if cached and name in self._variables:
+            return self._variables[name]
+        value = self._builtin.get_variable_value(name, default)
+        if cached:
+            self._variables[name] = value
+        return value
+
+    def _invalidate_variables(self):
+        self._variables = {}
 
     @property
     def steps(self):
@@ -791,9 +1270,10 @@ class _ZephyrTC(_Zephyr):
         :param execution_id:
         :param steps:
         '''
-        for k, v in steps:
-            v['stepId'] = _zephyr_add_test_step(issue_id, k, v['params'], v['expected'])
-            _zephyr_execute_test_step(v['stepId'], execution_id, self._get_execution_status(v), v['comment'])
+        ids = _zephyr_sync_test_steps(issue_id, execution_id, [
+            (k, v['params'], v['expected'], self._get_execution_status(v), v['comment']) for k, v in steps])
+        for (k, v), (step_id, _) in zip(steps, ids):
+            v['stepId'] = step_id
 
     def _process_test_cases(self, project_key, version_id, cycle_id, suite_summary, suite_description,
                             issue_custom_field, issue_custom_field_val, execution_log, execution_status):
@@ -818,15 +1298,10 @@ class _ZephyrTC(_Zephyr):
             self.steps.append({'executionId': execution_id, 'longname': test_case_name})
         logger.info('Test case %s is processed', issue_key)
 
-        if test_case_name in self._test_results and 'attachfile' in self._test_results[test_case_name]['tags'] and '${ATTACHMENT_PATHS}' in self._robot_vars:
-            if test_case_name in self._robot_vars['${ATTACHMENT_PATHS}']:
-                path_to_file = self._robot_vars['${ATTACHMENT_PATHS}'][test_case_name]
-                p = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-                p.apply_async(_zephyr_attach_test_execution_log, ({'baseURL': _Zephyr.baseURL, '_username': _Zephyr._username,
-                                                                   '_password': _Zephyr._password}, execution_id, path_to_file))
-                p.close()
-                p.join()
-                logger.info('Attachment uploaded: %s', path_to_file)
+        attachment_paths = self._get_variable('${ATTACHMENT_PATHS}', cached=True)
+        if test_case_name in self._test_results and 'attachfile' in self._test_results[test_case_name]['tags'] and attachment_paths is not None:
+            if test_case_name in attachment_paths:
+                self._attach_execution_file(execution_id, attachment_paths[test_case_name])
 
     def _get_test_steps(self, test_case):
         '''
@@ -859,8 +1334,8 @@ class _ZephyrTC(_Zephyr):
                 key = attrs['type']
 
             if attrs['type'] == 'Test Foritem':
-                longname = self._robot_vars.get('${' + self._current_test_name + '_SCENARIO_NAME}')
-                expected = self._robot_vars.get('${' + self._current_test_name + '_EXPECTED_RESULT}')
+                longname = self._get_variable('${' + self._current_test_name + '_SCENARIO_NAME}')
+                expected = self._get_variable('${' + self._current_test_name + '_EXPECTED_RESULT}')
             else:
                 longname = name
                 expected = 'PASS'
@@ -884,7 +1359,7 @@ class _ZephyrTC(_Zephyr):
                 'params': ', '.join(attrs['args']),
                 'status': attrs['status'],
                 'comment': self._keyword_message,
-                'tags': self._robot_vars.get('@{TEST_TAGS}', []),
+                'tags': self._get_variable('@{TEST_TAGS}', [], cached=True),
                 'doc': attrs['doc'],
             })
             # If we are on Suite Setup stage, there is no self._test_steps[key] is defined yet.
@@ -894,7 +1369,7 @@ class _ZephyrTC(_Zephyr):
         elif attrs['type'] == 'Test Teardown' and name == 'util.Report Status Message':
             # Save keyword status message for later use when process the for item
             # 'util.Report Status Message' keyword should be called from test template keyword teardown to enable this
-            self._keyword_message = self._robot_vars.get('${KEYWORD_MESSAGE}')
+            self._keyword_message = self._get_variable('${KEYWORD_MESSAGE}')
 
     def start_test(self, name, attrs):
         super(_ZephyrTC, self).start_test(name, attrs)
@@ -921,9 +1396,11 @@ class _ZephyrDI(_ZephyrTC):
         """
         Init `_test_results` map
         """
+        if name.endswith(('Set Tags', 'Remove Tags')):
+            self._invalidate_variables()
         if attrs['type'] in ('Test Foritem') and self._level == 2:
-            key = self._robot_vars.get('${' + self._current_test_name + '_SCENARIO_NAME}')
-            issue_key = self._robot_vars.get('${' + self._current_test_name + '_ISSUE_KEY}')
+            key = self._get_variable('${' + self._current_test_name + '_SCENARIO_NAME}')
+            issue_key = self._get_variable('${' + self._current_test_name + '_ISSUE_KEY}')
             if not key:
                 raise Exception(
                     'Keyword "util.Report As" must be called for "' + _ISSUE_PER + '  ' + _ISSUE_PER_DATA_ITEM + '" reports.')
@@ -932,7 +1409,7 @@ class _ZephyrDI(_ZephyrTC):
                 'status': attrs['status'],
                 'longname': key,
                 'comment': '',
-                'tags': self._robot_vars.get('@{TEST_TAGS}'),
+                'tags': self._get_variable('@{TEST_TAGS}', cached=True),
                 'doc': attrs['doc'],
                 'issue_key': issue_key
             })
@@ -950,25 +1427,45 @@ class _ZephyrDI(_ZephyrTC):
         """
         Update `test_results`
         """
+        self._invalidate_variables()
         self._level = 0
         del self._test_results[self._current_test_name]
         self._empty_suite = not (len(self._test_results) > 0)
         self._current_test_name = None
 
 
-def _jira_get_issue_links(issue_key):
+_SPOOLED_LISTENERS = dict((listener.__name__, listener) for listener in (_Zephyr, _ZephyrTC, _ZephyrDI))
+
+
+def _jira_search(jql, fields):
+    """
+    Search Jira issues by `jql` returning only specified `fields`, pages of results are fetched one by one
+    """
+    logger.info('Search Jira issues: %s', jql)
+
+    start_at = 0
+    while True:
+        resp_json = _JIRA.get('/rest/api/2/search/', {'fields': fields, 'maxResults': _SEARCH_PAGE_SIZE,
+                                                      'jql': jql, 'startAt': start_at})
+        for issue in resp_json['issues']:
+            yield issue
+        start_at += len(resp_json['issues'])
+        if not resp_json['issues'] or start_at >= resp_json['total']:
+            break
+
+
+def _jira_get_issues_links(issue_keys):
     """
-    Returns list of links for Zephyr test by it's `issue_key`
+    Returns keys of issues linked to Zephyr tests by their `issueKeys`
     """
-    url = _Zephyr.baseURL + '/rest/api/2/issue/' + issue_key + '?fields=issuelinks'
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
-    res = []
-    for l in resp_json['fields']['issuelinks']:
-        if 'outwardIssue' in l and l['type']['name'] == 'Relates':
-            res.append({'id': l['id'], 'issueKey': l['outwardIssue']['key']})
+    res = {}
+    for i in range(0, len(issue_keys), _LINKS_SEARCH_SIZE):
+        jql = 'key in (' + ','.join(issue_keys[i:i + _LINKS_SEARCH_SIZE]) + ')'
+        for issue in _jira_search(jql, 'issuelinks'):
+            links = res.setdefault(issue['key'], set())
+            for l in issue['fields']['issuelinks']:
+                if 'outwardIssue' in l and l['type']['name'] == 'Relates':
+                    links.add(l['outwardIssue']['key'])
     return res
 
 
@@ -976,104 +1473,138 @@ def _jira_delete_link(linked_issue_id):
     """
     Delete Jira issue link with specified `linkId`
     """
-    url = _Zephyr.baseURL + '/rest/api/2/issueLink/' + linked_issue_id
-    headers = _headers()
-    request = Request(url, headers=headers)
-    request.get_method = lambda: 'DELETE'
-    js_res = urlopen(request)
-    load(js_res)
+    _JIRA.delete('/rest/api/2/issueLink/' + linked_issue_id)
 
 
-def _jira_update_links(issue_key, based_on_issues_val, bugs):
+def _jira_create_link(issue_key, issue):
     """
-    Update Zephyr test links using `basedOnIssuesVal` metadata value
+    Link Zephyr test `issueKey` to `issue`, returns True if it is linked, None if `issue` was not found and False if
+    linking failed
     """
-    issues = split_metadata_value(based_on_issues_val) + bugs
-    if not issues:
-        logger.info('No links for issue %s specified. Skip.', issue_key)
+    json_data = {
+        'type': {
+            'name': 'Relates'
+        },
+        'inwardIssue': {
+            'key': issue_key
+        },
+        'outwardIssue': {
+            'key': issue
+        }
+    }
+
+    try:
+        _JIRA.post('/rest/api/2/issueLink/', json_data)
+    except HTTPError, e:
+        if e.response.status_code == 404:
+            logger.info('"Based on" issue %s was not found.', issue)
+            return None
+        else:
+            logger.error(ZephyrError(e))
+            return False
+    return True
+
+
+def _jira_update_links(links):
+    """
+    Update Zephyr tests links, `links` maps test issue key to keys of issues it should be linked to.
+
+    Existing links of all tests are fetched by one search and missing ones are created concurrently.
+    Tests linked to the same issues as last time are skipped, tests with links not created are linked again next time.
+    """
+    changed = {}
+    for issue_key, issues in links.iteritems():
+        issues = sorted(set(issues))
+        if not issues:
+            logger.info('No links for issue %s specified. Skip.', issue_key)
+            continue
+        fingerprint = sha1('\n'.join(issues).encode('utf8')).hexdigest()
+        if _LINK_FINGERPRINTS.find(_lookup_key('links', issue_key)) == fingerprint:
+            logger.info('Links for issue %s are not changed. Skip.', issue_key)
+            continue
+        changed[issue_key] = (issues, fingerprint)
+    if not changed:
         return
-    existing_links = _jira_get_issue_links(issue_key)
-
-    for issue in issues:
-        if issue not in [link['issueKey'] for link in existing_links]:
-            json_data = {
-                'type': {
-                    'name': 'Relates'
-                },
-                'inwardIssue': {
-                    'key': issue_key
-                },
-                'outwardIssue': {
-                    'key': issue
-                }
-            }
 
-            url = _Zephyr.baseURL + '/rest/api/2/issueLink/'
-            headers = _headers()
-            request = Request(url, data=dumps(json_data), headers=headers)
-            try:
-                js_res = urlopen(request)
-            except urllib2.HTTPError, e:
-                if e.code == 404:
-                    logger.info('"Based on" issue %s was not found.', issue)
-                else:
-                    logger.error(e.message)
-    logger.info('Links for issue %s are updated', issue_key)
+    existing = _jira_get_issues_links(changed.keys())
+    missing = [(issue_key, issue) for issue_key, (issues, _) in changed.iteritems()
+               for issue in issues if issue not in existing.get(issue_key, ())]
+    created = _request_pool().map(_apply, [(_jira_create_link, link) for link in missing])
+    # Issue not found may be created later, so links of the test are not stored as done
+    failed = set(issue_key for (issue_key, _), ok in zip(missing, created) if ok is not True)
+
+    for issue_key, (_, fingerprint) in changed.iteritems():
+        if issue_key not in failed:
+            _LINK_FINGERPRINTS.put(_lookup_key('links', issue_key), fingerprint)
+            logger.info('Links for issue %s are updated', issue_key)
 
 
 def _jira_find_test(project_key, issue_custom_field, issue_custom_field_val):
     """
     Find Zephyr test for project with key `projectKey`, custom field `issueCustomField` and it's value `issueCustomFieldVal`
     """
-    search_url = _Zephyr.baseURL + '/rest/api/2/search/?fields=id&jql='
-    issue_custom_field_val_esc = escape_string(
-        re.sub(r'([+\-&|!\^~*?\'\\])', '\\\\\\1', issue_custom_field_val))
-    search_url += urllib2.quote(('issuetype=Test AND cf[' + issue_custom_field + ']~\'' + issue_custom_field_val_esc
-                                 + '\' AND project=' + project_key).encode('utf8'), safe='')
+    issue_key = _jira_get_tests(project_key, issue_custom_field).get(issue_custom_field_val)
+    if issue_key:
+        logger.debug('Test found. KEY is: %s', issue_key)
+    return issue_key
 
-    logger.info('Search Jira issue, url: %s', search_url)
 
-    headers = _headers()
-    request = Request(search_url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+def _jira_get_tests(project_key, issue_custom_field):
+    """
+    Returns keys of Zephyr tests of project with key `projectKey` by value of custom field `issueCustomField`.
+    Tests are searched once per run, created tests are added to returned mapping.
+    """
+    key = (project_key, issue_custom_field)
+    with _TEST_ISSUES_LOCK:
+        if key not in _TEST_ISSUES:
+            _TEST_ISSUES[key] = _jira_search_tests(project_key, issue_custom_field)
+        return _TEST_ISSUES[key]
 
-    num_found = resp_json['total']
 
-    if num_found > 0:
-        issue_key = resp_json['issues'][0]['key']
-        logger.debug('Test found. KEY is: %s', issue_key)
-        return issue_key
+def _jira_search_tests(project_key, issue_custom_field):
+    """
+    Search all Zephyr tests of project with key `projectKey` having custom field `issueCustomField`
+    """
+    issue_custom_field_name = 'customfield_' + issue_custom_field
+    jql = ('issuetype=' + ISSUE_TYPE_NAME + ' AND project=' + project_key + ' AND cf[' + issue_custom_field +
+           '] is not EMPTY ORDER BY key ASC')
+    tests = {}
+    for issue in _jira_search(jql, issue_custom_field_name):
+        value = issue['fields'].get(issue_custom_field_name)
+        if value:
+            # the oldest one wins if there are duplicates
+            tests.setdefault(unicode(value), issue['key'])
 
-    return None
+    logger.info('Found %s tests in project %s', len(tests), project_key)
+    return tests
+
+
+@_cached_lookup
+def _jira_get_projects():
+    """
+    Returns list of all Jira projects
+    """
+    logger.info('Get projects')
+    return _JIRA.get('/rest/api/2/project')
 
 
 def _get_project_key(project_name):
     """
     Returns project key for specified `projectName`
     """
-    url = _Zephyr.baseURL + '/rest/api/2/project'
-    logger.info('Get project name: %s', url)
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
-    for project in resp_json:
+    for project in _jira_get_projects():
         if project['name'] == project_name:
             return project['key']
     return
 
 
+@_cached_lookup
 def _get_project_id(project_key):
     """
     Returns project id for specified `projectKey`
     """
-    url = _Zephyr.baseURL + '/rest/api/2/project/' + project_key
-    logger.info('Get project ID: %s', url)
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+    logger.info('Get project ID: %s', project_key)
+    resp_json = _JIRA.get('/rest/api/2/project/' + project_key)
     return resp_json['id']
 
 
@@ -1084,7 +1615,7 @@ def _zephyr_create_or_update(project_key, issue_key, issue_summary, issue_descri
     """
     issue_custom_field_name = 'customfield_' + issue_custom_field
     issue_custom_field_val = issue_custom_field_val.replace('\\', '/')
-    create_test_issue_url = _Zephyr.baseURL + '/rest/api/2/issue/'
+    issue_path = '/rest/api/2/issue/'
 
     issue_specified = bool(issue_key)
     if not issue_key:
@@ -1092,8 +1623,8 @@ def _zephyr_create_or_update(project_key, issue_key, issue_summary, issue_descri
 
     if issue_key:
         logger.info('Updating existing Jira Issue Id: %s', issue_key)
-        create_test_issue_url += issue_key
-        logger.debug('URL is: %s', create_test_issue_url)
+        issue_path += issue_key
+        logger.debug('Path is: %s', issue_path)
         action = 'Updating'
         update = True
     else:
@@ -1136,17 +1667,14 @@ def _zephyr_create_or_update(project_key, issue_key, issue_summary, issue_descri
             }
         })
 
-    headers = _headers()
-    request = Request(create_test_issue_url, data=dumps(issue), headers=headers)
-
-    if update:
-        request.get_method = lambda: 'PUT'
-
     try:
-        js_res = urlopen(request)
-    except urllib2.HTTPError, ex:
-        if ex.code == 400:
-            resp = ex.read()
+        if update:
+            _JIRA.put(issue_path, issue)
+        else:
+            resp_json = _JIRA.post(issue_path, issue)
+    except HTTPError, ex:
+        if ex.response.status_code == 400:
+            resp = ex.response.text
             # In case issue was closed and can not be updated.
             if issue_key and 'You do not have permission to edit issues in this project.' in resp:
                 logger.warning('Issue "%s" probably closed and can not be updated.', issue_key)
@@ -1157,13 +1685,14 @@ def _zephyr_create_or_update(project_key, issue_key, issue_summary, issue_descri
     if update:
         logger.info('Test issue updated: %s', issue_key)
     else:
-        resp_json = load(js_res)
         issue_key = resp_json['key']
         logger.info('Test issue created: %s', issue_key)
+        _jira_get_tests(project_key, issue_custom_field)[issue_custom_field_val] = issue_key
 
     return issue_key
 
 
+@_cached_lookup
 def _zephyr_find_test_cycle(project_id, version_id, name):
     """
     Find Zephyr test cycle id by it's `project_id`, `version_id` and `name`,
@@ -1171,14 +1700,9 @@ def _zephyr_find_test_cycle(project_id, version_id, name):
     if not version_id:
         version_id = '-1'
 
-    url = _Zephyr.baseURL + '/rest/zapi/latest/cycle?projectId=' + project_id + '&versionId=' + version_id
-
-    logger.info('Get test cycle: %s', url)
+    logger.info('Get test cycle: %s, project ID: %s, version ID: %s', name, project_id, version_id)
 
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+    resp_json = _JIRA.get('/rest/zapi/latest/cycle', {'projectId': project_id, 'versionId': version_id})
 
     for k, v in resp_json.iteritems():
         if k != 'recordsCount':
@@ -1195,6 +1719,7 @@ def _zephyr_create_test_cycle(project_id, version_id, name):
     if cycle_id:
         logger.debug('Found existing test cycle: %s', cycle_id)
         return cycle_id
+    lookup_key = _lookup_key('_zephyr_find_test_cycle', project_id, version_id, name)
 
     if not version_id:
         version_id = '-1'
@@ -1214,30 +1739,23 @@ def _zephyr_create_test_cycle(project_id, version_id, name):
         'versionId': version_id
     }
 
-    headers = _headers()
-    url = _Zephyr.baseURL + '/rest/zapi/latest/cycle'
-    request = Request(url, data=dumps(test_cycle), headers=headers)
-    js_res = urlopen(request)
-
-    resp_json = load(js_res)
+    resp_json = _JIRA.post('/rest/zapi/latest/cycle', test_cycle)
     cycle_id = resp_json['id']
     logger.info('Test cycle created. New ID is: %s', cycle_id)
+    _LOOKUPS.put(lookup_key, cycle_id)
 
     return cycle_id
 
 
+@_cached_lookup
 def _get_issue_id(issue_key):
     """
     Get Jira test id by `testKey`
     """
-    url = _Zephyr.baseURL + '/rest/api/2/issue/' + issue_key
-    logger.info('Get test ID: %s', url)
-    logger.info('Test Jira issue URL: %s', _Zephyr.baseURL + '/browse/' + issue_key)
-
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+    logger.info('Get test ID: %s', issue_key)
+    logger.info('Test Jira issue URL: %s', _JIRA.base_url + '/browse/' + issue_key)
+
+    resp_json = _JIRA.get('/rest/api/2/issue/' + issue_key)
     return resp_json['id']
 
 
@@ -1248,11 +1766,7 @@ def _zephyr_find_execution(cycle_id, version_id, issue_id):
     if not version_id:
         version_id = '-1'
 
-    url = _Zephyr.baseURL + '/rest/zapi/latest/execution?issueId=' + issue_id
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+    resp_json = _JIRA.get('/rest/zapi/latest/execution', {'issueId': issue_id})
 
     executions = resp_json['executions']
     for item in executions:
@@ -1266,12 +1780,7 @@ def _zephyr_delete_execution(execution_id):
     """
     # delete
     if execution_id:
-        url = _Zephyr.baseURL + '/rest/zapi/latest/execution/%s' % execution_id
-        headers = _headers()
-        request = Request(url, headers=headers)
-        request.get_method = lambda: 'DELETE'
-        js_res = urlopen(request)
-        resp_json = load(js_res)
+        _JIRA.delete('/rest/zapi/latest/execution/%s' % execution_id)
         logger.info('Test execution deleted. ID: %s', execution_id)
 
 
@@ -1293,8 +1802,6 @@ def _zephyr_execute_test(project_id, version_id, cycle_id, issue_id, exec_status
         execution_id = None
         cur_exec_status = -1
 
-    headers = _headers()
-
     if not execution_id:
         if not version_id:
             version_id = '-1'
@@ -1308,11 +1815,7 @@ def _zephyr_execute_test(project_id, version_id, cycle_id, issue_id, exec_status
             'comment': exec_log[:700] if exec_log else ''
         }
 
-        url = _Zephyr.baseURL + '/rest/zapi/latest/execution'
-        headers = _headers()
-        request = Request(url, data=dumps(json_data), headers=headers)
-        js_res = urlopen(request)
-        resp_json = load(js_res)
+        resp_json = _JIRA.post('/rest/zapi/latest/execution', json_data)
 
         for k, v in resp_json.iteritems():
             logger.debug('Test execution added. ID is: %s', k)
@@ -1323,14 +1826,11 @@ def _zephyr_execute_test(project_id, version_id, cycle_id, issue_id, exec_status
             return
     elif int(cur_exec_status) == exec_status:
         # To be able to update execution time, we need first change status.
-        # url = _Zephyr.baseURL + '/rest/zapi/latest/execution/%s/quickExecute' % execution_id  # does not work anymore?
-        url = _Zephyr.baseURL + '/rest/zapi/latest/execution/%s/execute' % execution_id
+        # path = '/rest/zapi/latest/execution/%s/quickExecute' % execution_id  # does not work anymore?
         json_data = {
             'status': 3  # WIP -- work in progress
         }
-        request = Request(url, data=dumps(json_data), headers=headers)
-        request.get_method = lambda: 'PUT'
-        urlopen(request)
+        _JIRA.put('/rest/zapi/latest/execution/%s/execute' % execution_id, json_data)
         logger.info('Test execution status set to WIP. ID: %s', execution_id)
 
     json_data = {
@@ -1338,88 +1838,102 @@ def _zephyr_execute_test(project_id, version_id, cycle_id, issue_id, exec_status
         'comment': exec_log[:700] if exec_log else ''
     }
 
-    url = _Zephyr.baseURL + '/rest/zapi/latest/execution/%s/execute' % execution_id
-    request = Request(url, data=dumps(json_data), headers=headers)
-    request.get_method = lambda: 'PUT'
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+    resp_json = _JIRA.put('/rest/zapi/latest/execution/%s/execute' % execution_id, json_data)
     logger.info('Test execution updated. ID: %s', resp_json['id'])
     return execution_id
 
 
-def _zephyr_find_test_step(issue_id, step):
+def _zephyr_get_test_steps(issue_id):
     """
-    Retrieve Zephyr test step id by 'issueId` and `step`
+    Retrieve all Zephyr test steps of issue with id `issueId`
     """
-    url = _Zephyr.baseURL + '/rest/zapi/latest/teststep/' + issue_id
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
-    for item in resp_json:
-        if 'step' in item and item['step'] == step:
-            logger.debug('Test step found. ID is: %s', item['id'])
-            return str(item['id'])
-
-    logger.info('Test step "%s" not found.', step)
-    return None
+    return _JIRA.get('/rest/zapi/latest/teststep/' + issue_id)
 
 
-def _zephyr_add_test_step(issue_id, step, data, result):
+def _zephyr_add_test_step(issue_id, step, data, result, step_id=None):
     """
-    Add test step for issue with id `issueId` using provided `step`, `data` and `result`
+    Add test step for issue with id `issueId` using provided `step`, `data` and `result`.
+    Existing step is updated if `step_id` is provided.
     """
-    step_id = _zephyr_find_test_step(issue_id, step)
-
     json_data = {
         'step': step,
         'data': data,
         'result': result
     }
 
-    headers = _headers()
-    url = _Zephyr.baseURL + '/rest/zapi/latest/teststep/' + issue_id
-
-    if step_id:
-        url += '/' + step_id
-
-    request = Request(url, data=dumps(json_data), headers=headers)
+    path = '/rest/zapi/latest/teststep/' + issue_id
 
     if step_id:
-        request.get_method = lambda: 'PUT'
-
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+        resp_json = _JIRA.put(path + '/' + step_id, json_data)
+    else:
+        resp_json = _JIRA.post(path, json_data)
     logger.debug('Test step created ID: %s', resp_json['id'])
     return str(resp_json['id'])
 
 
-def _zephyr_find_step_result_id(step_id, execution_id):
-    """
-    Retrieve Zephyr test step execution by 'stepId` and `executionId`
+def _zephyr_get_step_results(execution_id):
     """
-    url = _Zephyr.baseURL + '/rest/zapi/latest/stepResult/?executionId=' + execution_id
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
-    for item in resp_json:
-        if str(item['stepId']) == step_id:
-            logger.debug('Test step result found. ID is: %s', item['id'])
-            return str(item['id'])
-
-
-def _zephyr_execute_test_step(step_id, execution_id, status, comment):
+    Retrieve Zephyr test step results ids of execution `executionId` by their step ids
     """
-    Create Zephyr test step with id `stepId` execution using provided `status`, `comment` and `executionId`
-        |
+    resp_json = _JIRA.get('/rest/zapi/latest/stepResult/', {'executionId': execution_id})
+    return dict((str(item['stepId']), str(item['id'])) for item in resp_json)
+
+
+def _zephyr_sync_test_steps(issue_id, execution_id, steps):
     """
-    step_result_id = _zephyr_find_step_result_id(step_id, execution_id)
-    if not step_result_id:
-        return
+    Sync test steps of issue with id `issueId` and put their results into execution `executionId`.
 
-    url = _Zephyr.baseURL + '/rest/zapi/latest/stepResult/' + step_result_id
-    logger.debug('Updating step result: %s', url)
+    Steps and their results are fetched once. Missing steps are created in order, changed ones are updated
+    and results are put concurrently, one per step result.
+
+    :param steps: list of (step, data, result, status, comment) tuples
+    :return: list of (step id, step result id) tuples in `steps` order, step result id is None if not found
+    """
+    existing = {}
+    for item in _zephyr_get_test_steps(issue_id):
+        if 'step' in item:
+            existing.setdefault(item['step'], item)
+
+    step_ids = {}
+    updates = []
+    for step, data, result, _, _ in steps:
+        item = existing.get(step)
+        if step in step_ids:
+            continue
+        if item is None:
+            logger.info('Test step "%s" not found.', step)
+            step_ids[step] = None
+        else:
+            step_ids[step] = str(item['id'])
+            if item.get('data') != data or item.get('result') != result:
+                updates.append((issue_id, step, data, result, step_ids[step]))
+
+    pending = _request_pool().map_async(_apply, [(_zephyr_add_test_step, args) for args in updates])
+    # Steps are listed in order they were created, so new ones are added one by one.
+    for step, data, result, _, _ in steps:
+        if step_ids[step] is None:
+            step_ids[step] = _zephyr_add_test_step(issue_id, step, data, result)
+    pending.get()
+
+    step_results = _zephyr_get_step_results(execution_id)
+    # Steps with the same name share step result, the last result wins as if they were put one by one.
+    executions = OrderedDict()
+    ids = []
+    for step, _, _, status, comment in steps:
+        step_result_id = step_results.get(step_ids[step])
+        ids.append((step_ids[step], step_result_id))
+        if step_result_id:
+            executions.pop(step_result_id, None)
+            executions[step_result_id] = (_zephyr_execute_test_step, (step_result_id, status, comment))
+    _request_pool().map(_apply, executions.values())
+    return ids
+
+
+def _zephyr_execute_test_step(step_result_id, status, comment):
+    """
+    Update Zephyr test step result with id `stepResultId` using provided `status` and `comment`
+    """
+    logger.debug('Updating step result: %s', step_result_id)
 
     if isinstance(status, basestring):  # pass numeric status as is
         if status == 'PASS':
@@ -1433,27 +1947,19 @@ def _zephyr_execute_test_step(step_id, execution_id, status, comment):
         'status': status,
         'comment': comment[:700] if comment else ''
     }
-    headers = _headers()
-    request = Request(url, data=dumps(json_data), headers=headers)
-    request.get_method = lambda: 'PUT'
-    js_res = urlopen(request)
-    resp_json = load(js_res)
-    logger.debug('Test step %s executed.', step_id)
+    _JIRA.put('/rest/zapi/latest/stepResult/' + step_result_id, json_data)
+    logger.debug('Test step result %s updated.', step_result_id)
     return str(step_result_id)
 
 
+@_cached_lookup
 def _zephyr_get_version_id(project_key, version):
     """
     Return Jira project version id for project with key `projectKey` and version name `version`
     """
-    url = _Zephyr.baseURL + '/rest/api/2/project/' + project_key + '/versions'
-
-    logger.debug('Looking for versions: %s', url)
+    logger.debug('Looking for versions of project %s', project_key)
 
-    headers = _headers()
-    request = Request(url, headers=headers)
-    js_res = urlopen(request)
-    resp_json = load(js_res)
+    resp_json = _JIRA.get('/rest/api/2/project/' + project_key + '/versions')
 
     for v in resp_json:
         if v['name'] == version:
@@ -1462,92 +1968,162 @@ def _zephyr_get_version_id(project_key, version):
     return None
 
 
-def _zephyr_attach_log(z, entity_id, entity_type, log_path):
+class _MultipartFile(object):
+    '''
+    Multipart form data request body with single file. File is streamed in chunks when request is sent
+    instead of being read into memory.
+    '''
+
+    def __init__(self, path, file_name, field='file'):
+        boundary = uuid.uuid4().hex
+        content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        head = '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' % (
+            boundary, field, file_name.replace('"', '\\"'), content_type)
+        tail = '\r\n--%s--\r\n' % boundary
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+        self._file = open(path, 'rb')
+        self._length = len(head) + os.path.getsize(path) + len(tail)
+        self._parts = [StringIO(head), self._file, StringIO(tail)]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(lambda: self.read(_UPLOAD_CHUNK_SIZE), '')
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and size != 0:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(chunks)
+
+    def close(self):
+        self._file.close()
+
+
+def _zephyr_attach_log(entity_id, entity_type, log_path, log_file=None):
     """
-    Attach file `logPath` to Zephyr test execution step with id `stepResultId`
+    Attach file `logPath` to Zephyr entity with id `entityId`, file is named `logFile` if specified
     """
-    log_file = str(os.path.basename(log_path))
-
-    url = z['baseURL'] + '/rest/zapi/latest/attachment?entityId=' + entity_id + '&entityType=' + entity_type
-    headers = {'X-Atlassian-Token': 'nocheck', 'Accept': 'application/json'}
+    log_file = str(log_file or os.path.basename(log_path))
 
-    with open(log_path, 'rb') as f:
-        files = {'file': (log_file, f, 'multipart/form-data')}
-        post(url, files=files, headers=headers, auth=HTTPBasicAuth(z['_username'], z['_password']))
+    body = _MultipartFile(log_path, log_file)
+    headers = {'X-Atlassian-Token': 'nocheck', 'Content-Type': body.content_type}
+    try:
+        _JIRA.request('POST', '/rest/zapi/latest/attachment', params={'entityId': entity_id, 'entityType': entity_type},
+                      data=body, headers=headers)
+    finally:
+        body.close()
+    logger.info('Attachment uploaded: %s', log_path)
 
 
-def _zephyr_attach_test_step_log(z, step_result_id, log_path):
+def _zephyr_attach_test_step_log(step_result_id, log_path, log_file=None):
     '''
     Attaches log to test execution step result.
 
     :param step_result_id:
     :param log_path:
+    :param log_file: attachment file name
     :return:
     '''
-    _zephyr_attach_log(z, step_result_id, 'TESTSTEPRESULT', log_path)
+    _zephyr_attach_log(step_result_id, 'TESTSTEPRESULT', log_path, log_file)
 
 
-def _zephyr_attach_test_execution_log(z, execution_id, log_path):
+def _zephyr_attach_test_execution_log(execution_id, log_path, log_file=None):
     '''
     Attaches log to test execution.
 
     :param execution_id:
     :param log_path:
+    :param log_file: attachment file name
     :return:
     '''
-    _zephyr_attach_log(z, execution_id, 'EXECUTION', log_path)
+    _zephyr_attach_log(execution_id, 'EXECUTION', log_path, log_file)
 
 
-def _headers():
-    '''
-    Creates dict containing authorization and content type headers.
+_REQUEST_POOL = []
+_REQUEST_POOL_LOCK = Lock()
 
-    :return: dict
-    '''
-    headers = {'Authorization': ' Basic ' + b64encode(_Zephyr._username + ':' + _Zephyr._password),
-               'Content-Type': 'application/json'}
-    return headers
 
+def _request_pool():
+    """
+    Returns thread pool shared by concurrent requests of reporting jobs
+    """
+    with _REQUEST_POOL_LOCK:
+        if not _REQUEST_POOL:
+            _REQUEST_POOL.append(ThreadPool(_MAX_CONCURRENT_REQUESTS))
+        return _REQUEST_POOL[0]
 
-def gen_report(z, path, test):
-    if 'stepResultId' in test:
-        gen_test_step_report(z, path, test)
-    elif 'executionId' in test:
-        gen_test_case_report(z, path, test)
 
+def _apply(job):
+    """
+    Calls `(func, args)` job, used to run jobs on thread pool
+    """
+    func, args = job
+    return func(*args)
 
-def gen_test_step_report(z, path, test):
+
+def _upload_logs(path, steps):
     """
-    Generate test report for `test` and store it to file `${stepResultId}.html` in directory `path`
+    Generate logs of `steps` tests from output `path` and attach them to Zephyr step results and executions.
+
+    Output is split into per test outputs in single pass, logs are rendered from them in separate processes
+    and uploaded concurrently. Log of the same test is rendered once even if it is attached several times.
     """
-    step_result_id = str(test['stepResultId'])
-    log_path = str(os.path.dirname(path) + '/' + step_result_id + '.html')
+    directory = mkdtemp(prefix='zephyr_logs_', dir=os.path.dirname(os.path.abspath(path)))
     try:
-        rebot_cli(['--test', str(test['longname']), '--report', 'NONE', '--log', log_path, str(path)])
-    except SystemExit:
-        pass
-    except:
-        logger.error('Unexpected error: %s', sys.exc_info()[0])
+        outputs = split_output(path, [step['longname'] for step in steps], directory)
+        for name in set(step['longname'] for step in steps) - set(outputs):
+            logger.warning('No tests matching "%s" found in %s', name, path)
 
-    _zephyr_attach_test_step_log(z, step_result_id, log_path)
-    os.remove(log_path)
+        renderers = multiprocessing.Pool(multiprocessing.cpu_count())
+        try:
+            for name, log_path in renderers.imap_unordered(_render_log, outputs.items()):
+                if not log_path:
+                    continue
+                for step in steps:
+                    if step['longname'] == name:
+                        _UPLOAD_QUEUE.submit(_attach_log, step, log_path)
+        finally:
+            renderers.close()
+            renderers.join()
+            _UPLOAD_QUEUE.drain()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
 
 
-def gen_test_case_report(z, path, test):
+def _render_log(job):
     """
-    Generate test report for `test` and store it to file `${stepResultId}.html` in directory `path`
+    Render log of `(name, output)` job, runs in separate process
     """
-    execution_id = str(test['executionId'])
-    log_path = str(os.path.dirname(path) + '/' + execution_id + '.html')
+    name, output = job
+    log_path = os.path.splitext(output)[0] + '.html'
     try:
-        rebot_cli(['--test', str(test['longname']), '--report', 'NONE', '--log', log_path, str(path)])
-    except SystemExit:
-        pass
-    except:
+        rebot(output, log=log_path, report='NONE')
+    except Exception:
         logger.error('Unexpected error: %s', sys.exc_info()[0])
+    if not os.path.isfile(log_path):
+        logger.error('Log of "%s" is not generated', name)
+        return name, None
+    return name, log_path
 
-    _zephyr_attach_test_execution_log(z, execution_id, log_path)
-    os.remove(log_path)
+
+def _attach_log(test, log_path):
+    """
+    Attach log to step result or execution of `test`, attachment is named by its id
+    """
+    if 'stepResultId' in test:
+        step_result_id = str(test['stepResultId'])
+        _zephyr_attach_test_step_log(step_result_id, log_path, step_result_id + '.html')
+    elif 'executionId' in test:
+        execution_id = str(test['executionId'])
+        _zephyr_attach_test_execution_log(execution_id, log_path, execution_id + '.html')
 
 
 def split_metadata_value(value):
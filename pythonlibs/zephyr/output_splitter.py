@@ -0,0 +1,136 @@
+""" Splits Robot Framework output.xml into small outputs containing only selected tests.
+
+ Whole output is read once in streaming manner, so memory usage does not depend on its size. Resulting outputs keep
+ suites of selected tests together with their setups, teardowns, documentation, metadata and statuses and can be
+ processed by rebot as usual.
+"""
+import os
+import shutil
+from xml.etree.cElementTree import iterparse, tostring
+from xml.sax.saxutils import quoteattr
+
+from robot.model.namepatterns import TestNamePatterns
+
+
+class _Suite(object):
+    '''
+    Suite element parts needed to rebuild it around selected tests.
+    '''
+
+    def __init__(self, attrib, parent=None):
+        self.attrib = dict(attrib)
+        self.parent = parent
+        self.longname = attrib.get('name', '')
+        if parent is not None:
+            self.longname = parent.longname + '.' + self.longname
+        self.header = ''
+        self.footer = ''
+
+    def chain(self):
+        '''
+        :return: list of suites from top level one to this one
+        '''
+        suites = [self]
+        while suites[-1].parent is not None:
+            suites.append(suites[-1].parent)
+        return suites[::-1]
+
+    def start(self):
+        return _start_tag('suite', self.attrib) + self.header
+
+    def end(self):
+        return self.footer + '</suite>\n'
+
+
+def _start_tag(tag, attrib):
+    attributes = ''.join(' %s=%s' % (name, quoteattr(value)) for name, value in sorted(attrib.items()))
+    return (u'<%s%s>\n' % (tag, attributes)).encode('UTF-8')
+
+
+def split_output(path, names, directory):
+    '''
+    Splits output into outputs containing only tests matching names.
+
+    Names are matched against test names and long names like rebot `--test` option does.
+
+    :param path: output.xml path
+    :param names: test names or long names
+    :param directory: existing directory to write outputs to
+    :return: dict of output paths by name, names not matching any test are missing
+    '''
+    patterns = dict((name, TestNamePatterns([name])) for name in set(names))
+    matches = dict((name, []) for name in patterns)
+    robot_attrib = {}
+    elements = []
+    suites = []
+
+    for event, elem in iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'suite':
+                suites.append(_Suite(elem.attrib, suites[-1] if suites else None))
+            elif not elements:
+                robot_attrib = dict(elem.attrib)
+            elements.append(elem)
+            continue
+
+        elements.pop()
+        if not elements or elements[-1].tag not in ('robot', 'suite'):
+            continue
+        parent = elements[-1]
+        if elem.tag == 'suite':
+            suites.pop()
+        elif elem.tag == 'test':
+            name = elem.get('name')
+            longname = suites[-1].longname + '.' + name
+            matching = [n for n, pattern in patterns.iteritems() if pattern.match(name, longname)]
+            if matching:
+                body = os.path.join(directory, elem.get('id') + '.test')
+                with open(body, 'wb') as f:
+                    f.write(tostring(elem))
+                for n in matching:
+                    matches[n].append((suites[-1], body))
+        elif parent.tag == 'suite':
+            if elem.tag == 'kw' and elem.get('type') == 'setup':
+                suites[-1].header += tostring(elem)
+            else:
+                suites[-1].footer += tostring(elem)
+        # Processed elements are dropped, so only currently open ones are kept in memory.
+        parent.remove(elem)
+
+    outputs = {}
+    for n, (name, tests) in enumerate(matches.iteritems()):
+        if tests:
+            outputs[name] = os.path.join(directory, '%d.xml' % n)
+            _write_output(outputs[name], robot_attrib, tests)
+    for body in set(body for tests in matches.itervalues() for _, body in tests):
+        os.remove(body)
+    return outputs
+
+
+def _write_output(path, robot_attrib, tests):
+    '''
+    Writes output containing tests, suites shared by consecutive tests are written once.
+
+    :param path: output path
+    :param robot_attrib: root element attributes
+    :param tests: list of (suite, test body file) tuples in document order
+    '''
+    with open(path, 'wb') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(_start_tag('robot', robot_attrib))
+        opened = []
+        for suite, body in tests:
+            chain = suite.chain()
+            common = 0
+            while common < min(len(opened), len(chain)) and opened[common] is chain[common]:
+                common += 1
+            for s in reversed(opened[common:]):
+                f.write(s.end())
+            for s in chain[common:]:
+                f.write(s.start())
+            opened = chain
+            with open(body, 'rb') as b:
+                shutil.copyfileobj(b, f)
+        for s in reversed(opened):
+            f.write(s.end())
+        f.write('</robot>\n')
@@ -0,0 +1,183 @@
+""" Reports Zephyr results spooled by ZephyrLibrary with `spool` setting.
+
+ Usage:
+
+ |python -m zephyr.replay <spool> [--url <baseURL>] [--user <user>] [--password <passwd>] [--workers 4] [--retries 3]
+
+ Password is read from `ZEPHYR_PASSWD` environment variable if not specified. Jira URL and user default to ones
+ spooled with the jobs.
+
+ Jobs of different robot files are reported concurrently, jobs of the same file one by one in spool order.
+ Failed jobs are retried with growing delay if Jira is unavailable or responds with 429 code, or with 5xx code
+ to idempotent request. Creating request answered by 5xx code may have been applied, so such job is not retried.
+ Ids of reported jobs are appended to `<spool>.done` file, so replaying same spool again reports only jobs which
+ were not reported yet.
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict
+from json import loads
+from multiprocessing.pool import ThreadPool
+
+from requests import HTTPError, ReadTimeout, RequestException
+
+from .ZephyrLibrary import ZephyrError, _Zephyr, _LOOKUPS, _LINK_FINGERPRINTS, _DEFAULT_LINK_CACHE_TTL, \
+    _IDEMPOTENT_METHODS, _REPORT_QUEUE, _UPLOAD_QUEUE, _JIRA
+
+logger = logging.getLogger(__name__)
+
+_RETRY_DELAY = 2
+
+
+def read_jobs(spool, done_ids=()):
+    '''
+    Reads not reported jobs from spool file. Jobs with same id are read once.
+
+    :param spool: spool file path
+    :param done_ids: ids of reported jobs
+    :return: list of jobs
+    '''
+    jobs = OrderedDict()
+    with open(spool) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = loads(line)
+            except ValueError:
+                # last line may be incomplete if run was interrupted
+                logger.warning('Skipping malformed line %s of %s', n, spool)
+                continue
+            if job['id'] not in done_ids:
+                jobs.setdefault(job['id'], job)
+    return jobs.values()
+
+
+def read_done_ids(path):
+    '''
+    Reads ids of reported jobs.
+
+    :param path: done ids file path
+    :return: set of ids
+    '''
+    if not os.path.isfile(path):
+        return set()
+    with open(path) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def _is_retryable(error):
+    if isinstance(error, HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500 \
+            and error.response.request.method in _IDEMPOTENT_METHODS
+    if isinstance(error, ReadTimeout) and error.request is not None:
+        # Request was sent, it may have been applied
+        return error.request.method in _IDEMPOTENT_METHODS
+    return isinstance(error, (RequestException, socket.error))
+
+
+class _Replay(object):
+
+    def __init__(self, done_path, retries):
+        self.done_path = done_path
+        self.retries = retries
+        self.reported = 0
+        self.failed = 0
+
+    def report_jobs(self, jobs):
+        '''
+        Reports jobs one by one, stops on first failed one as following jobs may depend on it.
+        '''
+        for n, job in enumerate(jobs):
+            if not self._report_job(job):
+                self.failed += len(jobs) - n
+                return
+            self.reported += 1
+
+    def _report_job(self, job):
+        for attempt in range(self.retries + 1):
+            try:
+                _Zephyr._report_spooled_test_suite(job)
+            except Exception as e:
+                if attempt < self.retries and _is_retryable(e):
+                    delay = _RETRY_DELAY * 2 ** attempt
+                    logger.warning('Job %s failed, retrying in %s s: %s', job['id'], delay, ZephyrError(e))
+                    time.sleep(delay)
+                    continue
+                logger.error('Job %s failed: %s', job['id'], ZephyrError(e))
+                return False
+            # appends of single short line are not interleaved between threads
+            with open(self.done_path, 'a') as f:
+                f.write(job['id'] + '\n')
+            return True
+
+
+def replay(spool, url=None, user=None, password=None, workers=4, retries=3):
+    '''
+    Reports spooled jobs.
+
+    :return: number of jobs failed to report
+    '''
+    done_path = spool + '.done'
+    jobs = read_jobs(spool, read_done_ids(done_path))
+    if not jobs:
+        logger.info('Nothing to report in %s', spool)
+        return 0
+    _Zephyr.baseURL = url or jobs[0]['baseURL']
+    _Zephyr._username = user or jobs[0]['user']
+    _Zephyr._password = password or os.environ.get('ZEPHYR_PASSWD', '')
+    _JIRA.configure(_Zephyr.baseURL, _Zephyr._username, _Zephyr._password)
+    # Steps results and other requests are still sent concurrently by each job.
+    _REPORT_QUEUE.workers = 0
+
+    groups = OrderedDict()
+    for job in jobs:
+        groups.setdefault(job['args'][4], []).append(job)
+    runner = _Replay(done_path, retries)
+    pool = ThreadPool(max(workers, 1))
+    try:
+        pool.map(runner.report_jobs, groups.values())
+    finally:
+        pool.close()
+        pool.join()
+        try:
+            _UPLOAD_QUEUE.drain()
+        except ZephyrError as e:
+            logger.error('Uploading attachments failed: %s', e)
+            runner.failed += 1
+        _LOOKUPS.save()
+        _LINK_FINGERPRINTS.save()
+        _JIRA.log_metrics()
+    logger.info('Reported %s of %s jobs from %s', runner.reported, len(jobs), spool)
+    return runner.failed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Report Zephyr results spooled by ZephyrLibrary.')
+    parser.add_argument('spool', help='spool file')
+    parser.add_argument('--url', help='Jira base URL, spooled one by default')
+    parser.add_argument('--user', help='Jira user name, spooled one by default')
+    parser.add_argument('--password', help='Jira password, ZEPHYR_PASSWD environment variable by default')
+    parser.add_argument('--workers', type=int, default=4, help='number of robot files reported concurrently')
+    parser.add_argument('--retries', type=int, default=3, help='number of retries of failed job')
+    parser.add_argument('--lookup-cache', help='lookup cache file, see ZephyrLibrary `lookup_cache` setting')
+    parser.add_argument('--link-cache', help='link cache file, see ZephyrLibrary `link_cache` setting')
+    parser.add_argument('--link-cache-ttl', type=float, default=_DEFAULT_LINK_CACHE_TTL,
+                        help='time in seconds link cache entries are valid')
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.lookup_cache:
+        _LOOKUPS.load(args.lookup_cache)
+    if args.link_cache:
+        _LINK_FINGERPRINTS.load(args.link_cache, args.link_cache_ttl)
+    failed = replay(args.spool, args.url, args.user, args.password, args.workers, args.retries)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,7 +21,8 @@ class ZephyrMock(_Zephyr):
 def _bootstrap_robot():
     BuiltIn()
     v = Variables()
-    v['${zephyr}'] = Dotable.parse({'baseURL': 'qwe', 'user': 'qwe', 'passwd': 'qwe', 'project_key': 'TEST', 'custom_field_id': 'custom_field_id'})
+    v['${zephyr}'] = Dotable.parse({'baseURL': 'qwe', 'user': 'qwe', 'passwd': 'qwe', 'project_key': 'TEST', 'custom_field_id': 'custom_field_id',
+                                        'workers': 0})
     v['${/}'] = '/'
     EXECUTION_CONTEXTS.start_suite(Namespace(TestSuite(), v, None, [], []), 'qwe')
 
@@ -63,6 +64,21 @@ def test_windows_paths():
     l.end_suite('test', {'longname': '', 'doc': '', 'status': '', 'statistics': '', 'source': 'C:\\Program Files\\Asd', 'metadata': {}})
 
 
+def test_cached_metadata():
+    ctx = ZephyrLibrary._MetadataContext()
+    ctx.put('/home/asd', {'test': 'test'})
+    ctx.put('/home/asd/qwe.robot', {'test1': 'test1'})
+
+    metadata = ctx.lookup('/home/asd/qwe.robot')
+    metadata['test'] = 'changed'
+    assert ctx.lookup('/home/asd/qwe.robot') == {'test': 'test', 'test1': 'test1'}
+
+    ctx.put_all([('/home/asd', {'test': 'test2'}), ('/home/asd/asd.robot', {})])
+    assert ctx.lookup('/home/asd/qwe.robot') == {'test': 'test2', 'test1': 'test1'}
+    assert ctx.lookup('/home/asd/missing/zxc.robot') == {'test': 'test2'}
+    assert ctx.lookup('/home/asd/asd.robot') == {'test': 'test2'}
+
+
 if __name__ == '__main__':
 
     #print l.__default_zephyr._zephyr_find_test( "http://0.0.0.0.0:48080", 'divya', "automation", "10100", "zephyr\zephyrTest.robot", "TP")
@@ -76,3 +92,4 @@ if __name__ == '__main__':
 
     test_paths()
     test_windows_paths()
+    test_cached_metadata()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+from xml.etree.cElementTree import parse
+
+from robot.api import ExecutionResult
+
+from .output_splitter import split_output
+
+_OUTPUT = '''<?xml version="1.0" encoding="UTF-8"?>
+<robot rpa="false" generated="20200101 10:00:00.000" generator="Robot 3.2.2 (Python 2.7.18 on linux2)">
+<suite source="/tests/Top" id="s1" name="Top">
+<kw type="setup" name="Log" library="BuiltIn">
+<msg timestamp="20200101 10:00:00.010" level="INFO">top setup</msg>
+<status status="PASS" endtime="20200101 10:00:00.010" starttime="20200101 10:00:00.010"></status>
+</kw>
+<suite source="/tests/Top/First.robot" id="s1-s1" name="First">
+<kw type="setup" name="Log" library="BuiltIn">
+<msg timestamp="20200101 10:00:00.020" level="INFO">first setup</msg>
+<status status="PASS" endtime="20200101 10:00:00.020" starttime="20200101 10:00:00.020"></status>
+</kw>
+<test id="s1-s1-t1" name="Passing">
+<kw name="Log" library="BuiltIn">
+<msg timestamp="20200101 10:00:00.030" level="INFO">pass</msg>
+<status status="PASS" endtime="20200101 10:00:00.030" starttime="20200101 10:00:00.030"></status>
+</kw>
+<doc>Passing test</doc>
+<status status="PASS" endtime="20200101 10:00:00.030" critical="yes" starttime="20200101 10:00:00.030"></status>
+</test>
+<test id="s1-s1-t2" name="Failing">
+<kw name="Fail" library="BuiltIn">
+<msg timestamp="20200101 10:00:00.040" level="FAIL">failed</msg>
+<status status="FAIL" endtime="20200101 10:00:00.040" starttime="20200101 10:00:00.040"></status>
+</kw>
+<status status="FAIL" endtime="20200101 10:00:00.040" critical="yes" starttime="20200101 10:00:00.040">failed</status>
+</test>
+<kw type="teardown" name="Log" library="BuiltIn">
+<msg timestamp="20200101 10:00:00.050" level="INFO">first teardown</msg>
+<status status="PASS" endtime="20200101 10:00:00.050" starttime="20200101 10:00:00.050"></status>
+</kw>
+<doc>First suite</doc>
+<metadata>
+<item name="Owner">qa</item>
+</metadata>
+<status status="FAIL" endtime="20200101 10:00:00.050" starttime="20200101 10:00:00.020"></status>
+</suite>
+<suite source="/tests/Top/Second.robot" id="s1-s2" name="Second">
+<test id="s1-s2-t1" name="Other">
+<kw name="No Operation" library="BuiltIn">
+<status status="PASS" endtime="20200101 10:00:00.060" starttime="20200101 10:00:00.060"></status>
+</kw>
+<status status="PASS" endtime="20200101 10:00:00.060" critical="yes" starttime="20200101 10:00:00.060"></status>
+</test>
+<status status="PASS" endtime="20200101 10:00:00.060" starttime="20200101 10:00:00.060"></status>
+</suite>
+<doc>Top suite</doc>
+<metadata>
+<item name="Version">1.0</item>
+</metadata>
+<status status="FAIL" endtime="20200101 10:00:00.070" starttime="20200101 10:00:00.000"></status>
+</suite>
+<statistics>
+<total>
+<stat fail="1" pass="2">Critical Tests</stat>
+<stat fail="1" pass="2">All Tests</stat>
+</total>
+<tag>
+</tag>
+<suite>
+<stat fail="1" id="s1" name="Top" pass="2">Top</stat>
+<stat fail="1" id="s1-s1" name="First" pass="1">Top.First</stat>
+<stat fail="0" id="s1-s2" name="Second" pass="1">Top.Second</stat>
+</suite>
+</statistics>
+<errors>
+</errors>
+</robot>
+'''
+
+
+def _split(names):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'output.xml')
+        with open(path, 'w') as f:
+            f.write(_OUTPUT)
+        outputs = split_output(path, names, directory)
+        assert sorted(os.listdir(directory)) == sorted(['output.xml'] + [os.path.basename(p) for p in outputs.values()])
+        return dict((name, (parse(output).getroot(), ExecutionResult(output).suite))
+                    for name, output in outputs.iteritems())
+    finally:
+        shutil.rmtree(directory)
+
+
+def _suite_parts(suite):
+    return {
+        'setup': [kw.find('msg').text for kw in suite.findall('kw') if kw.get('type') == 'setup'],
+        'teardown': [kw.find('msg').text for kw in suite.findall('kw') if kw.get('type') == 'teardown'],
+        'doc': suite.findtext('doc'),
+        'metadata': dict((item.get('name'), item.text) for item in suite.findall('metadata/item')),
+        'status': suite.find('status').attrib,
+        'suites': [s.get('name') for s in suite.findall('suite')],
+        'tests': [t.get('name') for t in suite.findall('test')],
+    }
+
+
+def test_suites_are_kept_around_selected_tests():
+    outputs = _split(['Top.First.Passing', 'Other', 'Missing'])
+    assert sorted(outputs) == ['Other', 'Top.First.Passing'], 'Names not matching any test are missing'
+
+    root, result = outputs['Top.First.Passing']
+    top = _suite_parts(root.find('suite'))
+    assert top == {'setup': ['top setup'], 'teardown': [], 'doc': 'Top suite', 'metadata': {'Version': '1.0'},
+                   'status': {'status': 'FAIL', 'starttime': '20200101 10:00:00.000',
+                              'endtime': '20200101 10:00:00.070'},
+                   'suites': ['First'], 'tests': []}
+    first = _suite_parts(root.find('suite/suite'))
+    assert first == {'setup': ['first setup'], 'teardown': ['first teardown'], 'doc': 'First suite',
+                     'metadata': {'Owner': 'qa'},
+                     'status': {'status': 'FAIL', 'starttime': '20200101 10:00:00.020',
+                                'endtime': '20200101 10:00:00.050'},
+                     'suites': [], 'tests': ['Passing']}
+    test = root.find('suite/suite/test')
+    assert (test.findtext('doc'), test.find('status').get('status')) == ('Passing test', 'PASS')
+    assert root.find('statistics') is None and root.find('errors') is None, 'Rebot generates these again'
+    assert [t.longname for suite in result.suites for t in suite.tests] == ['Top.First.Passing']
+    assert result.metadata == {'Version': '1.0'} and result.suites[0].metadata == {'Owner': 'qa'}
+
+    root, result = outputs['Other']
+    assert _suite_parts(root.find('suite'))['suites'] == ['Second']
+    second = _suite_parts(root.find('suite/suite'))
+    assert (second['setup'], second['teardown'], second['tests']) == ([], [], ['Other'])
+    assert [t.longname for suite in result.suites for t in suite.tests] == ['Top.Second.Other']
+
+
+def test_suites_are_written_once_for_consecutive_tests():
+    root, result = _split(['Top.First.*'])['Top.First.*']
+    assert len(root.findall('suite/suite')) == 1
+    assert _suite_parts(root.find('suite/suite'))['tests'] == ['Passing', 'Failing']
+    assert [(t.name, t.status) for t in result.suites[0].tests] == [('Passing', 'PASS'), ('Failing', 'FAIL')]
+
+
+if __name__ == '__main__':
+    test_suites_are_kept_around_selected_tests()
+    test_suites_are_written_once_for_consecutive_tests()
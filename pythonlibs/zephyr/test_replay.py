@@ -0,0 +1,252 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+
+from robot.libraries.BuiltIn import EXECUTION_CONTEXTS
+from robot.running.namespace import Namespace
+from robot.running.model import TestSuite
+from robot.variables import VariableScopes
+from robot.conf import RobotSettings
+
+from Dotable import Dotable
+from . import replay
+from .ZephyrLibrary import ZephyrLibrary as ZL, _Zephyr, _JIRA
+
+
+class JiraStub(object):
+    '''
+    Jira with Zephyr REST API keeping just enough state to report a test suite.
+    '''
+
+    def __init__(self):
+        self.calls = []
+        self.issues = {}
+        self.cycles = {}
+        self.executions = {}
+        self.steps = {}
+        self.step_results = {}
+        self.fail = 0
+        self._id = 100
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            self._id += 1
+            return self._id
+
+    def handle(self, method, path, query, body):
+        self.calls.append((method, path))
+        if self.fail:
+            self.fail -= 1
+            return 503, {'errorMessages': ['busy']}
+        if path == '/rest/api/2/search':
+            issues = [{'key': k, 'id': v['id'], 'fields': v['fields']} for k, v in self.issues.items()]
+            match = re.search(r"~'(.*?)'", query.get('jql', [''])[0])
+            if match:
+                issues = [i for i in issues if any(match.group(1) == str(v) for v in i['fields'].values())]
+            return 200, {'total': len(issues), 'startAt': 0, 'maxResults': 50, 'issues': issues}
+        if path == '/rest/api/2/issue':
+            key = 'TP-%d' % self.next_id()
+            body['fields'].setdefault('issuelinks', [])
+            self.issues[key] = {'id': str(self.next_id()), 'fields': body['fields']}
+            return 201, {'key': key, 'id': self.issues[key]['id']}
+        match = re.match(r'/rest/api/2/issue/([A-Z]+-\d+)$', path)
+        if match:
+            issue = self.issues.get(match.group(1))
+            if issue is None:
+                return 404, {}
+            if method == 'PUT':
+                issue['fields'].update(body['fields'])
+                return 204, None
+            return 200, {'id': issue['id'], 'key': match.group(1), 'fields': issue['fields']}
+        if path == '/rest/api/2/issueLink':
+            return 201, None
+        if path == '/rest/api/2/project':
+            return 200, [{'name': 'Test Project', 'key': 'TP', 'id': '10000'}]
+        if re.match(r'/rest/api/2/project/\w+/versions$', path):
+            return 200, [{'name': '1.0', 'id': '500'}]
+        if re.match(r'/rest/api/2/project/\w+$', path):
+            return 200, {'id': '10000', 'key': 'TP'}
+        if path == '/rest/zapi/latest/cycle':
+            if method == 'POST':
+                cycle_id = str(self.next_id())
+                self.cycles[cycle_id] = body
+                return 200, {'id': cycle_id}
+            cycles = dict(self.cycles)
+            cycles['recordsCount'] = len(self.cycles)
+            return 200, cycles
+        if path == '/rest/zapi/latest/execution':
+            if method == 'POST':
+                execution_id = str(self.next_id())
+                body['executionStatus'] = '-1'
+                self.executions[execution_id] = body
+                self.step_results[execution_id] = [{'id': self.next_id(), 'stepId': step['id'], 'status': -1}
+                                                   for step in self.steps.get(body['issueId'], [])]
+                return 200, {execution_id: body}
+            issue_id = query['issueId'][0]
+            return 200, {'executions': [{'id': int(k), 'cycleId': v['cycleId'], 'versionId': v['versionId'],
+                                         'executionStatus': v['executionStatus']}
+                                        for k, v in self.executions.items() if v['issueId'] == issue_id]}
+        match = re.match(r'/rest/zapi/latest/execution/(\d+)(/execute)?$', path)
+        if match:
+            if method == 'DELETE':
+                self.executions.pop(match.group(1), None)
+                return 200, {'success': True}
+            self.executions[match.group(1)]['executionStatus'] = str(body['status'])
+            return 200, {'id': int(match.group(1))}
+        match = re.match(r'/rest/zapi/latest/teststep/(\d+)(?:/(\d+))?$', path)
+        if match:
+            steps = self.steps.setdefault(match.group(1), [])
+            if method == 'GET':
+                return 200, steps
+            if match.group(2):
+                for step in steps:
+                    if str(step['id']) == match.group(2):
+                        step.update(body)
+                return 200, {'id': int(match.group(2))}
+            step = dict(body, id=self.next_id())
+            steps.append(step)
+            return 200, step
+        if path == '/rest/zapi/latest/stepResult':
+            return 200, self.step_results.get(query['executionId'][0], [])
+        match = re.match(r'/rest/zapi/latest/stepResult/(\d+)$', path)
+        if match:
+            return 200, {'id': int(match.group(1))}
+        if path == '/rest/zapi/latest/attachment':
+            return 200, {}
+        return 404, {'path': path}
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                data = self.rfile.read(length) if length else ''
+                body = json.loads(data) if data.startswith('{') else None
+                status, result = stub.handle(self.command, url.path.rstrip('/'), parse_qs(url.query), body)
+                content = json.dumps(result) if result is not None else ''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _bootstrap_robot(base_url, **settings):
+    variables = VariableScopes(RobotSettings())
+    zephyr = {'baseURL': base_url, 'user': 'user', 'passwd': 'passwd', 'project_key': 'TP',
+              'custom_field_id': '100'}
+    zephyr.update(settings)
+    variables['${zephyr}'] = Dotable.parse(zephyr)
+    variables['${/}'] = '/'
+    # Connection settings are read once per process
+    _Zephyr.baseURL = ''
+    suite = TestSuite(name='test')
+    EXECUTION_CONTEXTS.start_suite(suite, Namespace(variables, suite, suite.resource), None)
+
+
+def _run_suite(listener, source, tests):
+    metadata = {'Issue Per': 'Test Case', 'Testcycle': 'Cycle', 'Version': '1.0'}
+    listener.start_suite('test', {'source': source, 'metadata': metadata})
+    for test in tests:
+        listener.start_test(test, {'tags': [], 'template': '', 'doc': '', 'longname': 'Test.' + test})
+        for keyword in ('Open', 'Check'):
+            listener.start_keyword(keyword, {'type': 'Keyword', 'args': []})
+            listener.end_keyword(keyword, {'type': 'Keyword', 'args': [], 'status': 'PASS', 'doc': ''})
+        listener.end_test(test, {'status': 'PASS', 'message': '', 'tags': []})
+    listener.end_suite('test', {'source': source, 'metadata': metadata, 'longname': 'Test', 'doc': '',
+                                'status': 'PASS', 'statistics': ''})
+
+
+def _spool_run(base_url, spool):
+    _bootstrap_robot(base_url, spool=spool, workers=0)
+    listener = ZL()
+    _run_suite(listener, '/tests/first.robot', ['test1', 'test2'])
+    _run_suite(listener, '/tests/second.robot', ['test3'])
+    listener.close()
+
+
+def test_spool():
+    stub = JiraStub()
+    base_url = stub.start()
+    directory = tempfile.mkdtemp()
+    try:
+        spool = os.path.join(directory, 'results.jsonl')
+        _spool_run(base_url, spool)
+        assert stub.calls == [], 'Nothing is sent to Jira while spooling'
+        jobs = replay.read_jobs(spool)
+        assert [job['args'][4] for job in jobs] == ['/tests/first.robot', '/tests/second.robot']
+        assert all(job['baseURL'] == base_url for job in jobs)
+    finally:
+        stub.stop()
+        shutil.rmtree(directory)
+
+
+def test_replay_retries_and_skips_reported_jobs():
+    stub = JiraStub()
+    base_url = stub.start()
+    directory = tempfile.mkdtemp()
+    retries, delay = _JIRA.retries, replay._RETRY_DELAY
+    try:
+        spool = os.path.join(directory, 'results.jsonl')
+        _spool_run(base_url, spool)
+        # Unavailable Jira is retried by replay itself, not by the client
+        _JIRA.retries = 0
+        replay._RETRY_DELAY = 0
+        stub.fail = 2
+        assert replay.main([spool, '--password', 'passwd', '--workers', '1']) == 0
+        assert len(stub.executions) == 3
+        assert sorted(s['executionStatus'] for s in stub.executions.values()) == ['1', '1', '1']
+        assert len(replay.read_done_ids(spool + '.done')) == 2
+
+        calls = len(stub.calls)
+        assert replay.main([spool, '--password', 'passwd']) == 0
+        assert len(stub.calls) == calls, 'Reported jobs are not reported again'
+
+        # Appended job of the same file is reported, the reported ones are not
+        with open(spool) as f:
+            job = json.loads(f.readline())
+        job['id'] = 'appended'
+        with open(spool, 'a') as f:
+            f.write(json.dumps(job) + '\n')
+        assert replay.main([spool, '--password', 'passwd']) == 0
+        assert len(stub.calls) > calls
+        assert len(stub.executions) == 3, 'Executions of reported tests are updated'
+        assert len(replay.read_done_ids(spool + '.done')) == 3
+    finally:
+        _JIRA.retries, replay._RETRY_DELAY = retries, delay
+        stub.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test_spool()
+    test_replay_retries_and_skips_reported_jobs()